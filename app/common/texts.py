@@ -16,20 +16,3 @@ RUSSIAN_MONTHS_GENITIVE = {
     1: "января", 2: "февраля", 3: "марта", 4: "апреля", 5: "мая", 6: "июня",
     7: "июля", 8: "августа", 9: "сентября", 10: "октября", 11: "ноября", 12: "декабря"
 }
-
-# Словарь с дополнительными услугами и их ценами из ТЗ (перенесен из client_kb.py)
-ADDITIONAL_SERVICES = {
-    "win": "🪞 Мойка окон (+300 ₽/шт)",
-    "sofa": "🛋 Химчистка дивана (+1500 ₽)",
-    "chair": "🪑 Химчистка стульев (+300 ₽/шт)",
-    "plumbing": "🚿 Чистка сантехники (+500 ₽)",
-    "bedding": "🛏 Замена постельного белья (+200 ₽)",
-    "kitchen": "🧴 Мытье кухонной техники (+600 ₽)",
-    "cabinets": "🧼 Чистка шкафчиков внутри (+500₽)",
-    "balcony": "🧯 Уборка балкона (+700 ₽)",
-    "carpet": "🧹 Чистка ковров (+800 ₽)",
-    "pets": "🐾 Удаление шерсти животных (+400 ₽)",
-    "fridge": "❄ Мойка холодильника (+700 ₽)",
-    "stove": "🍳 Мойка плиты (+500 ₽)",
-    "oven": "🔥 Мойка духовки (+700 ₽)",
-}
\ No newline at end of file
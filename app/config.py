@@ -14,6 +14,84 @@ class Bots:
 class ApiKeys:
     """Хранит ключи для внешних API."""
     yandex_api_key: str
+    geocoder_url: str
+
+@dataclass
+class HttpPool:
+    """Хранит настройки общего пула HTTP-соединений ботов с Telegram."""
+    limit: int
+    limit_per_host: int
+    keepalive_timeout: float
+    dns_ttl: int
+    request_timeout: float
+
+@dataclass
+class MediaCache:
+    """Хранит настройки локального кэша медиафайлов."""
+    directory: str
+    max_bytes: int
+
+@dataclass
+class Webhook:
+    """Хранит настройки режима вебхуков (вместо long polling)."""
+    enabled: bool
+    base_url: str | None
+    secret_token: str | None
+    host: str
+    port: int
+    max_in_flight: int  # Передается в setWebhook как max_connections, Telegram допускает 1-100
+
+@dataclass
+class Dispatch:
+    """Настройки рассылки предложений заказа исполнителям."""
+    strategy: str  # "sequential" - по одному исполнителю, "parallel" - сразу нескольким, "batch" - пакетами
+    top_k: int  # Сколько исполнителей получают предложение одновременно в режиме "parallel"
+    batch_interval_minutes: int  # Как часто запускать пакетное назначение (0 - только вручную из админки)
+
+@dataclass
+class Fsm:
+    """Хранит настройки хранилища состояний (FSM) ботов."""
+    # "memory" (по умолчанию, как было раньше) - только в памяти процесса;
+    # "postgres" - состояния переживают перезапуск (таблица fsm_storage); обязательно при CLUSTER_ENABLED
+    storage: str
+    user_budget_bytes: int  # Максимальный объем данных FSM одного пользователя
+    total_budget_bytes: int  # Максимальный объем данных FSM всех пользователей
+    janitor_interval_minutes: int  # Как часто убирать брошенные сценарии
+
+@dataclass
+class Updates:
+    """Хранит настройки обработки апдейтов."""
+    workers: int  # Сколько апдейтов разных пользователей обрабатывается одновременно
+
+@dataclass
+class Throttling:
+    """
+    Хранит лимиты частоты запросов пользователей (token bucket).
+    Выключено по умолчанию (THROTTLE_ENABLED=true включает). Лимиты по умолчанию рассчитаны так, чтобы
+    обычный пользователь в них не упирался: 30 нажатий подряд и 5 в секунду после этого, для дорогих
+    обработчиков (списки заказов, календарь, отчеты) - 10 подряд и 1 в секунду.
+    """
+    enabled: bool
+    rate: float  # Токенов в секунду для обычных обработчиков
+    burst: int  # Размер корзины для обычных обработчиков
+    expensive_rate: float  # То же для дорогих обработчиков (флаг throttling="expensive")
+    expensive_burst: int
+
+@dataclass
+class Shutdown:
+    """Хранит настройки остановки бота."""
+    drain_timeout: float  # Сколько секунд ждать апдейты и задачи, которые уже выполняются
+
+@dataclass
+class Monitoring:
+    """Хранит настройки вывода статистики сервисов."""
+    stats_interval_minutes: int  # Как часто писать статистику в лог (0 - только при остановке)
+
+@dataclass
+class Cluster:
+    """Хранит настройки запуска нескольких копий бота (процессов или реплик) с общей БД."""
+    enabled: bool
+    index_refresh_minutes: int  # Как часто перечитывать из БД индексы исполнителей и системные настройки в памяти
 
 @dataclass
 class System:
@@ -23,7 +101,6 @@ class System:
     test_mode_enabled: bool
     show_commission_to_executor: bool
     tariffs: Dict
-    additional_services: Dict
 
 @dataclass
 class Settings:
@@ -31,6 +108,16 @@ class Settings:
     bots: Bots
     api_keys: ApiKeys
     admin_id: int
+    http_pool: HttpPool
+    media_cache: MediaCache
+    webhook: Webhook
+    dispatch: Dispatch
+    fsm: Fsm
+    updates: Updates
+    throttling: Throttling
+    shutdown: Shutdown
+    cluster: Cluster
+    monitoring: Monitoring
     system: System = None # Будет загружен позже из БД
 
 def load_config(path: str = None):
@@ -47,6 +134,26 @@ def load_config(path: str = None):
     if not admin_id_str:
         raise ValueError("Переменная ADMIN_ID не найдена в файле .env")
 
+    webhook_enabled = os.getenv("WEBHOOK_ENABLED", "false").lower() in ("1", "true", "yes")
+    if webhook_enabled and not (os.getenv("WEBHOOK_BASE_URL") and os.getenv("WEBHOOK_SECRET")):
+        raise ValueError("Для режима вебхуков в файле .env нужны переменные WEBHOOK_BASE_URL и WEBHOOK_SECRET")
+
+    dispatch_strategy = os.getenv("ORDER_DISPATCH_STRATEGY", "sequential").lower()
+    if dispatch_strategy not in ("sequential", "parallel", "batch"):
+        raise ValueError("ORDER_DISPATCH_STRATEGY должна быть 'sequential', 'parallel' или 'batch'")
+    default_batch_interval = "10" if dispatch_strategy == "batch" else "0"
+
+    fsm_storage = os.getenv("FSM_STORAGE", "memory").lower()
+    if fsm_storage not in ("postgres", "memory"):
+        raise ValueError("FSM_STORAGE должна быть 'postgres' или 'memory'")
+
+    cluster_enabled = os.getenv("CLUSTER_ENABLED", "false").lower() in ("1", "true", "yes")
+    if cluster_enabled and not webhook_enabled:
+        # При long polling Telegram отдает апдейты только одному получателю на бота
+        raise ValueError("Для запуска нескольких копий бота нужен режим вебхуков (WEBHOOK_ENABLED=true)")
+    if cluster_enabled and fsm_storage != "postgres":
+        raise ValueError("Для запуска нескольких копий бота состояния FSM должны храниться в Postgres (FSM_STORAGE=postgres)")
+
     return Settings(
         bots=Bots(
             client_bot_token=os.getenv("CLIENT_BOT_TOKEN"),
@@ -54,7 +161,53 @@ def load_config(path: str = None):
             admin_bot_token=os.getenv("ADMIN_BOT_TOKEN"),
         ),
         api_keys=ApiKeys(
-            yandex_api_key=os.getenv("YANDEX_API_KEY")
+            yandex_api_key=os.getenv("YANDEX_API_KEY"),
+            # Можно указать адрес локального сервера-заглушки (app/services/geocoder_stub.py)
+            geocoder_url=os.getenv("GEOCODER_URL", "https://geocode-maps.yandex.ru/1.x/")
+        ),
+        admin_id=int(admin_id_str),
+        http_pool=HttpPool(
+            limit=int(os.getenv("BOT_HTTP_LIMIT", "100")),
+            limit_per_host=int(os.getenv("BOT_HTTP_LIMIT_PER_HOST", "50")),
+            keepalive_timeout=float(os.getenv("BOT_HTTP_KEEPALIVE", "60")),
+            dns_ttl=int(os.getenv("BOT_HTTP_DNS_TTL", "3600")),
+            request_timeout=float(os.getenv("BOT_HTTP_TIMEOUT", "60"))
+        ),
+        media_cache=MediaCache(
+            directory=os.getenv("MEDIA_CACHE_DIR", os.path.join(os.path.dirname(__file__), '..', 'media_cache')),
+            max_bytes=int(os.getenv("MEDIA_CACHE_MAX_MB", "512")) * 1024 * 1024
+        ),
+        webhook=Webhook(
+            enabled=webhook_enabled,
+            base_url=os.getenv("WEBHOOK_BASE_URL"),
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8080")),
+            max_in_flight=min(100, max(1, int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "40"))))
+        ),
+        dispatch=Dispatch(
+            strategy=dispatch_strategy,
+            top_k=max(1, int(os.getenv("ORDER_DISPATCH_TOP_K", "3"))),
+            batch_interval_minutes=max(0, int(os.getenv("ORDER_BATCH_INTERVAL_MINUTES", default_batch_interval)))
+        ),
+        fsm=Fsm(
+            storage=fsm_storage,
+            user_budget_bytes=int(os.getenv("FSM_USER_BUDGET_KB", "16")) * 1024,
+            total_budget_bytes=int(os.getenv("FSM_TOTAL_BUDGET_MB", "64")) * 1024 * 1024,
+            janitor_interval_minutes=max(1, int(os.getenv("FSM_JANITOR_INTERVAL_MINUTES", "30")))
+        ),
+        updates=Updates(workers=max(1, int(os.getenv("UPDATE_WORKERS", "32")))),
+        throttling=Throttling(
+            enabled=os.getenv("THROTTLE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            rate=float(os.getenv("THROTTLE_RATE", "5")),
+            burst=max(1, int(os.getenv("THROTTLE_BURST", "30"))),
+            expensive_rate=float(os.getenv("THROTTLE_EXPENSIVE_RATE", "1")),
+            expensive_burst=max(1, int(os.getenv("THROTTLE_EXPENSIVE_BURST", "10")))
+        ),
+        shutdown=Shutdown(drain_timeout=float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25"))),
+        cluster=Cluster(
+            enabled=cluster_enabled,
+            index_refresh_minutes=max(1, int(os.getenv("CLUSTER_INDEX_REFRESH_MINUTES", "5")))
         ),
-        admin_id=int(admin_id_str)
+        monitoring=Monitoring(stats_interval_minutes=max(0, int(os.getenv("STATS_LOG_INTERVAL_MINUTES", "15"))))
     )
\ No newline at end of file
@@ -2,7 +2,7 @@ from sqlalchemy.orm import declarative_base, relationship
 import datetime
 import enum
 from sqlalchemy import Column, Integer, String, BigInteger, \
-    Float, DateTime, Enum, ForeignKey, Boolean
+    Float, DateTime, Enum, ForeignKey, Boolean, UniqueConstraint
 from sqlalchemy.dialects.postgresql import ARRAY
 
 Base = declarative_base()
@@ -44,6 +44,11 @@ class User(Base):
     last_bonus_order_count = Column(Integer, default=0, nullable=False)
     priority = Column(Integer, default=0, nullable=False)  # Чем выше число, тем выше приоритет
 
+    # База исполнителя (откуда он выезжает на заказы) и радиус выезда в км
+    base_lat = Column(Float, nullable=True)
+    base_lon = Column(Float, nullable=True)
+    service_radius_km = Column(Float, nullable=True)
+
 class ServiceType(enum.Enum):
     base = "base"
     additional = "additional"
@@ -215,12 +220,34 @@ class OrderOffer(Base):
     executor_tg_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
     # Время, до которого исполнитель должен ответить
     expires_at = Column(DateTime, nullable=False)
-    # Статус предложения: active, accepted, expired, declined
+    # Статус предложения: active, accepted, expired, declined, revoked
     status = Column(String, default='active', nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    # Сообщение с предложением в чате исполнителя (чтобы отозвать его, если заказ принял другой)
+    message_id = Column(BigInteger, nullable=True)
+    # Стратегия рассылки, по которой отправлено предложение: sequential или parallel
+    strategy = Column(String, nullable=True)
 
     order = relationship("Order")
     executor = relationship("User")
 
+class ExecutorSlotBooking(Base):
+    """
+    Занятость исполнителя активным заказом (accepted, pending_confirmation, on_the_way, in_progress).
+    Уникальное ограничение не дает назначить исполнителю два заказа на одни и те же дату и слот.
+    """
+    __tablename__ = 'executor_slot_bookings'
+    __table_args__ = (
+        UniqueConstraint('executor_tg_id', 'scheduled_date', 'slot', name='uq_executor_slot_booking'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('orders.id'), unique=True, nullable=False)
+    executor_tg_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
+    scheduled_date = Column(String, nullable=False)
+    slot = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
 class SystemSettings(Base):
     __tablename__ = 'system_settings'
 
@@ -234,4 +261,83 @@ class SystemSettings(Base):
     additional_services = Column(String, default='{}')
 
 # Добавляем поле is_test в модель Order
-Order.is_test = Column(Boolean, default=False, nullable=False)
\ No newline at end of file
+Order.is_test = Column(Boolean, default=False, nullable=False)
+
+# Колонки, добавленные в уже существующие таблицы: create_all их не создает, поэтому при старте
+# они добавляются этими командами (каждая безопасна при повторном выполнении)
+SCHEMA_UPGRADES = (
+    "ALTER TABLE order_offers ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE order_offers ADD COLUMN IF NOT EXISTS message_id BIGINT",
+    "ALTER TABLE order_offers ADD COLUMN IF NOT EXISTS strategy VARCHAR",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS base_lat DOUBLE PRECISION",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS base_lon DOUBLE PRECISION",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS service_radius_km DOUBLE PRECISION",
+    "ALTER TABLE order_financial_snapshots ADD COLUMN IF NOT EXISTS manual_payment BOOLEAN NOT NULL DEFAULT FALSE",
+)
+
+class FsmRecord(Base):
+    """
+    Состояние и данные FSM одного пользователя в одном боте.
+    Таблица UNLOGGED: записи не идут в WAL и потому дешевле, но после аварийной остановки Postgres она очищается.
+    """
+    __tablename__ = 'fsm_storage'
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    key = Column(String, primary_key=True)  # bot_id:chat_id:user_id:thread_id:business_connection_id:destiny
+    state = Column(String, nullable=True)
+    data = Column(String, nullable=False, default='{}')  # Компактный JSON
+    updated_at = Column(DateTime, nullable=False, default=datetime.datetime.now)
+    expires_at = Column(DateTime, nullable=True, index=True)  # Когда брошенный сценарий считается устаревшим
+
+class SchedulerJobState(Base):
+    """Состояние периодической задачи планировщика, общее для всех копий бота и переживающее перезапуск."""
+    __tablename__ = 'scheduler_job_state'
+
+    job_name = Column(String, primary_key=True)
+    last_run_at = Column(DateTime, nullable=False)  # До какого момента (местное время) задача уже отработала
+
+class MediaRelayCache(Base):
+    """Кэш пересылки медиа между ботами: file_id, полученный целевым ботом после первой загрузки."""
+    __tablename__ = 'media_relay_cache'
+    __table_args__ = (
+        UniqueConstraint('source_bot_id', 'file_unique_id', 'target_bot_id', name='uq_media_relay_key'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    source_bot_id = Column(BigInteger, nullable=False) # ID бота, через которого файл был получен
+    file_unique_id = Column(String, nullable=False) # Постоянный идентификатор файла (одинаков для всех ботов)
+    target_bot_id = Column(BigInteger, nullable=False) # ID бота, в который файл был загружен
+    target_file_id = Column(String, nullable=False) # file_id, пригодный для отправки через целевого бота
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    last_used_at = Column(DateTime, default=datetime.datetime.now, index=True) # Для вытеснения по LRU
+
+class GeocodeCache(Base):
+    """Постоянный кэш ответов геокодера."""
+    __tablename__ = 'geocode_cache'
+
+    id = Column(Integer, primary_key=True)
+    query_key = Column(String, nullable=False, unique=True) # Нормализованный адрес или округленные координаты
+    address = Column(String, nullable=False) # Адрес, который вернул геокодер
+    created_at = Column(DateTime, default=datetime.datetime.now, index=True) # Для вытеснения по TTL
+
+class OrderFinancialSnapshot(Base):
+    """
+    Неизменяемый финансовый снимок версии заказа: цена, условия комиссии, выплата и бонусы.
+    Записывается при создании и каждом изменении заказа; строки никогда не обновляются.
+    """
+    __tablename__ = 'order_financial_snapshots'
+    __table_args__ = (
+        UniqueConstraint('order_id', 'version', name='uq_order_financial_version'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False, index=True)
+    version = Column(Integer, nullable=False) # Номер версии заказа, начиная с 1
+    total_price = Column(Float, nullable=False) # Цена для клиента
+    commission_type = Column(String, nullable=False) # "percent" или "fixed" на момент записи
+    commission_value = Column(Float, nullable=False)
+    executor_payment = Column(Float, nullable=False) # Выплата исполнителю
+    bonus = Column(Float, default=0.0, nullable=False) # Бонусы исполнителю по заказу (переходят в следующие версии)
+    manual_payment = Column(Boolean, default=False, nullable=False) # Выплату задал администратор - пересчет ее не меняет
+    reason = Column(String, nullable=True) # Что привело к новой версии
+    created_at = Column(DateTime, default=datetime.datetime.now)
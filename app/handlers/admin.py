@@ -1,11 +1,11 @@
 import logging
+import html
 import io
 from contextlib import suppress
 from openpyxl import Workbook
 from openpyxl.styles import Font
 import datetime
 import json
-import re
 from aiogram import F, Router, types, Bot
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, StateFilter
@@ -13,21 +13,29 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import BufferedInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app.services.yandex_maps_api import get_address_from_coords, get_address_from_text
+from app.services.geocoder import GeocoderUnavailable
+from app.services.media_relay import relay_photo
 from app.keyboards.client_kb import (
     get_additional_services_keyboard, create_calendar, get_time_keyboard,
     get_address_keyboard, get_address_confirmation_keyboard,
     get_room_count_keyboard, get_bathroom_count_keyboard, get_exit_chat_keyboard, get_reply_to_chat_keyboard
 )
-from app.services.price_calculator import calculate_preliminary_cost, calculate_total_cost, calculate_executor_payment
+from app.services.price_calculator import calculate_preliminary_cost, calculate_total_cost, \
+    rebuild_pricing_engine
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.keyboards.executor_kb import get_order_changes_confirmation_keyboard
 from app.services.db_queries import update_system_settings
+from app.services.service_catalog import get_service_catalog, set_service_catalog
+from app.services.repricing import reprice_open_orders, notify_repriced_orders
+from app.services.dispatch import DISPATCH_MANUAL, dispatch_metrics, revoke_offer_messages, start_batch_assignment
+from app.services.occupancy import SlotConflictError
 from app.database.models import TicketStatus, MessageAuthor, UserRole, OrderStatus, Order, User, UserStatus, OrderLog
-from app.common.texts import STATUS_MAPPING, ADDITIONAL_SERVICES, RUSSIAN_MONTHS_GENITIVE
+from app.common.texts import STATUS_MAPPING, RUSSIAN_MONTHS_GENITIVE
 from app.config import Settings
 from app.services.db_queries import (
-    get_user,update_user_role,
+    get_users_by_ids,
+    get_user,update_user_role, get_order_financial_snapshot, close_order_offers,
     assign_supervisor_to_executor, get_all_supervisors,
     block_executor_by_admin,
     unblock_executor_by_admin,
@@ -72,18 +80,8 @@ from app.keyboards.admin_kb import (
     get_statistics_menu_keyboard, get_manage_access_keyboard,get_cancel_editing_tariff_keyboard,
     get_supervisors_list_keyboard, get_admin_list_keyboard,
     get_admin_settings_keyboard, get_tariff_management_keyboard, get_main_tariffs_keyboard,
-    get_additional_services_edit_keyboard, get_commission_management_keyboard
+    get_additional_services_edit_keyboard, get_commission_management_keyboard, get_repricing_confirmation_keyboard
 )
-def calculate_price_from_service_string(service_string: str) -> int:
-    """Извлекает числовую цену из строки услуги с помощью регулярного выражения."""
-    if not service_string:
-        return 0
-    # Ищем числа внутри скобок
-    match = re.search(r'\(.*?\+(\d+)', service_string)
-    if match:
-        return int(match.group(1))
-    return 0
-
 router = Router()
 
 @router.message(CommandStart())
@@ -182,17 +180,15 @@ async def view_ticket_admin(callback: types.CallbackQuery, session: AsyncSession
     if photo_id:
         try:
             client_bot = bots["client"]
-            photo_file = await client_bot.get_file(photo_id)
-            photo_bytes_io = await client_bot.download_file(photo_file.file_path)
-            photo_bytes = photo_bytes_io.read()
-
-            photo_to_send = BufferedInputFile(photo_bytes, filename="photo.jpg")
-
             await callback.message.delete()
-            await callback.message.answer_photo(
-                photo=photo_to_send,
-                caption=history,
-                reply_markup=reply_markup
+            await relay_photo(
+                session, client_bot, callback.bot,
+                file_id=photo_id,
+                send=lambda photo: callback.message.answer_photo(
+                    photo=photo,
+                    caption=history,
+                    reply_markup=reply_markup
+                )
             )
         except Exception:
             # Если что-то пошло не так, просто отправим текст, чтобы не было ошибки
@@ -294,13 +290,14 @@ async def admin_reply_finish(message: types.Message, state: FSMContext, session:
 
     try:
         if original_photo_id:
-            photo_file = await admin_bot.get_file(original_photo_id)
-            photo_bytes_io = await admin_bot.download_file(photo_file.file_path)
-            photo_to_send = BufferedInputFile(photo_bytes_io.read(), filename="photo.jpg")
-
-            sent_message = await client_bot.send_photo(
-                ticket.user_tg_id, photo=photo_to_send,
-                caption=client_message_text, reply_markup=go_to_ticket_keyboard
+            sent_message = await relay_photo(
+                session, admin_bot, client_bot,
+                file_id=original_photo_id,
+                file_unique_id=message.photo[-1].file_unique_id,
+                send=lambda photo: client_bot.send_photo(
+                    ticket.user_tg_id, photo=photo,
+                    caption=client_message_text, reply_markup=go_to_ticket_keyboard
+                )
             )
             new_photo_id_for_db = sent_message.photo[-1].file_id
         else:
@@ -340,10 +337,11 @@ async def admin_reply_finish(message: types.Message, state: FSMContext, session:
     if photo_id_for_admin_view:
         try:
             # Все file_id в базе теперь доступны через client_bot
-            photo_file = await client_bot.get_file(photo_id_for_admin_view)
-            photo_bytes_io = await client_bot.download_file(photo_file.file_path)
-            photo_to_send = BufferedInputFile(photo_bytes_io.read(), filename="photo.jpg")
-            await message.answer_photo(photo=photo_to_send, caption=history, reply_markup=reply_markup)
+            await relay_photo(
+                session, client_bot, message.bot,
+                file_id=photo_id_for_admin_view,
+                send=lambda photo: message.answer_photo(photo=photo, caption=history, reply_markup=reply_markup)
+            )
         except TelegramBadRequest:
             await message.answer(history, reply_markup=reply_markup)
     else:
@@ -405,7 +403,7 @@ async def manage_executors(message: types.Message, session: AsyncSession, state:
         return
 
     await state.set_state(AdminExecutorStates.viewing_executors)
-    await state.update_data(executors_list=executors_to_show)
+    await state.update_data(executors_list=[executor.telegram_id for executor in executors_to_show])
 
     await message.answer(
         "📋 <b>Список исполнителей:</b>",
@@ -413,11 +411,12 @@ async def manage_executors(message: types.Message, session: AsyncSession, state:
     )
 
 @router.callback_query(AdminExecutorStates.viewing_executors, F.data.startswith("admin_executors_page:"))
-async def admin_executors_page(callback: types.CallbackQuery, state: FSMContext):
+async def admin_executors_page(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
     """Обрабатывает переключение страниц в списке исполнителей."""
     page = int(callback.data.split(":")[1])
     user_data = await state.get_data()
-    executors = user_data.get("executors_list", [])
+    # В состоянии хранятся только ID, сами исполнители перечитываются из БД
+    executors = await get_users_by_ids(session, user_data.get("executors_list", []))
 
     await callback.message.edit_reply_markup(
         reply_markup=get_executors_list_keyboard(executors, page=page)
@@ -524,8 +523,9 @@ async def show_top_services(callback: types.CallbackQuery, session: AsyncSession
     if not top_services:
         text = "➕ <b>Топ дополнительных услуг:</b>\n\nЕще не было заказано ни одной дополнительной услуги."
     else:
+        catalog = get_service_catalog()
         services_list = [
-            f"{i + 1}. {ADDITIONAL_SERVICES.get(key, key).split('(')[0].strip()} - {count} раз"
+            f"{i + 1}. {catalog.title(key)} - {count} раз"
             for i, (key, count) in enumerate(top_services)
         ]
         text = "➕ <b>Топ дополнительных услуг:</b>\n\n" + "\n".join(services_list)
@@ -572,6 +572,34 @@ async def back_to_manage_orders(callback: types.CallbackQuery, session: AsyncSes
     await callback.answer()
 
 
+@router.callback_query(F.data == "admin_batch_assign")
+async def batch_assign_orders(callback: types.CallbackQuery, session_pool, bots: dict, config: Settings):
+    """
+    Запускает в фоне распределение всех новых заказов без активных предложений по оптимальному плану.
+    Рассылка может занять минуты, поэтому итог приходит отдельным сообщением.
+    """
+    async def report(result: tuple[int, int] | None):
+        if result is None:
+            text = "⏳ Распределение заказов уже выполняется, дождитесь его завершения."
+        elif not result[0]:
+            text = "Нет новых заказов, ожидающих распределения."
+        else:
+            orders_count, offers_count = result
+            text = (
+                f"🧮 <b>Пакетное распределение</b>\n\n"
+                f"Заказов без предложений: {orders_count}\n"
+                f"Отправлено предложений: {offers_count}"
+            )
+            if offers_count < orders_count:
+                text += f"\nНе удалось подобрать исполнителя: {orders_count - offers_count} (назначьте вручную)"
+        await callback.message.answer(text)
+
+    if start_batch_assignment(session_pool, bots["executor"], config, on_done=report):
+        await callback.answer("Распределяю заказы, итог пришлю сообщением...")
+    else:
+        await callback.answer("Распределение уже выполняется.", show_alert=True)
+
+
 @router.callback_query(F.data.startswith("admin_orders:"))
 async def list_orders_by_status(callback: types.CallbackQuery, session: AsyncSession, config: Settings):
     """Показывает список заказов в зависимости от выбранного статуса и роли."""
@@ -647,19 +675,16 @@ async def view_order_admin(callback: types.CallbackQuery, session: AsyncSession)
         executor_info = f"{order.executor.name} ({identifier})"
 
     services_list = []
+    catalog = get_service_catalog()
     for item in order.items:
-        service_name = ADDITIONAL_SERVICES.get(item.service_key, "Неизвестная услуга")
-        if "шт" in service_name and item.quantity > 1:
-            services_list.append(f"  - {service_name} (x{item.quantity})")
-        else:
-            services_list.append(f"  - {service_name}")
+        services_list.append(f"  - {catalog.format_item(item.service_key, item.quantity)}")
     services_text = "\n".join(services_list) or "Нет"
 
     # --- НОВЫЙ БЛОК: Формирование истории заказа ---
     logs_list = []
     if order.logs:
         for log in sorted(order.logs, key=lambda x: x.timestamp):
-            logs_list.append(f"  - {log.timestamp.strftime('%d.%m %H:%M')}: {log.message}")
+            logs_list.append(f"  - {log.timestamp.strftime('%d.%m %H:%M')}: {html.escape(log.message)}")
     logs_text = "\n".join(logs_list) or "Нет записей"
 
 
@@ -679,14 +704,16 @@ async def assign_executor_start(callback: types.CallbackQuery, session: AsyncSes
         return
 
     # Находим подходящих исполнителей
-    executors = await get_matching_executors(session, order.selected_date, order.selected_time)
+    executors = await get_matching_executors(
+        session, order.selected_date, order.selected_time, order.address_lat, order.address_lon
+    )
     if not executors:
         await callback.answer("Подходящих исполнителей не найдено.", show_alert=True)
         return
 
     # Сохраняем найденных исполнителей в состояние для пагинации
     await state.set_state(AdminOrderStates.assigning_executor)
-    await state.update_data(executors_to_assign=executors)
+    await state.update_data(executors_to_assign=[executor.telegram_id for executor in executors])
 
     await callback.message.edit_text(
         f"👤 <b>Выберите исполнителя для заказа №{order_id}:</b>",
@@ -696,14 +723,14 @@ async def assign_executor_start(callback: types.CallbackQuery, session: AsyncSes
 
 
 @router.callback_query(AdminOrderStates.assigning_executor, F.data.startswith("admin_assign_page:"))
-async def assign_executor_page(callback: types.CallbackQuery, state: FSMContext):
+async def assign_executor_page(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
     """Обрабатывает переключение страниц в списке исполнителей."""
     _, order_id_str, page_str = callback.data.split(":")
     order_id = int(order_id_str)
     page = int(page_str)
 
     user_data = await state.get_data()
-    executors = user_data.get("executors_to_assign", [])
+    executors = await get_users_by_ids(session, user_data.get("executors_to_assign", []))
 
     await callback.message.edit_reply_markup(
         reply_markup=get_assign_executor_keyboard(executors, order_id, page=page)
@@ -751,18 +778,24 @@ async def assign_executor_finish(callback: types.CallbackQuery, session: AsyncSe
         await callback.answer("Заказ не найден.", show_alert=True)
         return
 
-    payment = calculate_executor_payment(
-        total_price=order.total_price,
-        commission_type=config.system.commission_type,
-        commission_value=config.system.commission_value
-    )
-
-    assigned_order = await assign_executor_to_order(session, order_id, executor_id, payment)
+    financials = await get_order_financial_snapshot(session, order)
+    try:
+        assigned_order = await assign_executor_to_order(session, order_id, executor_id, financials.executor_payment)
+    except SlotConflictError:
+        await callback.answer("У исполнителя уже есть заказ на эти дату и время.", show_alert=True)
+        return
 
     if assigned_order:
         session.add(OrderLog(order_id=order_id, message=f"👤 Администратор @{callback.from_user.username} назначил исполнителя"))
         await session.commit()
 
+        # Предложения, разосланные исполнителям, больше не актуальны
+        closed_offers = await close_order_offers(session, order_id, executor_id)
+        await revoke_offer_messages(bots["executor"], order_id, closed_offers)
+        dispatch_metrics.record_assignment(
+            DISPATCH_MANUAL, (datetime.datetime.now() - assigned_order.created_at).total_seconds()
+        )
+
         await callback.answer("Исполнитель успешно назначен!", show_alert=True)
         client_bot = bots.get("client")
         executor_bot = bots.get("executor")
@@ -1031,16 +1064,11 @@ async def done_additional_services_admin(callback: types.CallbackQuery, state: F
     if updated_order.executor_tg_id:
         await update_order_status(session, order_id, OrderStatus.pending_confirmation)
         try:
-            new_executor_payment = calculate_executor_payment(
-                total_price=new_price,
-                commission_type=config.system.commission_type,
-                commission_value=config.system.commission_value
-            )
             await bots["executor"].send_message(
                 chat_id=updated_order.executor_tg_id,
                 text=(
                     f"❗️ <b>Администратор изменил доп. услуги в заказе №{order_id}.</b>\n"
-                    f"Новая выплата: {new_executor_payment} ₽\n\n"
+                    f"Новая выплата: {updated_order.executor_payment} ₽\n\n"
                     "Пожалуйста, подтвердите, что вы готовы выполнить заказ с этими изменениями."
                 ),
                 reply_markup=get_order_changes_confirmation_keyboard(order_id)
@@ -1069,7 +1097,7 @@ async def edit_datetime_start_admin(callback: types.CallbackQuery, state: FSMCon
     await state.set_state(AdminOrderStates.editing_date)
     await callback.answer()
 
-@router.callback_query(AdminOrderStates.editing_date, F.data.startswith("month_nav:"))
+@router.callback_query(AdminOrderStates.editing_date, F.data.startswith("month_nav:"), flags={"throttling": "expensive"})
 async def process_calendar_navigation_admin(callback: types.CallbackQuery):
     """(Админ-панель) Обрабатывает навигацию по календарю."""
     try:
@@ -1115,11 +1143,20 @@ async def handle_time_selection_admin(message: types.Message, state: FSMContext,
     new_date = user_data.get("new_date")
     new_time = user_data.get("new_time")
 
-    updated_order = await update_order_datetime(
-        session, order_id, new_date, new_time,
-        admin_id=message.from_user.id,
-        admin_username=message.from_user.username or "admin"
-    )
+    try:
+        updated_order = await update_order_datetime(
+            session, order_id, new_date, new_time,
+            admin_id=message.from_user.id,
+            admin_username=message.from_user.username or "admin"
+        )
+    except SlotConflictError:
+        await message.answer(
+            "❌ У исполнителя этого заказа уже есть другой заказ на эти дату и время. "
+            "Выберите другое время или сначала снимите исполнителя.",
+            reply_markup=get_admin_main_keyboard()
+        )
+        await state.clear()
+        return
 
     if not updated_order:
         await message.answer("Произошла ошибка при обновлении заказа.", reply_markup=get_admin_main_keyboard())
@@ -1177,10 +1214,14 @@ async def edit_address_start_admin(callback: types.CallbackQuery, state: FSMCont
 
 
 @router.message(AdminOrderStates.editing_address, F.location)
-async def handle_address_location_admin(message: types.Message, state: FSMContext, config: Settings):
+async def handle_address_location_admin(message: types.Message, state: FSMContext, session: AsyncSession, config: Settings):
     """(Админ-панель) Обрабатывает геолокацию, получает адрес и просит подтверждения."""
     lat, lon = message.location.latitude, message.location.longitude
-    address_text = await get_address_from_coords(lat, lon, config.api_keys.yandex_api_key)
+    try:
+        address_text = await get_address_from_coords(lat, lon, config.api_keys.yandex_api_key, session)
+    except GeocoderUnavailable:
+        await message.answer("Сервис определения адреса временно недоступен. Пожалуйста, введите адрес вручную.")
+        return
 
     if address_text:
         await state.update_data(new_address_lat=lat, new_address_lon=lon, new_address_text=address_text)
@@ -1194,9 +1235,20 @@ async def handle_address_location_admin(message: types.Message, state: FSMContex
 
 
 @router.message(AdminOrderStates.editing_address, F.text)
-async def handle_address_text_admin(message: types.Message, state: FSMContext, config: Settings):
+async def handle_address_text_admin(message: types.Message, state: FSMContext, session: AsyncSession, config: Settings):
     """(Админ-панель) Обрабатывает текстовый адрес, проверяет его и просит подтверждения."""
-    validated_address = await get_address_from_text(message.text, config.api_keys.yandex_api_key)
+    try:
+        validated_address = await get_address_from_text(message.text, config.api_keys.yandex_api_key, session)
+    except GeocoderUnavailable:
+        # Проверить адрес не получилось - сохраняем его в том виде, как ввел администратор
+        await state.update_data(new_address_text=message.text, new_address_lat=None, new_address_lon=None)
+        await message.answer(
+            f"Сейчас не удается проверить адрес, он будет сохранен как есть: <b>{html.escape(message.text)}</b>.\nВсе верно?",
+            reply_markup=get_address_confirmation_keyboard()
+        )
+        await state.set_state(AdminOrderStates.confirming_edited_address)
+        return
+
     if validated_address:
         await state.update_data(new_address_text=validated_address, new_address_lat=None, new_address_lon=None)
         await message.answer(
@@ -1237,12 +1289,12 @@ async def handle_address_confirmation_admin(message: types.Message, state: FSMCo
     await bots["admin"].send_message(
         config.admin_id,
         f"✅ Администратор @{message.from_user.username} изменил адрес в заказе №{order_id}.\n"
-        f"Новый адрес: {new_address}"
+        f"Новый адрес: {html.escape(new_address)}"
     )
     await bots["client"].send_message(
         updated_order.client_tg_id,
         f"❗️ Администратор изменил адрес в вашем заказе №{order_id}.\n"
-        f"Новый адрес: <b>{new_address}</b>"
+        f"Новый адрес: <b>{html.escape(new_address)}</b>"
     )
 
     if updated_order.executor_tg_id:
@@ -1251,7 +1303,7 @@ async def handle_address_confirmation_admin(message: types.Message, state: FSMCo
             chat_id=updated_order.executor_tg_id,
             text=(
                 f"❗️ <b>Администратор изменил адрес в заказе №{order_id}.</b>\n"
-                f"Новый адрес: {new_address}\n\n"
+                f"Новый адрес: {html.escape(new_address)}\n\n"
                 "Пожалуйста, подтвердите, что вы готовы выполнить заказ с этими изменениями."
             ),
             reply_markup=get_order_changes_confirmation_keyboard(order_id)
@@ -1356,17 +1408,12 @@ async def handle_edit_bathroom_count_admin(message: types.Message, state: FSMCon
         )
         if updated_order.executor_tg_id:
             await update_order_status(session, order_id, OrderStatus.pending_confirmation)
-            new_executor_payment = calculate_executor_payment(
-                total_price=new_total_price,
-                commission_type=config.system.commission_type,
-                commission_value=config.system.commission_value
-            )
             await bots["executor"].send_message(
                 chat_id=updated_order.executor_tg_id,
                 text=(
                     f"❗️ <b>Администратор изменил параметры в заказе №{order_id}.</b>\n"
                     f"Новые параметры: {new_room_count} ком., {new_bathroom_count} с/у.\n"
-                    f"Новая выплата: {new_executor_payment} ₽\n\n"
+                    f"Новая выплата: {updated_order.executor_payment} ₽\n\n"
                     "Пожалуйста, подтвердите, что вы готовы выполнить заказ с этими изменениями."
                 ),
                 reply_markup=get_order_changes_confirmation_keyboard(order_id)
@@ -1474,7 +1521,7 @@ async def block_executor_finish_handler(callback: types.CallbackQuery, session:
 
         # Обновляем список исполнителей и возвращаемся к нему
         executors = await get_all_executors(session)
-        await state.update_data(executors_list=executors)
+        await state.update_data(executors_list=[executor.telegram_id for executor in executors])
         await callback.message.edit_text(
             "📋 <b>Список исполнителей:</b>",
             reply_markup=get_executors_list_keyboard(executors, page=page)
@@ -1501,7 +1548,7 @@ async def unblock_executor_handler(callback: types.CallbackQuery, session: Async
 
         # Обновляем список исполнителей и возвращаемся к нему
         executors = await get_all_executors(session)
-        await state.update_data(executors_list=executors)
+        await state.update_data(executors_list=[executor.telegram_id for executor in executors])
 
         await callback.message.edit_text(
             "📋 <b>Список исполнителей:</b>",
@@ -1875,7 +1922,7 @@ async def reports_menu(message: types.Message):
     )
 
 
-@router.callback_query(F.data.startswith("report:"))
+@router.callback_query(F.data.startswith("report:"), flags={"throttling": "expensive"})
 async def generate_report(callback: types.CallbackQuery, session: AsyncSession):
     """Генерирует и отправляет отчет по заказам в формате Excel."""
     period = callback.data.split(":")[1]
@@ -1941,7 +1988,7 @@ async def generate_report(callback: types.CallbackQuery, session: AsyncSession):
     report_file = BufferedInputFile(file_stream.read(), filename=f"report_{period}_{end_date.strftime('%Y-%m-%d')}.xlsx")
     await callback.message.answer_document(report_file, caption=f"Отчет по заказам за выбранный период.")
 
-@router.callback_query(F.data.startswith("admin_executor_report:"))
+@router.callback_query(F.data.startswith("admin_executor_report:"), flags={"throttling": "expensive"})
 async def generate_executor_report(callback: types.CallbackQuery, session: AsyncSession):
     """Генерирует и отправляет отчет по заказам для конкретного исполнителя."""
     _, executor_id_str, page_str = callback.data.split(":")
@@ -2051,7 +2098,7 @@ async def exit_admin_chat(message: types.Message, state: FSMContext):
 
 
 @router.message(ChatStates.in_chat)
-async def forward_message_from_admin(message: types.Message, state: FSMContext, bots: dict):
+async def forward_message_from_admin(message: types.Message, state: FSMContext, session: AsyncSession, bots: dict):
     """Пересылает сообщение от админа клиенту или исполнителю."""
     user_data = await state.get_data()
     partner_id = user_data.get("chat_partner_id")
@@ -2083,17 +2130,18 @@ async def forward_message_from_admin(message: types.Message, state: FSMContext,
                 reply_markup=reply_keyboard
             )
         elif message.photo:
-            # Скачиваем файл через текущего бота (админского)
-            photo_file = await message.bot.get_file(message.photo[-1].file_id)
-            photo_bytes_io = await message.bot.download_file(photo_file.file_path)
-            photo_to_send = BufferedInputFile(photo_bytes_io.read(), filename="photo.jpg")
-
-            # И отправляем через целевого бота (клиентского или исполнительского)
-            await target_bot.send_photo(
-                chat_id=partner_id,
-                photo=photo_to_send,
-                caption=f"{prefix}{message.caption or ''}",
-                reply_markup=reply_keyboard
+            # Скачиваем файл через текущего бота (админского) и отправляем через целевого
+            # (клиентского или исполнительского), если целевой бот еще не получал это фото
+            await relay_photo(
+                session, message.bot, target_bot,
+                file_id=message.photo[-1].file_id,
+                file_unique_id=message.photo[-1].file_unique_id,
+                send=lambda photo: target_bot.send_photo(
+                    chat_id=partner_id,
+                    photo=photo,
+                    caption=f"{prefix}{message.caption or ''}",
+                    reply_markup=reply_keyboard
+                )
             )
 
         await message.answer("✅ Сообщение отправлено.")
@@ -2117,18 +2165,15 @@ async def _get_order_details_text(order: Order) -> str:
         executor_info = f"{order.executor.name} ({identifier})"
 
     services_list = []
+    catalog = get_service_catalog()
     for item in order.items:
-        service_name = ADDITIONAL_SERVICES.get(item.service_key, "Неизвестная услуга")
-        if "шт" in service_name and item.quantity > 1:
-            services_list.append(f"  - {service_name} (x{item.quantity})")
-        else:
-            services_list.append(f"  - {service_name}")
+        services_list.append(f"  - {catalog.format_item(item.service_key, item.quantity)}")
     services_text = "\n".join(services_list) or "Нет"
 
     logs_list = []
     if order.logs:
         for log in sorted(order.logs, key=lambda x: x.timestamp):
-            logs_list.append(f"  - {log.timestamp.strftime('%d.%m %H:%M')}: {log.message}")
+            logs_list.append(f"  - {log.timestamp.strftime('%d.%m %H:%M')}: {html.escape(log.message)}")
     logs_text = "\n".join(logs_list) or "Нет записей"
 
     test_label = " (ТЕСТ)" if order.is_test else ""
@@ -2138,7 +2183,7 @@ async def _get_order_details_text(order: Order) -> str:
         f"👤 <b>Клиент:</b> {client_info}\n"
         f"📞 <b>Телефон:</b> {order.order_phone}\n\n"
         f"🛠️ <b>Исполнитель:</b> {executor_info}\n\n"
-        f"📍 <b>Адрес:</b> {order.address_text}\n"
+        f"📍 <b>Адрес:</b> {html.escape(order.address_text)}\n"
         f"📅 <b>Дата и время:</b> {order.selected_date} {order.selected_time}\n\n"
         f"🧹 <b>Состав заказа:</b>\n"
         f"  - {order.cleaning_type} ({order.room_count} ком., {order.bathroom_count} с/у)\n"
@@ -2295,6 +2340,7 @@ async def edit_main_tariff_finish(message: types.Message, state: FSMContext, ses
     # Обновляем тарифы в объекте конфига и сохраняем в БД
     config.system.tariffs[tariff_name] = {"base": base, "per_room": per_room, "per_bathroom": per_bathroom}
     await update_system_settings(session, {"tariffs": json.dumps(config.system.tariffs)})
+    rebuild_pricing_engine(config.system)
 
     # Удаляем старые сообщения
     if prompt_message_id:
@@ -2320,7 +2366,7 @@ async def manage_additional_services(callback: types.CallbackQuery, state: FSMCo
     await state.set_state(AdminSettingsStates.choosing_additional_service)
     await callback.message.edit_text(
         "Выберите дополнительную услугу для изменения цены:",
-        reply_markup=get_additional_services_edit_keyboard(config.system.additional_services)
+        reply_markup=get_additional_services_edit_keyboard(get_service_catalog())
     )
 
 
@@ -2328,8 +2374,12 @@ async def manage_additional_services(callback: types.CallbackQuery, state: FSMCo
 async def edit_additional_service_start(callback: types.CallbackQuery, state: FSMContext, config: Settings):
     """Начинает процесс изменения цены на доп. услугу."""
     service_key = callback.data.split(":")[1]
-    service_name = config.system.additional_services.get(service_key, "Неизвестная услуга").split('(')[0].strip()
-    current_price = calculate_price_from_service_string(config.system.additional_services.get(service_key, ""))
+    service = get_service_catalog().get(service_key)
+    if not service:
+        await callback.answer("Услуга не найдена.", show_alert=True)
+        return
+    service_name = service.title
+    current_price = service.unit_price
 
     await state.set_state(AdminSettingsStates.editing_additional_service_price)
     await state.update_data(
@@ -2360,14 +2410,11 @@ async def edit_additional_service_finish(message: types.Message, state: FSMConte
     service_name = user_data.get("editing_service_name")
     prompt_message_id = user_data.get("prompt_message_id")
 
-    # Обновляем цену в словаре в конфиге
-    base_text = service_name
-    if "шт" in config.system.additional_services[service_key]:
-        config.system.additional_services[service_key] = f"{base_text} (+{new_price} ₽/шт)"
-    else:
-        config.system.additional_services[service_key] = f"{base_text} (+{new_price} ₽)"
-
-    await update_system_settings(session, {"additional_services": json.dumps(config.system.additional_services)})
+    # Собираем новый каталог с измененной ценой и подменяем текущий
+    new_catalog = get_service_catalog().with_price(service_key, new_price)
+    await update_system_settings(session, {"additional_services": new_catalog.to_json()})
+    set_service_catalog(new_catalog)
+    rebuild_pricing_engine(config.system)
 
     # Удаляем старые сообщения
     if prompt_message_id:
@@ -2410,6 +2457,7 @@ async def change_commission_type(callback: types.CallbackQuery, state: FSMContex
     new_type = "fixed" if current_type == "percent" else "percent"
     config.system.commission_type = new_type
     await update_system_settings(session, {"commission_type": new_type})
+    rebuild_pricing_engine(config.system)
 
     await callback.message.edit_reply_markup(
         reply_markup=get_commission_management_keyboard(
@@ -2450,6 +2498,7 @@ async def change_commission_value_finish(message: types.Message, state: FSMConte
 
     config.system.commission_value = new_value
     await update_system_settings(session, {"commission_value": new_value})
+    rebuild_pricing_engine(config.system)
 
     # Удаляем старые сообщения (приглашение и ответ пользователя)
     if prompt_message_id:
@@ -2487,6 +2536,31 @@ async def toggle_show_commission(callback: types.CallbackQuery, state: FSMContex
     status_text = "включен" if new_status else "выключен"
     await callback.answer(f"Показ комиссии для исполнителей {status_text}.")
 
+# --- Пересчет открытых заказов ---
+
+@router.callback_query(F.data == "admin_reprice:preview")
+async def reprice_orders_preview(callback: types.CallbackQuery, session: AsyncSession):
+    """Показывает, как изменятся цены открытых заказов по текущим тарифам и комиссии (без записи в БД)."""
+    await callback.answer("Считаю...")
+    report = await reprice_open_orders(session, dry_run=True)
+    await callback.message.edit_text(
+        report.summary(),
+        reply_markup=get_repricing_confirmation_keyboard(has_changes=bool(report.changes))
+    )
+
+
+@router.callback_query(F.data == "admin_reprice:apply")
+async def reprice_orders_apply(callback: types.CallbackQuery, session: AsyncSession, bots: dict):
+    """Пересчитывает открытые заказы, сохраняет новые цены и уведомляет клиентов и исполнителей."""
+    await callback.answer("Пересчитываю...")
+    report = await reprice_open_orders(session, dry_run=False, admin_id=callback.from_user.id)
+    await callback.message.edit_text(
+        report.summary(),
+        reply_markup=get_repricing_confirmation_keyboard(has_changes=False)
+    )
+    notify_repriced_orders(bots, report.changes)
+
+
 # --- Тестовый режим ---
 
 @router.callback_query(AdminSettingsStates.choosing_setting, F.data == "admin_setting:test_mode")
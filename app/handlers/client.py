@@ -1,18 +1,22 @@
 import datetime
+import html
 import logging
 from contextlib import suppress
 from zoneinfo import ZoneInfo
 from aiogram import F, Router, types, Bot
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.services.db_queries import get_matching_executors, get_users_by_role
+from app.services.db_queries import get_users_by_role
+from app.services.dispatch import find_and_notify_executors
+from app.services.occupancy import SlotConflictError
+from app.services.media_relay import relay_photo
 from app.config import Settings
 from app.handlers.states import OrderStates, SupportStates, RatingStates, ChatStates
-from app.keyboards.executor_kb import get_new_order_notification_keyboard, get_order_changes_confirmation_keyboard
-from app.common.texts import ADDITIONAL_SERVICES
+from app.keyboards.executor_kb import get_order_changes_confirmation_keyboard
+from app.services.service_catalog import get_service_catalog
 from app.keyboards.admin_kb import get_new_order_admin_keyboard
 from app.keyboards.client_kb import (
     get_exit_chat_keyboard,
@@ -57,11 +61,12 @@ from app.services.db_queries import (
     get_user_tickets,
     add_message_to_ticket,
     update_ticket_status,
-    save_order_rating, update_executor_rating, update_user_phone, create_order_offer, check_and_award_performance_bonus
+    save_order_rating, update_executor_rating, update_user_phone, check_and_award_performance_bonus
 )
 from app.database.models import MessageAuthor, TicketStatus, User, Order, UserRole
-from app.services.price_calculator import ADDITIONAL_SERVICE_PRICES, calculate_preliminary_cost, calculate_total_cost, calculate_executor_payment
+from app.services.price_calculator import get_pricing_engine, calculate_preliminary_cost, calculate_total_cost
 from app.services.yandex_maps_api import get_address_from_coords, get_address_from_text
+from app.services.geocoder import GeocoderUnavailable
 from app.common.texts import STATUS_MAPPING, RUSSIAN_MONTHS_GENITIVE
 
 TYUMEN_TZ = ZoneInfo("Asia/Yekaterinburg") # UTC+5, соответствует Тюмени
@@ -170,7 +175,7 @@ async def handle_bathroom_count(message: types.Message, state: FSMContext):
     await state.set_state(OrderStates.choosing_additional_services)
 
 
-@router.message(F.text == "💬 Мои заказы")
+@router.message(F.text == "💬 Мои заказы", flags={"throttling": "expensive"})
 async def my_orders(message: types.Message, session: AsyncSession, state: FSMContext):
     """Отображает список активных заказов в виде кнопок."""
     await state.clear()  # На всякий случай сбрасываем состояние
@@ -235,8 +240,9 @@ async def view_order(callback: types.CallbackQuery, session: AsyncSession):
         pass  # Если что-то пошло не так с датой, просто не даем редактировать
 
     # Собираем информацию о доп. услугах
+    catalog = get_service_catalog()
     selected_services_text = "\n".join(
-        [f"    - {ADDITIONAL_SERVICES[item.service_key]}" for item in order.items]
+        [f"    - {catalog.display_name(item.service_key)}" for item in order.items]
     ) or "Нет"
 
     # Форматируем дату
@@ -254,7 +260,7 @@ async def view_order(callback: types.CallbackQuery, session: AsyncSession):
         f"<b>Тип уборки:</b> {order.cleaning_type}\n"
         f"<b>Комнат:</b> {order.room_count}, <b>Санузлов:</b> {order.bathroom_count}\n\n"
         f"<b>Дополнительные услуги:</b>\n{selected_services_text}\n\n"
-        f"📍 <b>Адрес:</b> {order.address_text}\n"
+        f"📍 <b>Адрес:</b> {html.escape(order.address_text)}\n"
         f"📅 <b>Дата:</b> {formatted_date}\n"
         f"🕒 <b>Время:</b> {order.selected_time}\n\n"
         f"💰 <b>ИТОГОВАЯ СТОИМОСТЬ: {order.total_price} ₽</b>"
@@ -322,8 +328,9 @@ async def view_archive_order(callback: types.CallbackQuery, session: AsyncSessio
         return
 
     # Форматирование деталей заказа (аналогично view_order)
+    catalog = get_service_catalog()
     selected_services_text = "\n".join(
-        [f"    - {ADDITIONAL_SERVICES[item.service_key]}" for item in order.items]
+        [f"    - {catalog.display_name(item.service_key)}" for item in order.items]
     ) or "Нет"
     try:
         selected_date = datetime.datetime.strptime(order.selected_date, "%Y-%m-%d")
@@ -341,7 +348,7 @@ async def view_archive_order(callback: types.CallbackQuery, session: AsyncSessio
 
     f"<b>Дополнительные услуги:</b>\n{selected_services_text}\n\n"
 
-    f"📍 <b>Адрес:</b> {order.address_text}\n"
+    f"📍 <b>Адрес:</b> {html.escape(order.address_text)}\n"
 
     f"📅 <b>Дата:</b> {formatted_date}\n"
 
@@ -472,7 +479,7 @@ async def edit_bathroom_count_chosen(message: types.Message, state: FSMContext,
         room_count_str=user_data.get("new_room_count"),
         bathroom_count_str=user_data.get("new_bathroom_count")
     )
-    additional_cost = sum(ADDITIONAL_SERVICE_PRICES.get(item.service_key, 0) * item.quantity for item in order.items)
+    additional_cost = get_pricing_engine().services_cost({item.service_key: item.quantity for item in order.items})
     new_total_price = new_preliminary_cost + additional_cost
     updated_order = await update_order_rooms_and_price(
         session, order_id=order_id,
@@ -496,13 +503,12 @@ async def edit_bathroom_count_chosen(message: types.Message, state: FSMContext,
                     reply_markup=get_main_menu_keyboard()
                 )
                 try:
-                    new_executor_payment = round(new_total_price * 0.85)
                     await bots["executor"].send_message(
                         chat_id=updated_order.executor_tg_id,
                         text=(
                             f"❗️ <b>В заказе №{order_id} изменены параметры.</b>\n"
                             f"Новые параметры: {updated_order.room_count} комнат, {updated_order.bathroom_count} санузлов\n"
-                            f"Новая выплата: {new_executor_payment} ₽\n\n"
+                            f"Новая выплата: {updated_order.executor_payment} ₽\n\n"
                             "Пожалуйста, подтвердите, что вы готовы выполнить заказ с этими изменениями."
                         ),
                         reply_markup=get_order_changes_confirmation_keyboard(order_id)
@@ -527,7 +533,7 @@ async def edit_bathroom_count_chosen(message: types.Message, state: FSMContext,
         await message.answer("Произошла ошибка при обновлении заказа.", reply_markup=get_main_menu_keyboard())
     await state.clear()
 
-@router.callback_query(F.data.startswith("cancel_order:"))
+@router.callback_query(F.data.startswith("cancel_order:"), flags={"idempotent": True})
 async def cancel_order(callback: types.CallbackQuery, session: AsyncSession, bots: dict, config: Settings):
     """Обрабатывает отмену заказа."""
     order_id = int(callback.data.split(":")[1])
@@ -541,7 +547,7 @@ async def cancel_order(callback: types.CallbackQuery, session: AsyncSession, bot
             f"<b>Заказ №{updated_order.id} от {updated_order.created_at.strftime('%d.%m.%Y')}</b>\n"
             f"Статус: <i>{STATUS_MAPPING.get(updated_order.status, updated_order.status.value)}</i>\n"
             f"Сумма: {updated_order.total_price} ₽\n"
-            f"Адрес: {updated_order.address_text}"
+            f"Адрес: {html.escape(updated_order.address_text)}"
         )
         await callback.answer("Заказ отменен.")
 
@@ -615,10 +621,6 @@ async def support(message: types.Message, state: FSMContext):
     )
 
 
-# Константа для услуг, требующих указания количества
-QUANTITY_SERVICES = {"win", "chair"}
-
-
 @router.callback_query(
     StateFilter(OrderStates.choosing_additional_services, OrderStates.editing_additional_services),
     F.data.startswith("add_service_")
@@ -630,7 +632,8 @@ async def handle_add_service(callback: types.CallbackQuery, state: FSMContext):
     selected_services = user_data.get("selected_services", {}).copy()
 
     # --- Новая логика ---
-    if service_key in QUANTITY_SERVICES:
+    service = get_service_catalog().get(service_key)
+    if service and service.per_unit:
         # Если услуга уже выбрана, удаляем ее
         if service_key in selected_services:
             del selected_services[service_key]
@@ -649,7 +652,7 @@ async def handle_add_service(callback: types.CallbackQuery, state: FSMContext):
                 services_message_id=callback.message.message_id  # Запоминаем ID главного сообщения
             )
             prompt_message = await callback.message.answer(
-                f"Пожалуйста, укажите количество ({ADDITIONAL_SERVICES[service_key].split('(')[0].strip()}):"
+                f"Пожалуйста, укажите количество ({service.title}):"
             )
             # Запоминаем ID сообщения с вопросом, чтобы потом его удалить
             await state.update_data(quantity_prompt_message_id=prompt_message.message_id)
@@ -722,11 +725,7 @@ async def update_services_message(bot: Bot, chat_id: int, message_id: int, state
     selected_services = user_data.get("selected_services", {})
     preliminary_cost = user_data.get("preliminary_cost", 0)
 
-    additional_cost = 0
-    for service, quantity in selected_services.items():
-        additional_cost += ADDITIONAL_SERVICE_PRICES.get(service, 0) * quantity
-
-    total_cost = preliminary_cost + additional_cost
+    total_cost = calculate_total_cost(preliminary_cost, selected_services)
     await state.update_data(total_cost=total_cost)
 
     with suppress(TelegramBadRequest):
@@ -779,12 +778,11 @@ async def done_additional_services(callback: types.CallbackQuery, state: FSMCont
                     )
                     await callback.message.answer("Вы вернулись в главное меню.", reply_markup=get_main_menu_keyboard())
                     try:
-                        new_executor_payment = round(new_price * 0.85)
                         await bots["executor"].send_message(
                             chat_id=updated_order.executor_tg_id,
                             text=(
                                 f"❗️ <b>В заказе №{order_id} изменены доп. услуги.</b>\n"
-                                f"Новая выплата: {new_executor_payment} ₽\n\n"
+                                f"Новая выплата: {updated_order.executor_payment} ₽\n\n"
                                 "Пожалуйста, подтвердите, что вы готовы выполнить заказ с этими изменениями."
                             ),
                             reply_markup=get_order_changes_confirmation_keyboard(order_id)
@@ -818,10 +816,14 @@ async def done_additional_services(callback: types.CallbackQuery, state: FSMCont
     await callback.answer()
 
 @router.message(OrderStates.entering_address, F.location)
-async def handle_address_location(message: types.Message, state: FSMContext, config: Settings):
+async def handle_address_location(message: types.Message, state: FSMContext, session: AsyncSession, config: Settings):
     """Обрабатывает геолокацию, получает адрес и просит подтверждения."""
     lat, lon = message.location.latitude, message.location.longitude
-    address_text = await get_address_from_coords(lat, lon, config.api_keys.yandex_api_key)
+    try:
+        address_text = await get_address_from_coords(lat, lon, config.api_keys.yandex_api_key, session)
+    except GeocoderUnavailable:
+        await message.answer("Сервис определения адреса временно недоступен. Пожалуйста, введите адрес вручную.")
+        return
 
     if address_text:
         await state.update_data(address_lat=lat, address_lon=lon, address_text=address_text)
@@ -835,13 +837,24 @@ async def handle_address_location(message: types.Message, state: FSMContext, con
 
 
 @router.message(OrderStates.entering_address, F.text)
-async def handle_address_text(message: types.Message, state: FSMContext, config: Settings):
+async def handle_address_text(message: types.Message, state: FSMContext, session: AsyncSession, config: Settings):
     """Обрабатывает текстовый адрес, проверяет его и просит подтверждения."""
     if message.text == "⬅️ Назад к доп. услугам":
         await back_to_additional_services(message, state)
         return
 
-    validated_address = await get_address_from_text(message.text, config.api_keys.yandex_api_key)
+    try:
+        validated_address = await get_address_from_text(message.text, config.api_keys.yandex_api_key, session)
+    except GeocoderUnavailable:
+        # Проверить адрес не получилось - принимаем его в том виде, как ввел клиент
+        await state.update_data(address_text=message.text)
+        await message.answer(
+            f"Сейчас не удается проверить адрес, поэтому мы сохраним его так, как вы ввели: <b>{html.escape(message.text)}</b>.\nВсе верно?",
+            reply_markup=get_address_confirmation_keyboard()
+        )
+        await state.set_state(OrderStates.confirming_address)
+        return
+
     if validated_address:
         await state.update_data(address_text=validated_address)
         await message.answer(
@@ -868,7 +881,7 @@ async def handle_address_confirmation(message: types.Message, state: FSMContext,
         if updated_order:
             await bots["admin"].send_message(
                 config.admin_id,
-                f"❗️ <b>В заказе №{order_id} изменен адрес.</b>\nНовый адрес: {new_address}"
+                f"❗️ <b>В заказе №{order_id} изменен адрес.</b>\nНовый адрес: {html.escape(new_address)}"
             )
 
             if updated_order.executor_tg_id:
@@ -883,7 +896,7 @@ async def handle_address_confirmation(message: types.Message, state: FSMContext,
                             chat_id=updated_order.executor_tg_id,
                             text=(
                                 f"❗️ <b>В заказе №{order_id} изменен адрес.</b>\n"
-                                f"Новый адрес: {new_address}\n\n"
+                                f"Новый адрес: {html.escape(new_address)}\n\n"
                                 "Пожалуйста, подтвердите, что вы готовы выполнить заказ с этими изменениями."
                             ),
                             reply_markup=get_order_changes_confirmation_keyboard(order_id)
@@ -925,7 +938,7 @@ async def handle_reenter_address(message: types.Message, state: FSMContext):
 
 
 # --- БЛОК: ОБРАБОТЧИКИ ДЛЯ КАЛЕНДАРЯ ---
-@router.callback_query(OrderStates.choosing_date, F.data.startswith("month_nav:"))
+@router.callback_query(OrderStates.choosing_date, F.data.startswith("month_nav:"), flags={"throttling": "expensive"})
 async def process_calendar_navigation(callback: types.CallbackQuery):
     """Обрабатывает навигацию 'вперед'/'назад' по календарю."""
     user_id = callback.from_user.id
@@ -1037,7 +1050,13 @@ async def handle_time_selection(message: types.Message, state: FSMContext, sessi
     if order_id:
         new_date = user_data.get("selected_date")
         new_time = user_data.get("selected_time")
-        updated_order = await update_order_datetime(session, order_id, new_date, new_time)
+        try:
+            updated_order = await update_order_datetime(session, order_id, new_date, new_time)
+        except SlotConflictError:
+            await message.answer(
+                "К сожалению, исполнитель вашего заказа уже занят в это время. Пожалуйста, выберите другое время."
+            )
+            return
 
         if updated_order:
             try:
@@ -1155,8 +1174,9 @@ async def _show_order_summary(message: types.Message, state: FSMContext):
 
     # Собираем информацию о доп. услугах
     selected_services_data = user_data.get("selected_services", {})
+    catalog = get_service_catalog()
     selected_services_text = "\n".join(
-        [f"    - {ADDITIONAL_SERVICES[key]}" for key in selected_services_data.keys()]
+        [f"    - {catalog.display_name(key)}" for key in selected_services_data.keys()]
     ) or "Нет"
 
     # Формируем итоговое сообщение
@@ -1246,7 +1266,7 @@ async def handle_confirmation(message: types.Message, state: FSMContext):
     await state.set_state(OrderStates.choosing_payment_method)
 
 
-@router.callback_query(F.data.startswith("cancel_order:"))
+@router.callback_query(F.data.startswith("cancel_order:"), flags={"idempotent": True})
 async def cancel_order(callback: types.CallbackQuery, session: AsyncSession, bots: dict, config: Settings):
     """Обрабатывает отмену заказа."""
     order_id = int(callback.data.split(":")[1])
@@ -1268,7 +1288,7 @@ async def cancel_order(callback: types.CallbackQuery, session: AsyncSession, bot
             f"<b>Заказ №{updated_order.id} от {updated_order.created_at.strftime('%d.%m.%Y')}</b>\n"
             f"Статус: <i>{STATUS_MAPPING.get(updated_order.status, updated_order.status.value)}</i>\n"
             f"Сумма: {updated_order.total_price} ₽\n"
-            f"Адрес: {updated_order.address_text}"
+            f"Адрес: {html.escape(updated_order.address_text)}"
         )
         await callback.answer("Заказ отменен.")
 
@@ -1292,7 +1312,7 @@ async def cancel_order(callback: types.CallbackQuery, session: AsyncSession, bot
         await callback.answer("Не удалось найти или обновить заказ.", show_alert=True)
 
 
-@router.message(OrderStates.choosing_payment_method, F.text == "💵 Наличными исполнителю")
+@router.message(OrderStates.choosing_payment_method, F.text == "💵 Наличными исполнителю", flags={"idempotent": True})
 async def handle_payment_cash(message: types.Message, state: FSMContext, session: AsyncSession, bots: dict,
                               config: Settings):
     """
@@ -1320,7 +1340,7 @@ async def handle_payment_cash(message: types.Message, state: FSMContext, session
             f"✅ <b>Новый заказ! №{new_order.id}{test_label}</b>\n\n"
             f"<b>Тип уборки:</b> {new_order.cleaning_type}\n"
             f"<b>Состав:</b> {new_order.room_count} ком., {new_order.bathroom_count} с/у\n"
-            f"<b>Адрес:</b> {new_order.address_text}\n"
+            f"<b>Адрес:</b> {html.escape(new_order.address_text)}\n"
             f"<b>Дата и время:</b> {new_order.selected_date} {new_order.selected_time}\n"
             f"<b>Сумма:</b> {new_order.total_price} ₽\n\n"
             f"Заказ ожидает назначения исполнителя."
@@ -1338,73 +1358,6 @@ async def handle_payment_cash(message: types.Message, state: FSMContext, session
 
     await find_and_notify_executors(session, new_order.id, bots["executor"], config)
 
-async def find_and_notify_executors(session: AsyncSession, order_id: int, executor_bot: Bot, config: Settings):
-    """Находит подходящих исполнителей и предлагает заказ первому в очереди."""
-    order = await get_order_by_id(session, order_id)
-    if not order:
-        logging.error(f"Не удалось найти заказ №{order_id} для поиска исполнителя.")
-        return
-
-    executors = await get_matching_executors(session, order.selected_date, order.selected_time)
-
-    if executors:
-        next_executor = executors[0]
-        await offer_order_to_executor(session, {"executor": executor_bot}, order, next_executor, config)
-    else:
-        logging.warning(f"На новый заказ №{order_id} не найдено подходящих исполнителей.")
-
-async def offer_order_to_executor(session: AsyncSession, bots: dict, order: Order, executor: User, config: Settings):
-    """Отправляет предложение одному исполнителю и создает запись в OrderOffer."""
-    now = datetime.datetime.now(TYUMEN_TZ)
-    order_start_time = datetime.datetime.strptime(
-        f"{order.selected_date} {order.selected_time.split(' ')[0]}", "%Y-%m-%d %H:%M"
-    ).replace(tzinfo=TYUMEN_TZ)
-
-    time_to_order = order_start_time - now
-
-    # Определяем время на ответ
-    if time_to_order < datetime.timedelta(hours=24):
-        timeout_minutes = 15
-    elif time_to_order < datetime.timedelta(days=3):
-        timeout_minutes = 30
-    else:
-        timeout_minutes = 60
-
-    expires_at = now + datetime.timedelta(minutes=timeout_minutes)
-    naive_expires_at = expires_at.replace(tzinfo=None)
-
-    await create_order_offer(session, order.id, executor.telegram_id, naive_expires_at)
-
-    executor_payment = calculate_executor_payment(
-        total_price=order.total_price,
-        commission_type=config.system.commission_type,
-        commission_value=config.system.commission_value
-    )
-
-    financial_line = ""
-    if config.system.show_commission_to_executor:
-        financial_line = f"💰 <b>Ваша выплата:</b> {executor_payment} ₽"
-    else:
-        financial_line = f"💰 <b>Вознаграждение:</b> {executor_payment} ₽"
-
-    test_label = " (ТЕСТОВЫЙ)" if order.is_test else ""
-    notification_text = (
-        f"🔥 <b>Новый заказ №{order.id}{test_label}</b>\n\n"
-        f"<b>Дата и время:</b> {order.selected_date}, {order.selected_time}\n"
-        f"{financial_line}\n\n"
-        f"<i>У вас есть {timeout_minutes} минут, чтобы принять решение.</i>"
-    )
-    notification_keyboard = get_new_order_notification_keyboard(order.id, timeout_minutes)
-
-    try:
-        await bots["executor"].send_message(
-            chat_id=executor.telegram_id,
-            text=notification_text,
-            reply_markup=notification_keyboard
-        )
-    except Exception as e:
-        logging.warning(f"Не удалось отправить уведомление исполнителю {executor.telegram_id}: {e}")
-
 @router.message(OrderStates.choosing_payment_method, F.text == "💳 Онлайн-оплата")
 async def handle_payment_online(message: types.Message): # <--- УБРАН state
     """Обрабатывает онлайн-оплату."""
@@ -1681,20 +1634,17 @@ async def finish_ticket_creation(message: types.Message, state: FSMContext, sess
         ])
 
         if photo_id:
-            # Скачиваем фото во временный объект в памяти
-            photo_file = await client_bot.get_file(photo_id)
-            photo_bytes_io = await client_bot.download_file(photo_file.file_path)
-            photo_bytes = photo_bytes_io.read()  # Читаем байты из объекта BytesIO
-
-            # Оборачиваем байты в BufferedInputFile для отправки
-            photo_to_send = BufferedInputFile(photo_bytes, filename="photo.jpg")
-
-            # Отправляем фото с подписью и КНОПКОЙ от имени АДМИН-БОТА
-            await admin_bot.send_photo(
-                chat_id=config.admin_id,
-                photo=photo_to_send,
-                caption=admin_caption,
-                reply_markup=go_to_ticket_keyboard
+            # Пересылаем фото от имени АДМИН-БОТА с подписью и КНОПКОЙ.
+            # Файл скачивается через клиент-бота только если админ-бот еще не получал его
+            await relay_photo(
+                session, client_bot, admin_bot,
+                file_id=photo_id,
+                send=lambda photo: admin_bot.send_photo(
+                    chat_id=config.admin_id,
+                    photo=photo,
+                    caption=admin_caption,
+                    reply_markup=go_to_ticket_keyboard
+                )
             )
         else:
             # Если фото нет, просто отправляем текст и КНОПКУ от имени АДМИН-БОТА
@@ -1816,7 +1766,7 @@ async def handle_review(message: types.Message, state: FSMContext, session: Asyn
         )
 
         # 4. Проверяем и начисляем бонус за производительность
-        bonus_amount = await check_and_award_performance_bonus(session, order.executor_tg_id)
+        bonus_amount = await check_and_award_performance_bonus(session, order.executor_tg_id, order_id=order.id)
         if bonus_amount:
             await executor_bot.send_message(
                 chat_id=order.executor_tg_id,
@@ -1887,7 +1837,7 @@ async def exit_chat_client(message: types.Message, state: FSMContext):
     )
 
 @router.message(ChatStates.in_chat)
-async def forward_message_from_client(message: types.Message, state: FSMContext, bots: dict):
+async def forward_message_from_client(message: types.Message, state: FSMContext, session: AsyncSession, bots: dict):
     """Пересылает сообщение от клиента админу или исполнителю в зависимости от состояния."""
     user_data = await state.get_data()
     partner_id = user_data.get("chat_partner_id")
@@ -1917,16 +1867,17 @@ async def forward_message_from_client(message: types.Message, state: FSMContext,
         if message.text:
             await target_bot.send_message(partner_id, f"{prefix}{message.text}", reply_markup=reply_keyboard)
         elif message.photo:
-            # Используем универсальный метод скачивания и отправки, как в других чатах
-            photo_file = await message.bot.get_file(message.photo[-1].file_id)
-            photo_bytes_io = await message.bot.download_file(photo_file.file_path)
-            photo_to_send = BufferedInputFile(photo_bytes_io.read(), filename="photo.jpg")
-
-            await target_bot.send_photo(
-                chat_id=partner_id,
-                photo=photo_to_send,
-                caption=f"{prefix}{message.caption or ''}",
-                reply_markup=reply_keyboard
+            # Используем универсальный метод пересылки, как в других чатах
+            await relay_photo(
+                session, message.bot, target_bot,
+                file_id=message.photo[-1].file_id,
+                file_unique_id=message.photo[-1].file_unique_id,
+                send=lambda photo: target_bot.send_photo(
+                    chat_id=partner_id,
+                    photo=photo,
+                    caption=f"{prefix}{message.caption or ''}",
+                    reply_markup=reply_keyboard
+                )
             )
         await message.answer("✅ Ваше сообщение отправлено.")
 
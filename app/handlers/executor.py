@@ -1,20 +1,24 @@
+import html
 import logging
 import datetime
 from aiogram import F, Router, types
 from aiogram.filters import CommandStart, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, BufferedInputFile
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 from typing import List
 from app.config import Settings
-from app.database.models import UserRole, OrderStatus, UserStatus, DeclinedOrder, MessageAuthor
-from app.handlers.states import ExecutorRegistration, ChatStates, ExecutorSupportStates
-from app.common.texts import ADDITIONAL_SERVICES, STATUS_MAPPING
-from app.services.price_calculator import calculate_executor_payment
+from app.database.models import UserRole, OrderStatus, UserStatus, MessageAuthor
+from app.handlers.states import ExecutorRegistration, ExecutorWorkAreaStates, ChatStates, ExecutorSupportStates
+from app.common.texts import STATUS_MAPPING
+from app.services.service_catalog import get_service_catalog
+from app.services.media_relay import get_relay_photos, remember_relay_photo, relay_photo, close_relay_photos
 from app.services.db_queries import (
     get_user,
     register_executor,
+    get_order_financial_snapshot,
+    close_order_offers,
+    count_active_offers,
     get_orders_by_status,
     get_order_by_id,
     assign_executor_to_order,
@@ -26,10 +30,12 @@ from app.services.db_queries import (
     get_executor_completed_orders, get_user_by_referral_code,
     credit_referral_bonus, get_executor_orders_with_reviews,
     unassign_executor_from_order, increment_and_get_declines, reset_consecutive_declines, block_user_temporarily,
-    unblock_user, add_declined_order, decline_active_offer, get_matching_executors, create_ticket, get_user_tickets,
-    get_ticket_by_id
+    unblock_user, add_declined_order, decline_active_offer, create_ticket, get_user_tickets,
+    get_ticket_by_id,
+    update_executor_base_location
 )
-from app.handlers.client import find_and_notify_executors
+from app.services.dispatch import DISPATCH_DIRECT, dispatch_metrics, revoke_offer_messages, find_and_notify_executors
+from app.services.occupancy import SlotConflictError
 from app.keyboards.executor_kb import (
     get_executor_main_keyboard, get_exit_chat_keyboard,
     get_phone_request_keyboard, get_reply_to_chat_keyboard,
@@ -44,8 +50,11 @@ from app.keyboards.executor_kb import (
     get_executor_support_menu_keyboard,
     get_executor_my_tickets_keyboard,
     get_executor_view_ticket_keyboard,
-    get_executor_skip_photo_keyboard
+    get_executor_skip_photo_keyboard,
+    get_base_location_keyboard,
+    get_service_radius_keyboard
 )
+from app.services.geo_index import SERVICE_RADIUS_OPTIONS
 
 router = Router()
 
@@ -113,7 +122,7 @@ async def register_phone_received(message: types.Message, session: AsyncSession,
     await state.clear()
 
 
-@router.message(F.text == "🆕 Новые заказы")
+@router.message(F.text == "🆕 Новые заказы", flags={"throttling": "expensive"})
 async def show_new_orders(message: types.Message, session: AsyncSession):
     """Показывает список всех заказов со статусом 'new'."""
     user = await get_user(session, message.from_user.id)
@@ -146,7 +155,7 @@ async def show_new_orders(message: types.Message, session: AsyncSession):
 
 
 @router.callback_query(F.data.startswith("executor_view_order:"))
-async def executor_view_order(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext, config: Settings):
+async def executor_view_order(callback: types.CallbackQuery, session: AsyncSession, config: Settings):
     """Показывает детали заказа исполнителю."""
     order_id = int(callback.data.split(":")[1])
     order = await get_order_by_id(session, order_id)
@@ -161,66 +170,70 @@ async def executor_view_order(callback: types.CallbackQuery, session: AsyncSessi
     except (ValueError, TypeError):
         formatted_date = order.selected_date  # Если формат некорректен, показываем как есть
 
-    executor_payment = round(order.total_price * 0.85)
+    financials = await get_order_financial_snapshot(session, order)
     services_list = []
+    catalog = get_service_catalog()
     for item in order.items:
-        service_name = ADDITIONAL_SERVICES.get(item.service_key, "Неизвестная услуга")
-        # Для услуг, измеряемых в штуках, добавляем количество
-        if "шт" in service_name and item.quantity > 1:
-            services_list.append(f"  - {service_name} (x{item.quantity})")
-        else:
-            services_list.append(f"  - {service_name}")
+        # Для услуг, измеряемых в штуках, добавляется количество
+        services_list.append(f"  - {catalog.format_item(item.service_key, item.quantity)}")
     services_text = "\n".join(services_list) or "Нет"
 
     # Внедряем новую переменную для финансового блока
     financial_block = ""
     if config.system.show_commission_to_executor:
         financial_block = (
-            f"<b>Цена для клиента:</b> {order.total_price} ₽\n"
-            f"💰 <b>Ваша выплата:</b> {executor_payment} ₽"
+            f"<b>Цена для клиента:</b> {financials.total_price} ₽\n"
+            f"💰 <b>Ваша выплата:</b> {financials.executor_payment} ₽"
         )
     else:
-        financial_block = f"💰 <b>Вознаграждение:</b> {executor_payment} ₽"
+        financial_block = f"💰 <b>Вознаграждение:</b> {financials.executor_payment} ₽"
 
     order_details = (
         f"📝 <b>Детали заказа №{order.id}</b>\n\n"
         f"<b>Тип:</b> {order.cleaning_type}\n"
         f"<b>Комнат:</b> {order.room_count}, <b>Санузлов:</b> {order.bathroom_count}\n"
-        f"<b>Адрес:</b> {order.address_text}\n"
+        f"<b>Адрес:</b> {html.escape(order.address_text)}\n"
         f"<b>Дата/время:</b> {formatted_date}, {order.selected_time}\n\n"
         f"<b>Доп. услуги:</b>\n{services_text}\n\n"
         f"{financial_block}"
     )
 
-    await state.update_data({f"payment_{order_id}": executor_payment})
-
     await callback.message.answer(order_details, reply_markup=get_order_confirmation_keyboard(order_id))
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("executor_accept_order:"))
-async def executor_accept_order(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext, bots: dict,
-                                config: Settings):
+@router.callback_query(F.data.startswith("executor_accept_order:"), flags={"idempotent": True})
+async def executor_accept_order(callback: types.CallbackQuery, session: AsyncSession, bots: dict, config: Settings):
     """Обрабатывает принятие заказа исполнителем."""
     order_id = int(callback.data.split(":")[1])
-    user_data = await state.get_data()
-    payment = user_data.get(f"payment_{order_id}")
+    order_for_payment = await get_order_by_id(session, order_id)
+    if not order_for_payment:
+        await callback.message.edit_text("❌ Ошибка: заказ не найден.")
+        await callback.answer()
+        return
+    # Выплата берется из финансового снимка заказа - ту же сумму исполнитель видел в карточке заказа
+    financials = await get_order_financial_snapshot(session, order_for_payment)
 
-    if payment is None:
-        order_for_payment = await get_order_by_id(session, order_id)
-        if not order_for_payment:
-            await callback.message.edit_text("❌ Ошибка: заказ не найден.")
-            await callback.answer()
-            return
-        payment = calculate_executor_payment(
-            total_price=order_for_payment.total_price,
-            commission_type=config.system.commission_type,
-            commission_value=config.system.commission_value
+    try:
+        order = await assign_executor_to_order(session, order_id, callback.from_user.id, financials.executor_payment)
+    except SlotConflictError:
+        # Предложение освобождаем без штрафа, чтобы заказ ушел следующему исполнителю
+        if await decline_active_offer(session, order_id, callback.from_user.id):
+            await find_and_notify_executors(session, order_id, bots["executor"], config)
+        await callback.message.edit_text(
+            f"❌ Не удалось принять заказ №{order_id}: у вас уже есть заказ на это же время."
         )
-
-    order = await assign_executor_to_order(session, order_id, callback.from_user.id, payment)
+        await callback.answer()
+        return
 
     if order:
+        # Остальные предложения по заказу проиграли - отзываем их
+        closed_offers = await close_order_offers(session, order_id, callback.from_user.id)
+        await revoke_offer_messages(callback.bot, order_id, closed_offers)
+        winner_offer = next((offer for offer in closed_offers if offer.status == 'accepted'), None)
+        strategy = (winner_offer.strategy if winner_offer else None) or DISPATCH_DIRECT
+        dispatch_metrics.record_assignment(strategy, (datetime.datetime.now() - order.created_at).total_seconds())
+
         await reset_consecutive_declines(session, callback.from_user.id)
         await callback.message.edit_text(
             f"✅ Вы приняли заказ №{order.id}. Он перемещен в раздел 'Мои заказы'.\n\n"
@@ -279,25 +292,9 @@ async def executor_decline_order(callback: types.CallbackQuery, session: AsyncSe
         await callback.answer()
         return
 
-    all_executors = await get_matching_executors(session, order.selected_date, order.selected_time)
-
-    # Находим всех, кому уже предлагали или кто отказался
-    declined_stmt = select(DeclinedOrder.executor_tg_id).where(DeclinedOrder.order_id == order_id)
-    declined_result = await session.execute(declined_stmt)
-    declined_ids = set(declined_result.scalars().all())
-
-    # Ищем первого в списке, которому еще не предлагали
-    next_executor = None
-    for executor in all_executors:
-        if executor.telegram_id not in declined_ids:
-            next_executor = executor
-            break
-
-        # Если нашли, отправляем ему предложение
-    if next_executor:
-        from app.handlers.client import offer_order_to_executor  # Локальный импорт
-        await offer_order_to_executor(session, bots, order, next_executor, config)
-    else:
+    # Предлагаем заказ следующим в очереди, кому его еще не предлагали
+    sent = await find_and_notify_executors(session, order_id, bots["executor"], config)
+    if not sent and not await count_active_offers(session, order_id):
         # Если исполнители кончились
         await bots["admin"].send_message(
             config.admin_id,
@@ -308,7 +305,7 @@ async def executor_decline_order(callback: types.CallbackQuery, session: AsyncSe
     await callback.answer()
 
 
-@router.message(F.text == "📋 Мои заказы")
+@router.message(F.text == "📋 Мои заказы", flags={"throttling": "expensive"})
 async def show_my_orders(message: types.Message, session: AsyncSession):
     """Показывает список принятых исполнителем заказов."""
     my_orders = await get_executor_active_orders(session, message.from_user.id)
@@ -339,14 +336,14 @@ async def executor_view_my_order(callback: types.CallbackQuery, session: AsyncSe
     except (ValueError, TypeError):
         formatted_date = order.selected_date  # Если формат некорректен, показываем как есть
 
-    services_text = "\n".join([f"  - {ADDITIONAL_SERVICES[item.service_key]}" for item in order.items]) or "Нет"
+    services_text = "\n".join([f"  - {get_service_catalog().display_name(item.service_key)}" for item in order.items]) or "Нет"
 
     test_label = " (ТЕСТ)" if order.is_test else ""
     order_details = (
         f"📝 <b>Детали заказа №{order.id}{test_label}</b>\n\n"
         f"<b>Статус:</b> {STATUS_MAPPING.get(order.status, 'Неизвестен')}\n"
         f"<b>Клиент:</b> {order.order_name}\n"
-        f"<b>Адрес:</b> {order.address_text}\n"
+        f"<b>Адрес:</b> {html.escape(order.address_text)}\n"
         f"<b>Дата/время:</b> {formatted_date}, {order.selected_time}\n\n"
         f"<b>Доп. услуги:</b>\n{services_text}\n\n"
         f"💰 <b>Ваша выплата:</b> {order.executor_payment} ₽"
@@ -481,13 +478,13 @@ async def executor_upload_finish(message: types.Message, session: AsyncSession,
         except (ValueError, TypeError):
             formatted_date = order.selected_date
 
-        services_text = "\n".join([f"  - {ADDITIONAL_SERVICES[item.service_key]}" for item in order.items]) or "Нет"
+        services_text = "\n".join([f"  - {get_service_catalog().display_name(item.service_key)}" for item in order.items]) or "Нет"
 
         order_details = (
             f"📝 <b>Детали заказа №{order.id}</b>\n\n"
             f"<b>Статус:</b> {STATUS_MAPPING.get(order.status, 'Неизвестен')}\n"
             f"<b>Клиент:</b> {order.order_name}, {order.order_phone}\n"
-            f"<b>Адрес:</b> {order.address_text}\n"
+            f"<b>Адрес:</b> {html.escape(order.address_text)}\n"
             f"<b>Дата/время:</b> {formatted_date}, {order.selected_time}\n\n"
             f"<b>Доп. услуги:</b>\n{services_text}\n\n"
             f"💰 <b>Ваша выплата:</b> {order.executor_payment} ₽"
@@ -500,7 +497,7 @@ async def incorrect_photo_upload(message: types.Message):
     """Ловит любые сообщения, кроме фото, в состоянии загрузки."""
     await message.answer("Пожалуйста, отправьте фотографию, а не текст или другой файл.")
 
-@router.callback_query(F.data.startswith("executor_complete_order:"))
+@router.callback_query(F.data.startswith("executor_complete_order:"), flags={"idempotent": True})
 async def executor_complete_order(callback: types.CallbackQuery, session: AsyncSession, bots: dict, config: Settings):
     """Завершает заказ и начисляет реферальный бонус, если это первый заказ."""
     order_id = int(callback.data.split(":")[1])
@@ -588,6 +585,56 @@ def format_schedule_text(schedule_data: dict) -> str:
     return text
 
 
+@router.message(F.text == "📍 Район работы")
+async def show_work_area(message: types.Message, session: AsyncSession, state: FSMContext):
+    """Показывает текущую базу и радиус выезда и просит отправить геолокацию базы."""
+    await state.clear()
+    executor = await get_user(session, message.from_user.id)
+    if executor and executor.base_lat is not None and executor.base_lon is not None:
+        text = (
+            f"📍 <b>Ваш район работы:</b> до {executor.service_radius_km or 0:.0f} км от базы.\n\n"
+            "Чтобы изменить базу, отправьте новую геолокацию."
+        )
+    else:
+        text = (
+            "📍 <b>Район работы не указан.</b>\n\n"
+            "Отправьте геолокацию места, откуда вы выезжаете на заказы, и мы будем предлагать "
+            "вам в первую очередь заказы поблизости."
+        )
+    await state.set_state(ExecutorWorkAreaStates.waiting_for_base_location)
+    await message.answer(text, reply_markup=get_base_location_keyboard())
+
+
+@router.message(ExecutorWorkAreaStates.waiting_for_base_location, F.text == "❌ Отмена")
+async def cancel_work_area(message: types.Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Район работы не изменен.", reply_markup=get_executor_main_keyboard())
+
+
+@router.message(ExecutorWorkAreaStates.waiting_for_base_location, F.location)
+async def handle_base_location(message: types.Message, state: FSMContext):
+    """Сохраняет координаты базы в FSM и предлагает выбрать радиус выезда."""
+    await state.update_data(base_lat=message.location.latitude, base_lon=message.location.longitude)
+    await state.set_state(ExecutorWorkAreaStates.choosing_service_radius)
+    await message.answer("Геолокация получена.", reply_markup=get_executor_main_keyboard())
+    await message.answer("На какое расстояние от базы вы готовы выезжать?", reply_markup=get_service_radius_keyboard())
+
+
+@router.callback_query(ExecutorWorkAreaStates.choosing_service_radius, F.data.startswith("executor_radius:"))
+async def handle_service_radius(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
+    """Сохраняет базу и радиус выезда исполнителя."""
+    radius_km = int(callback.data.split(":")[1])
+    data = await state.get_data()
+    if radius_km not in SERVICE_RADIUS_OPTIONS or "base_lat" not in data:
+        await callback.answer("Не удалось сохранить район работы, попробуйте еще раз.", show_alert=True)
+        return
+
+    await update_executor_base_location(session, callback.from_user.id, data["base_lat"], data["base_lon"], radius_km)
+    await state.clear()
+    await callback.message.edit_text(f"✅ Район работы сохранен: до {radius_km} км от базы.")
+    await callback.answer()
+
+
 @router.message(F.text == "🗓️ График работы")
 async def show_schedule_menu(message: types.Message, session: AsyncSession, state: FSMContext):
     """Отображает меню управления графиком работы."""
@@ -811,26 +858,26 @@ async def view_order_photos(callback: types.CallbackQuery, session: AsyncSession
         await callback.answer("Ошибка конфигурации: клиентский бот не найден.", show_alert=True)
         return
 
-    media_group = []
+    relayed = []
     try:
-        for photo_id in order.photo_file_ids:
-            # 1. Скачиваем файл с помощью клиент-бота
-            photo_file = await client_bot.get_file(photo_id)
-            photo_bytes_io = await client_bot.download_file(photo_file.file_path)
-            photo_bytes = photo_bytes_io.read()
+        # 1. Берем file_id из кэша пересылки, остальные файлы параллельно скачиваем с помощью клиент-бота
+        relayed = await get_relay_photos(session, client_bot, callback.bot, order.photo_file_ids)
+        media_group = [InputMediaPhoto(media=photo) for photo, _, _ in relayed]
 
-            # 2. Готовим файл для отправки
-            buffered_file = BufferedInputFile(photo_bytes, filename=f"photo_{order_id}.jpg")
-            media_group.append(InputMediaPhoto(media=buffered_file))
-
-        # 3. Отправляем медиа-группу от имени текущего (исполнительского) бота
+        # 2. Отправляем медиа-группу от имени текущего (исполнительского) бота
         if media_group:
-            await callback.message.answer_media_group(media=media_group)
+            sent_messages = await callback.message.answer_media_group(media=media_group)
+
+            # 3. Запоминаем file_id загруженных фото, чтобы в следующий раз не скачивать их заново
+            for (_, file_unique_id, from_cache), sent_message in zip(relayed, sent_messages):
+                if not from_cache:
+                    await remember_relay_photo(session, client_bot, callback.bot, file_unique_id, sent_message)
 
     except Exception as e:
         logging.error(f"Ошибка при отправке фото заказа №{order_id} исполнителю: {e}")
         await callback.answer("Произошла ошибка при загрузке фотографий.", show_alert=True)
     finally:
+        close_relay_photos(relayed)
         await callback.answer()
 
 # --- БЛОК: ЧАТ С КЛИЕНТОМ ---
@@ -888,7 +935,7 @@ async def exit_chat_executor(message: types.Message, state: FSMContext):
 
 
 @router.message(ChatStates.in_chat)
-async def forward_message_from_executor(message: types.Message, state: FSMContext, bots: dict):
+async def forward_message_from_executor(message: types.Message, state: FSMContext, session: AsyncSession, bots: dict):
     """Пересылает сообщение от исполнителя клиенту или админу."""
     user_data = await state.get_data()
     partner_id = user_data.get("chat_partner_id")
@@ -917,15 +964,16 @@ async def forward_message_from_executor(message: types.Message, state: FSMContex
         if message.text:
             await target_bot.send_message(partner_id, f"{prefix}{message.text}", reply_markup=reply_keyboard)
         elif message.photo:
-            photo_file = await message.bot.get_file(message.photo[-1].file_id)
-            photo_bytes_io = await message.bot.download_file(photo_file.file_path)
-            photo_to_send = BufferedInputFile(photo_bytes_io.read(), filename="photo.jpg")
-
-            await target_bot.send_photo(
-                chat_id=partner_id,
-                photo=photo_to_send,
-                caption=f"{prefix}{message.caption or ''}",
-                reply_markup=reply_keyboard
+            await relay_photo(
+                session, message.bot, target_bot,
+                file_id=message.photo[-1].file_id,
+                file_unique_id=message.photo[-1].file_unique_id,
+                send=lambda photo: target_bot.send_photo(
+                    chat_id=partner_id,
+                    photo=photo,
+                    caption=f"{prefix}{message.caption or ''}",
+                    reply_markup=reply_keyboard
+                )
             )
         await message.answer("✅ Ваше сообщение отправлено.")
 
@@ -1119,16 +1167,15 @@ async def finish_executor_ticket_creation(message: types.Message, state: FSMCont
         ])
 
         if photo_id:
-            photo_file = await executor_bot.get_file(photo_id)
-            photo_bytes_io = await executor_bot.download_file(photo_file.file_path)
-            photo_bytes = photo_bytes_io.read()
-            photo_to_send = BufferedInputFile(photo_bytes, filename="photo.jpg")
-
-            await admin_bot.send_photo(
-                chat_id=config.admin_id,
-                photo=photo_to_send,
-                caption=admin_caption,
-                reply_markup=go_to_ticket_keyboard
+            await relay_photo(
+                session, executor_bot, admin_bot,
+                file_id=photo_id,
+                send=lambda photo: admin_bot.send_photo(
+                    chat_id=config.admin_id,
+                    photo=photo,
+                    caption=admin_caption,
+                    reply_markup=go_to_ticket_keyboard
+                )
             )
         else:
             await admin_bot.send_message(
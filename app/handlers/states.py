@@ -39,6 +39,10 @@ class ExecutorRegistration(StatesGroup):
     waiting_for_completion_confirmation = State()
     editing_schedule = State()
 
+class ExecutorWorkAreaStates(StatesGroup):
+    waiting_for_base_location = State()
+    choosing_service_radius = State()
+
 class ChatStates(StatesGroup):
     in_chat = State()
     admin_chat = State()
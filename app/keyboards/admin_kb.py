@@ -1,6 +1,7 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app.database.models import Ticket, User, UserRole, Order, OrderStatus, UserStatus
+from app.services.service_catalog import ServiceCatalog
 
 
 def get_admin_main_keyboard() -> ReplyKeyboardMarkup:
@@ -91,8 +92,9 @@ def get_admin_orders_keyboard(counts: dict) -> InlineKeyboardMarkup:
     builder.button(text=f"⏳ В работе ({counts.get('in_progress', 0)})", callback_data="admin_orders:in_progress")
     builder.button(text=f"✅ Завершенные ({counts.get('completed', 0)})", callback_data="admin_orders:completed")
     builder.button(text=f"❌ Отмененные ({counts.get('cancelled', 0)})", callback_data="admin_orders:cancelled")
+    builder.button(text="🧮 Распределить новые заказы", callback_data="admin_batch_assign")
     builder.button(text="⬅️ Назад в главное меню", callback_data="admin_main_menu")
-    builder.adjust(2, 2, 1)
+    builder.adjust(2, 2, 1, 1)
     return builder.as_markup()
 
 
@@ -355,6 +357,7 @@ def get_tariff_management_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="🧹 Основные типы уборок", callback_data="admin_tariff:main")
     builder.button(text="➕ Дополнительные услуги", callback_data="admin_tariff:additional")
+    builder.button(text="🔄 Пересчитать открытые заказы", callback_data="admin_reprice:preview")
     builder.button(text="⬅️ Назад в настройки", callback_data="admin_settings_menu")
     builder.adjust(1)
     return builder.as_markup()
@@ -372,13 +375,11 @@ def get_main_tariffs_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_additional_services_edit_keyboard(additional_services: dict) -> InlineKeyboardMarkup:
+def get_additional_services_edit_keyboard(catalog: ServiceCatalog) -> InlineKeyboardMarkup:
     """Создает клавиатуру для выбора доп. услуги для редактирования цены."""
     builder = InlineKeyboardBuilder()
-    for key, text in additional_services.items():
-        # Убираем текущую цену из текста для чистоты
-        service_name = text.split('(')[0].strip()
-        builder.button(text=service_name, callback_data=f"admin_edit_service:{key}")
+    for item in catalog:
+        builder.button(text=item.title, callback_data=f"admin_edit_service:{item.key}")
     builder.button(text="⬅️ Назад", callback_data="admin_setting:tariffs")
     builder.adjust(1)
     return builder.as_markup()
@@ -392,6 +393,17 @@ def get_commission_management_keyboard(current_type: str, current_value: float,
     builder.button(text=f"Тип комиссии: {type_text}", callback_data="admin_commission:change_type")
     builder.button(text=f"Значение: {current_value}", callback_data="admin_commission:change_value")
     builder.button(text=f"Показывать комиссию: {show_text}", callback_data="admin_commission:toggle_show")
+    builder.button(text="🔄 Пересчитать открытые заказы", callback_data="admin_reprice:preview")
+    builder.button(text="⬅️ Назад в настройки", callback_data="admin_settings_menu")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def get_repricing_confirmation_keyboard(has_changes: bool) -> InlineKeyboardMarkup:
+    """Клавиатура под отчетом пробного пересчета открытых заказов."""
+    builder = InlineKeyboardBuilder()
+    if has_changes:
+        builder.button(text="✅ Применить и уведомить", callback_data="admin_reprice:apply")
     builder.button(text="⬅️ Назад в настройки", callback_data="admin_settings_menu")
     builder.adjust(1)
     return builder.as_markup()
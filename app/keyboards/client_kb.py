@@ -2,7 +2,8 @@ from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMar
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 import calendar
 from datetime import datetime
-from app.common.texts import STATUS_MAPPING, ADDITIONAL_SERVICES
+from app.common.texts import STATUS_MAPPING
+from app.services.service_catalog import get_service_catalog
 from app.database.models import Ticket, TicketStatus, Order, OrderStatus
 
 
@@ -173,19 +174,17 @@ def get_additional_services_keyboard(selected_services: dict = None) -> InlineKe
         selected_services = {}
 
     builder = InlineKeyboardBuilder()
-    for key, text in ADDITIONAL_SERVICES.items():
-        quantity = selected_services.get(key)
+    for item in get_service_catalog():
+        quantity = selected_services.get(item.key)
         if quantity:
-            # Убираем цену из названия, чтобы не было дублирования
-            base_text = text.split('(')[0].strip()
-            # Для услуг с количеством добавляем "шт."
-            if key in {"win", "chair"}:
-                button_text = f"✅ {base_text} ({quantity} шт.)"
+            # Для выбранной услуги показываем название без цены, чтобы не было дублирования
+            if item.per_unit:
+                button_text = f"✅ {item.title} ({quantity} шт.)"
             else:
-                button_text = f"✅ {base_text}"
+                button_text = f"✅ {item.title}"
         else:
-            button_text = text
-        builder.button(text=button_text, callback_data=f"add_service_{key}")
+            button_text = item.display_name
+        builder.button(text=button_text, callback_data=f"add_service_{item.key}")
 
     # Выстраиваем кнопки услуг в один столбец
     builder.adjust(1)
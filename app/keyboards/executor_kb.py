@@ -1,6 +1,7 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from app.database.models import OrderStatus, Order, Ticket, TicketStatus
+from app.services.geo_index import SERVICE_RADIUS_OPTIONS
 import urllib.parse
 
 def get_executor_main_keyboard() -> ReplyKeyboardMarkup:
@@ -9,10 +10,26 @@ def get_executor_main_keyboard() -> ReplyKeyboardMarkup:
         [KeyboardButton(text="🆕 Новые заказы"), KeyboardButton(text="📋 Мои заказы")],
         [KeyboardButton(text="🗓️ График работы"), KeyboardButton(text="💰 Баланс")],
         [KeyboardButton(text="⭐ Мой рейтинг"), KeyboardButton(text="👥 Реферальная программа")],
-        [KeyboardButton(text="🆘 Помощь")]
+        [KeyboardButton(text="📍 Район работы"), KeyboardButton(text="🆘 Помощь")]
     ]
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
+def get_base_location_keyboard() -> ReplyKeyboardMarkup:
+    """Возвращает клавиатуру с кнопкой отправки геолокации базы исполнителя."""
+    buttons = [
+        [KeyboardButton(text="📍 Отправить геолокацию", request_location=True)],
+        [KeyboardButton(text="❌ Отмена")]
+    ]
+    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+
+def get_service_radius_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура выбора радиуса выезда."""
+    builder = InlineKeyboardBuilder()
+    for radius_km in SERVICE_RADIUS_OPTIONS:
+        builder.button(text=f"{radius_km} км", callback_data=f"executor_radius:{radius_km}")
+    builder.adjust(3)
+    return builder.as_markup()
+
 def get_phone_request_keyboard() -> ReplyKeyboardMarkup:
     """Возвращает клавиатуру с кнопкой запроса номера телефона."""
     buttons = [
@@ -1,22 +1,50 @@
 import asyncio
 import logging
 import os
+import signal
+from contextlib import suppress
 from typing import Callable, Dict, Any, Awaitable
 import json
 
 from aiogram import Bot, Dispatcher, BaseMiddleware
 from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import TelegramObject
+from sqlalchemy import text, select, func
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from app.config import load_config, System
+from app.config import load_config
 from app.handlers import admin, client, executor
-from app.database.models import Base
-from app.scheduler import check_and_send_reminders, check_and_auto_close_tickets, check_expired_offers
-from app.services.db_queries import get_system_settings, update_system_settings
+from app.database.models import Base, SCHEMA_UPGRADES
+from app.scheduler import (check_and_send_reminders, check_and_auto_close_tickets, check_expired_offers,
+                           run_scheduled_batch_assignment, refresh_memory_indexes)
+from app.services.db_queries import (get_system_settings, update_system_settings, get_executor_locations,
+                                     sync_executor_slot_bookings, backfill_order_financial_snapshots)
 from app.services.price_calculator import TARIFFS
+from app.services.service_catalog import ServiceCatalog, DEFAULT_SERVICES
+from app.services.system_settings import parse_tariffs, parse_service_catalog, apply_system_settings
+from app.services.media_store import init_media_store
+from app.services.media_relay import flush_relay_cache_hits, trim_relay_cache
+from app.services.http_session import create_bot_session
+from app.services.yandex_maps_api import close_geocoder_client, YandexGeocoderBackend, GEOCODER_DEADLINE
+from app.services.geocoder import configure_geocoder
+from app.services.dispatch import dispatch_metrics
+from app.services.geo_index import get_executor_geo_index
+from app.services.occupancy import get_occupancy_index
+from app.services.notifier import get_notifier
+from app.services.fsm_storage import PostgresStorage
+from app.services.fsm_janitor import FsmJanitor
+from app.services.user_queue import UserQueueIsolation
+from app.services.idempotency import get_idempotency_cache
+from app.services.throttling import RateLimiter, ROUTE_DEFAULT, ROUTE_EXPENSIVE
+from app.services.runtime_stats import get_runtime_stats
+from app.services.job_coordinator import configure_job_coordinator, job_lock_id
+from app.middlewares.fsm_flush_middleware import FsmFlushMiddleware
+from app.middlewares.idempotency_middleware import IdempotencyMiddleware, CallbackAnswerRecorder
+from app.middlewares.throttling_middleware import ThrottlingMiddleware
+from app.webhook import run_webhook
 
 
 class DbSessionMiddleware(BaseMiddleware):
@@ -31,9 +59,29 @@ class DbSessionMiddleware(BaseMiddleware):
     ) -> Any:
         async with self.session_pool() as session:
             data["session"] = session
+            data["session_pool"] = self.session_pool  # Для фоновых задач, которые переживают обработчик
             return await handler(event, data)
 
 
+async def run_polling(dispatchers: list[tuple[Dispatcher, Bot]], stop_event: asyncio.Event):
+    """
+    Запускает long polling всех ботов и прекращает прием апдейтов по stop_event.
+    Сигналы aiogram не перехватывает (иначе каждый Dispatcher ставит свой обработчик и останавливается только один),
+    а HTTP-сессию не закрывает - она общая и нужна до конца остановки.
+    """
+    polling = asyncio.gather(*(
+        dp.start_polling(bot, handle_signals=False, close_bot_session=False) for dp, bot in dispatchers
+    ))
+    stop_wait = asyncio.create_task(stop_event.wait())
+    await asyncio.wait({polling, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+    stop_wait.cancel()
+    if not polling.done():
+        for dp, _ in dispatchers:
+            with suppress(RuntimeError):  # Polling этого бота уже остановлен
+                await dp.stop_polling()
+    await polling
+
+
 # --- НОВЫЙ БЛОК ДЛЯ УНИВЕРСАЛЬНОГО ЛОГИРОВАНИЯ ---
 
 class ContextFilter(logging.Filter):
@@ -72,7 +120,12 @@ async def main():
     engine = create_async_engine(DATABASE_URL, echo=False)
     session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     async with engine.begin() as conn:
+        if config.cluster.enabled:
+            # Копии бота, запущенные одновременно, обновляют схему по очереди
+            await conn.execute(select(func.pg_advisory_xact_lock(job_lock_id("schema_upgrade"))))
         await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
 
     # --- БЛОК ЗАГРУЗКИ СИСТЕМНЫХ НАСТРОЕК ПРИ СТАРТЕ ---
     async with session_maker() as session:
@@ -81,57 +134,94 @@ async def main():
             # Если настроек в БД нет, создаем их со значениями по умолчанию из модели
             system_settings = await update_system_settings(session, {})
 
-        # Десериализуем JSON-строки в словари
-        try:
-            tariffs_dict = json.loads(system_settings.tariffs) if isinstance(system_settings.tariffs,
-                                                                             str) else system_settings.tariffs or {}
-        except (json.JSONDecodeError, TypeError):
-            tariffs_dict = {}
-
-            # Если в базе нет тарифов, загружаем их из файла-константы
-        if not tariffs_dict:
-            tariffs_dict = TARIFFS
-            await update_system_settings(session, {"tariffs": json.dumps(tariffs_dict, ensure_ascii=False)})
-            system_settings.tariffs = json.dumps(tariffs_dict, ensure_ascii=False)
-
-        try:
-            services_dict = json.loads(system_settings.additional_services) if isinstance(
-                system_settings.additional_services, str) else system_settings.additional_services or {}
-        except (json.JSONDecodeError, TypeError):
-            services_dict = {}
-
-            # Если в базе нет доп. услуг, загружаем их из файла-константы
-        if not services_dict:
-            from app.common.texts import ADDITIONAL_SERVICES
-            services_dict = ADDITIONAL_SERVICES
-            await update_system_settings(session,
-                                         {"additional_services": json.dumps(services_dict, ensure_ascii=False)})
-            # Обновляем локальную переменную, чтобы не перезапрашивать из БД
-            system_settings.additional_services = json.dumps(services_dict, ensure_ascii=False)
-
-            # Заполняем объект config.system данными из БД
-        config.system = System(
-            commission_type=system_settings.commission_type,
-            commission_value=system_settings.commission_value,
-            test_mode_enabled=system_settings.test_mode_enabled,
-            show_commission_to_executor=system_settings.show_commission_to_executor,
-            tariffs=tariffs_dict,
-            additional_services=services_dict
-        )
+        # Если в базе нет тарифов, сохраняем тарифы из файла-константы
+        if not parse_tariffs(system_settings.tariffs):
+            await update_system_settings(session, {"tariffs": json.dumps(TARIFFS, ensure_ascii=False)})
+
+        # Если в базе нет доп. услуг, берем каталог по умолчанию.
+        # Сохраняем каталог в структурированном виде (заодно переводим старый формат со строками)
+        service_catalog = parse_service_catalog(system_settings.additional_services) or ServiceCatalog(DEFAULT_SERVICES)
+        if system_settings.additional_services != service_catalog.to_json():
+            await update_system_settings(session, {"additional_services": service_catalog.to_json()})
+
+        # Заполняем config.system, каталог доп. услуг и расчетчик цен данными из БД
+        apply_system_settings(config, system_settings)
+        # Старым заказам - первую версию финансового снимка (новые получают ее при создании)
+        backfilled = await backfill_order_financial_snapshots(session)
+        if backfilled:
+            logging.info(f"Записаны финансовые снимки существующих заказов: {backfilled}")
+
+        # Загружаем базы исполнителей в геоиндекс
+        geo_index = get_executor_geo_index()
+        geo_index.load(await get_executor_locations(session))
+        logging.info(f"Геоиндекс исполнителей загружен: {len(geo_index)}")
+
+        # Загружаем занятые слоты исполнителей (заодно досоздаем слоты для заказов, назначенных раньше)
+        occupancy = get_occupancy_index()
+        occupancy.load(await sync_executor_slot_bookings(session))
+        logging.info(f"Индекс занятости исполнителей загружен: {len(occupancy)}")
     # --- КОНЕЦ БЛОКА ЗАГРУЗКИ ---
 
+    # Локальный кэш медиафайлов, пересылаемых между ботами
+    media_store = await init_media_store(config.media_cache.directory, config.media_cache.max_bytes)
+    geocoder = configure_geocoder(
+        YandexGeocoderBackend(config.api_keys.yandex_api_key, config.api_keys.geocoder_url),
+        GEOCODER_DEADLINE
+    )
 
-    client_bot = Bot(token=config.bots.client_bot_token, default=DefaultBotProperties(parse_mode="HTML"))
-    executor_bot = Bot(token=config.bots.executor_bot_token, default=DefaultBotProperties(parse_mode="HTML"))
-    admin_bot = Bot(token=config.bots.admin_bot_token, default=DefaultBotProperties(parse_mode="HTML"))
-
-    client_dp = Dispatcher()
-    executor_dp = Dispatcher()
-    admin_dp = Dispatcher()
+    # Все боты ходят в Telegram через один общий пул соединений
+    bot_session = create_bot_session(config.http_pool)
+    client_bot = Bot(token=config.bots.client_bot_token, session=bot_session, default=DefaultBotProperties(parse_mode="HTML"))
+    executor_bot = Bot(token=config.bots.executor_bot_token, session=bot_session, default=DefaultBotProperties(parse_mode="HTML"))
+    admin_bot = Bot(token=config.bots.admin_bot_token, session=bot_session, default=DefaultBotProperties(parse_mode="HTML"))
+
+    # Одно хранилище FSM на все три бота (ключи различаются по bot_id)
+    if config.fsm.storage == "postgres":
+        fsm_storage = PostgresStorage(session_maker, user_budget_bytes=config.fsm.user_budget_bytes)
+    else:
+        fsm_storage = MemoryStorage()
+    fsm_janitor = FsmJanitor(
+        fsm_storage,
+        total_budget_bytes=config.fsm.total_budget_bytes,
+        user_budget_bytes=config.fsm.user_budget_bytes
+    )
+    # Апдейты одного пользователя выполняются по очереди, разных пользователей - параллельно
+    update_queue = UserQueueIsolation(workers=config.updates.workers)
+    client_dp = Dispatcher(storage=fsm_storage, events_isolation=update_queue)
+    executor_dp = Dispatcher(storage=fsm_storage, events_isolation=update_queue)
+    admin_dp = Dispatcher(storage=fsm_storage, events_isolation=update_queue)
+
+    # Дубли колбэков (повторная доставка, двойное нажатие) не обрабатываются повторно
+    idempotency_cache = get_idempotency_cache()
+    bot_session.middleware(CallbackAnswerRecorder(idempotency_cache))
+    client_dp.callback_query.middleware(IdempotencyMiddleware(idempotency_cache))
+    executor_dp.callback_query.middleware(IdempotencyMiddleware(idempotency_cache))
+    admin_dp.callback_query.middleware(IdempotencyMiddleware(idempotency_cache))
+    client_dp.message.middleware(IdempotencyMiddleware(idempotency_cache))
+    executor_dp.message.middleware(IdempotencyMiddleware(idempotency_cache))
+    admin_dp.message.middleware(IdempotencyMiddleware(idempotency_cache))
+
+    rate_limiter = RateLimiter({
+        ROUTE_DEFAULT: (config.throttling.rate, config.throttling.burst),
+        ROUTE_EXPENSIVE: (config.throttling.expensive_rate, config.throttling.expensive_burst)
+    })
+    if config.throttling.enabled:
+        # Лимиты частоты запросов на пользователя (владелец бота не ограничивается)
+        client_dp.callback_query.middleware(ThrottlingMiddleware(rate_limiter, config.admin_id))
+        executor_dp.callback_query.middleware(ThrottlingMiddleware(rate_limiter, config.admin_id))
+        admin_dp.callback_query.middleware(ThrottlingMiddleware(rate_limiter, config.admin_id))
+        client_dp.message.middleware(ThrottlingMiddleware(rate_limiter, config.admin_id))
+        executor_dp.message.middleware(ThrottlingMiddleware(rate_limiter, config.admin_id))
+        admin_dp.message.middleware(ThrottlingMiddleware(rate_limiter, config.admin_id))
 
     client_dp.update.middleware(DbSessionMiddleware(session_pool=session_maker))
     executor_dp.update.middleware(DbSessionMiddleware(session_pool=session_maker))
     admin_dp.update.middleware(DbSessionMiddleware(session_pool=session_maker))
+    if isinstance(fsm_storage, PostgresStorage):
+        # Изменения FSM за время обработки апдейта сохраняются одной записью
+        client_dp.update.outer_middleware(FsmFlushMiddleware(fsm_storage))
+        executor_dp.update.outer_middleware(FsmFlushMiddleware(fsm_storage))
+        admin_dp.update.outer_middleware(FsmFlushMiddleware(fsm_storage))
 
     bots = {"client": client_bot, "executor": executor_bot, "admin": admin_bot}
     client_dp["bots"] = bots
@@ -145,41 +235,121 @@ async def main():
     executor_dp.include_router(executor.router)
     admin_dp.include_router(admin.router)
 
+    # Статистика сервисов: периодически и при остановке пишется в лог
+    runtime_stats = get_runtime_stats()
+    runtime_stats.register("Статистика медиа-кэша", media_store.stats)
+    runtime_stats.register("Статистика очереди уведомлений", get_notifier().stats)
+    runtime_stats.register("Статистика HTTP-пула ботов", bot_session.stats)
+    runtime_stats.register("Статистика геокодера", geocoder.stats)
+    runtime_stats.register("Статистика рассылки заказов", dispatch_metrics.stats)
+    runtime_stats.register("Отклонено назначений из-за занятого слота", lambda: occupancy.conflicts_rejected)
+    if isinstance(fsm_storage, PostgresStorage):
+        runtime_stats.register("Статистика хранилища FSM", fsm_storage.stats)
+    runtime_stats.register("Статистика очистки FSM", fsm_janitor.stats)
+    runtime_stats.register("Статистика очереди апдейтов", update_queue.stats)
+    runtime_stats.register("Отброшено дублей апдейтов", idempotency_cache.stats)
+    runtime_stats.register("Статистика ограничения частоты запросов", rate_limiter.stats)
+
+    # При нескольких копиях бота каждую задачу планировщика в каждый момент выполняет только одна из них
+    jobs = configure_job_coordinator(engine, enabled=config.cluster.enabled)
+    runtime_stats.register("Статистика задач планировщика", jobs.stats)
     scheduler = AsyncIOScheduler(timezone="Asia/Yekaterinburg")
     scheduler.add_job(
-        check_and_send_reminders,
+        jobs.exclusive(check_and_send_reminders),
         trigger="interval",
         seconds=60,
         kwargs={"bots": bots, "session_pool": session_maker, "admin_id": config.admin_id}
     )
     # Новая задача для автозакрытия тикетов (проверка каждые 10 минут)
     scheduler.add_job(
-        check_and_auto_close_tickets,
+        jobs.exclusive(check_and_auto_close_tickets),
         trigger="interval",
         minutes=10,
         kwargs={"bot": client_bot, "session_pool": session_maker}
     )
     scheduler.add_job(
-        check_expired_offers,
+        jobs.exclusive(check_expired_offers),
         trigger="interval",
         seconds=30,  # Проверяем каждые 30 секунд
         kwargs={"bots": bots, "session_pool": session_maker, "admin_id": config.admin_id, "config": config}
     )
+    # Кэш пересылки медиа: каждая копия записывает свои попадания, а лишние записи удаляет одна из них
+    scheduler.add_job(flush_relay_cache_hits, trigger="interval", minutes=5, kwargs={"session_pool": session_maker})
+    scheduler.add_job(jobs.exclusive(trim_relay_cache), trigger="interval", minutes=30,
+                      kwargs={"session_pool": session_maker})
+    # Удаление брошенных сценариев и контроль объема данных FSM
+    scheduler.add_job(jobs.exclusive(fsm_janitor.sweep), trigger="interval", minutes=config.fsm.janitor_interval_minutes)
+    if config.dispatch.batch_interval_minutes:
+        # Пакетное распределение накопившихся новых заказов
+        scheduler.add_job(
+            jobs.exclusive(run_scheduled_batch_assignment),
+            trigger="interval",
+            minutes=config.dispatch.batch_interval_minutes,
+            kwargs={"bots": bots, "session_pool": session_maker, "config": config}
+        )
+    if config.cluster.enabled:
+        # Базы исполнителей, занятые слоты и настройки цен могли измениться в других копиях
+        scheduler.add_job(
+            refresh_memory_indexes,
+            trigger="interval",
+            minutes=config.cluster.index_refresh_minutes,
+            kwargs={"session_pool": session_maker, "config": config}
+        )
+    if config.monitoring.stats_interval_minutes:
+        scheduler.add_job(runtime_stats.log, trigger="interval", minutes=config.monitoring.stats_interval_minutes)
     scheduler.start()
 
+    # Сигналы остановки обрабатываем сами, чтобы провести остановку по шагам (см. finally)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):  # Windows
+            loop.add_signal_handler(sig, stop_event.set)
+
     try:
-        await asyncio.gather(
-            client_dp.start_polling(client_bot),
-            executor_dp.start_polling(executor_bot),
-            admin_dp.start_polling(admin_bot),
-        )
+        if config.webhook.enabled:
+            # Все три бота принимают апдейты через один HTTP-сервер
+            await run_webhook(
+                {"client": (client_dp, client_bot), "executor": (executor_dp, executor_bot), "admin": (admin_dp, admin_bot)},
+                config.webhook,
+                reuse_port=config.cluster.enabled,
+                stop_event=stop_event,
+                drain_timeout=config.shutdown.drain_timeout
+            )
+        else:
+            await run_polling(
+                [(client_dp, client_bot), (executor_dp, executor_bot), (admin_dp, admin_bot)],
+                stop_event
+            )
     finally:
-        scheduler.shutdown()
-        await client_bot.session.close()
-        await executor_bot.session.close()
-        await admin_bot.session.close()
+        # 1. Прием апдейтов остановлен; новые запуски задач планировщика не начинаются
+        logging.info("Остановка: прием апдейтов прекращен")
+        scheduler.pause()
+
+        # 2. Дожидаемся уже принятых апдейтов и выполняющихся задач планировщика (общий срок)
+        # (в режиме вебхуков принятые апдейты уже дождался run_webhook)
+        deadline = loop.time() + config.shutdown.drain_timeout
+        pending_updates = await update_queue.drain(timeout=0 if config.webhook.enabled else config.shutdown.drain_timeout)
+        pending_jobs = await jobs.drain(timeout=max(0.0, deadline - loop.time()))
+        if pending_updates or pending_jobs:
+            logging.warning(f"Остановка: не дождались апдейтов - {pending_updates}, задач планировщика - {pending_jobs}")
+
+        # 3. Досылаем уведомления фоновых задач, пока открыта HTTP-сессия ботов (в пределах того же срока)
+        notifier = get_notifier()
+        await notifier.drain(timeout=max(0.0, deadline - loop.time()))
+
+        # 4. Сохраняем состояние: прогресс задач планировщика уже записан в scheduler_job_state,
+        # остается остановить планировщик и записать в БД несохраненные изменения FSM
+        scheduler.shutdown(wait=False)
+        await fsm_storage.close()
+
+        await runtime_stats.log()
+        await bot_session.close()
+        await close_geocoder_client()
+
+        # 5. Закрываем соединения с БД
         await engine.dispose()
-
+        logging.info("Остановка завершена")
 
 if __name__ == "__main__":
     try:
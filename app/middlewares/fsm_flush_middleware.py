@@ -0,0 +1,29 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.services.fsm_storage import PostgresStorage
+
+
+class FsmFlushMiddleware(BaseMiddleware):
+    """
+    Мидлварь, в рамках которой обработчики апдейта работают с FSM в памяти:
+    ключ загружается один раз, а изменения сохраняются одной записью после обработки апдейта.
+    Регистрируется как outer-мидлварь апдейтов, после встроенной FSM-мидлвари aiogram.
+    """
+
+    def __init__(self, storage: PostgresStorage):
+        self.storage = storage
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        state = data.get("state")
+        if state is None:
+            return await handler(event, data)
+        async with self.storage.update_scope(state.key):
+            return await handler(event, data)
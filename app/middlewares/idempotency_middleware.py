@@ -0,0 +1,76 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.methods import AnswerCallbackQuery, TelegramMethod
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from app.services.idempotency import IdempotencyCache
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """
+    Мидлварь, которая не дает повторно выполнить обработчик для дубля апдейта.
+    Колбэк с уже обработанным id (повторная доставка) - всегда дубль. Для обработчиков с флагом idempotent
+    дублем считается и повтор той же кнопки того же сообщения (или того же текста в том же чате) в пределах TTL.
+    Дубль колбэка получает ответ, который получил оригинал; дубль сообщения просто пропускается.
+    Регистрируется как inner-мидлварь колбэков и сообщений (флаги обработчика доступны только там).
+    """
+
+    def __init__(self, cache: IdempotencyCache):
+        self.cache = cache
+
+    @staticmethod
+    def _keys(event: TelegramObject, data: Dict[str, Any]) -> list[tuple]:
+        bot_id = data["bot"].id
+        idempotent = get_flag(data, "idempotent")
+        if isinstance(event, CallbackQuery):
+            keys = [("callback", event.id)]
+            if idempotent:
+                message_id = event.message.message_id if event.message else event.inline_message_id
+                keys.append(("button", bot_id, event.from_user.id, message_id, event.data))
+            return keys
+        if isinstance(event, Message) and idempotent and event.from_user:
+            return [("message", bot_id, event.chat.id, event.from_user.id, event.text)]
+        return []
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        keys = self._keys(event, data)
+        if not keys:
+            return await handler(event, data)
+
+        duplicate = self.cache.lookup(keys)
+        if duplicate is not None:
+            if isinstance(event, CallbackQuery):
+                text, show_alert = duplicate.answer or (None, False)
+                await event.answer(text=text, show_alert=show_alert)
+            return None
+
+        callback_id = event.id if isinstance(event, CallbackQuery) else None
+        self.cache.remember(keys, callback_id)
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.cache.forget(keys)
+            raise
+        finally:
+            if callback_id:
+                self.cache.finish(callback_id)
+
+
+class CallbackAnswerRecorder(BaseRequestMiddleware):
+    """Мидлварь HTTP-сессии ботов: запоминает ответы на колбэки для IdempotencyMiddleware."""
+
+    def __init__(self, cache: IdempotencyCache):
+        self.cache = cache
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        if isinstance(method, AnswerCallbackQuery):
+            self.cache.record_answer(method.callback_query_id, method.text, method.show_alert)
+        return await make_request(bot, method)
@@ -0,0 +1,43 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from app.services.throttling import RateLimiter, ROUTE_DEFAULT
+
+THROTTLED_TEXT = "⏳ Слишком много запросов. Подождите несколько секунд и попробуйте снова."
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Мидлварь защиты от флуда: перед вызовом обработчика списывает токен из корзины (пользователь, класс обработчика).
+    Класс задается флагом обработчика throttling (например, flags={"throttling": "expensive"}), по умолчанию - default.
+    При исчерпании лимита обработчик не вызывается, а пользователь один раз получает мягкое предупреждение.
+    Владелец бота (ADMIN_ID) не ограничивается. Регистрируется как inner-мидлварь (нужны флаги обработчика).
+    """
+
+    def __init__(self, limiter: RateLimiter, admin_id: int):
+        self.limiter = limiter
+        self.admin_id = admin_id
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id == self.admin_id:
+            return await handler(event, data)
+
+        allowed, warn = self.limiter.hit(user.id, get_flag(data, "throttling", default=ROUTE_DEFAULT))
+        if allowed:
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery):
+            # На колбэк отвечаем всегда, иначе у пользователя будут висеть "часики"
+            await event.answer(THROTTLED_TEXT if warn else None)
+        elif isinstance(event, Message) and warn:
+            await event.answer(THROTTLED_TEXT)
+        return None
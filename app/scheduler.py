@@ -1,93 +1,164 @@
 import datetime
+import html
+from sqlalchemy import update
 from sqlalchemy.future import select
 from aiogram import Bot
 
 from app.database.models import Order, OrderStatus, Ticket, TicketStatus, OrderOffer
 from app.common.texts import RUSSIAN_MONTHS_GENITIVE
 from app.handlers.client import TYUMEN_TZ
-from app.services.db_queries import get_order_by_id, get_matching_executors
+from app.services.db_queries import (get_order_by_id, count_active_offers, get_executor_locations,
+                                     get_executor_slot_bookings, get_job_last_run, set_job_last_run,
+                                     get_system_settings)
+from app.services.geo_index import get_executor_geo_index
+from app.services.occupancy import get_occupancy_index
+from app.services.notifier import get_notifier
+from app.services.dispatch import find_and_notify_executors, run_batch_assignment_job
+from app.services.system_settings import apply_system_settings
 from app.config import Settings
 
 
+# Сколько строк задача забирает за одну короткую транзакцию
+CLAIM_BATCH_SIZE = 50
+# Насколько назад задача напоминаний догоняет пропущенные окна (например, пока бот перезапускался)
+REMINDER_MAX_CATCH_UP = datetime.timedelta(hours=1)
+# Сколько после наступления момента напоминания его еще можно отправить (повтор после неудачной отправки)
+REMINDER_RETRY_WINDOW = datetime.timedelta(minutes=15)
+REMINDERS_JOB = "check_and_send_reminders"
+
+
+def _order_datetime(order: Order) -> datetime.datetime:
+    order_time_str = f"{order.selected_date} {order.selected_time.split(' ')[0]}"
+    return datetime.datetime.strptime(order_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=TYUMEN_TZ)
+
+
+async def _claim_orders_for_reminder(session_pool, statuses: list, sent_flag, window_from: datetime.datetime,
+                                     window_to: datetime.datetime):
+    """
+    Забирает порциями (SELECT ... FOR UPDATE SKIP LOCKED) заказы, начало которых попадает в окно напоминания,
+    и в той же короткой транзакции отмечает напоминание отправленным. Выдает порции уже после коммита,
+    поэтому отправка сообщений не держит блокировок, а строки, занятые другой копией или обработчиком, пропускаются.
+    Если отправка потом не удастся, флаг снимает _reminder_retry, и заказ снова попадет в выборку.
+    """
+    dates = sorted({window_from.date().isoformat(), window_to.date().isoformat()})
+    last_id = 0
+    while True:
+        async with session_pool() as session:
+            result = await session.execute(
+                select(Order)
+                .where(
+                    Order.status.in_(statuses),
+                    sent_flag == False,
+                    Order.selected_date.in_(dates),
+                    Order.id > last_id
+                )
+                .order_by(Order.id)
+                .limit(CLAIM_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            orders = result.scalars().all()
+            if not orders:
+                return
+            last_id = orders[-1].id
+
+            due_orders = []
+            for order in orders:
+                try:
+                    order_datetime = _order_datetime(order)
+                except (AttributeError, ValueError) as e:
+                    print(f"Некорректные дата и время у заказа {order.id}: {e}")
+                    continue
+                if window_from < order_datetime <= window_to:
+                    setattr(order, sent_flag.key, True)
+                    due_orders.append(order)
+            await session.commit()
+        if due_orders:
+            yield due_orders
+
+
+def _reminder_retry(session_pool, order_id: int, sent_flag):
+    """Возвращает обработчик неудачной отправки для Notifier: снимает флаг напоминания, чтобы следующий запуск повторил его."""
+    async def retry():
+        async with session_pool() as session:
+            await session.execute(update(Order).where(Order.id == order_id).values({sent_flag.key: False}))
+            await session.commit()
+    return retry
+
+
 async def check_and_send_reminders(bots: dict, session_pool, admin_id: int):
     """
     Проверяет заказы и отправляет напоминания за 24 и 2 часа клиентам и исполнителям.
+    Сообщения уходят через очередь отправки; если отправка не удалась по временной причине,
+    флаг напоминания снимается, и следующий запуск (в пределах REMINDER_RETRY_WINDOW) повторит его.
+    Окно проверки начинается с момента, до которого задача отработала в прошлый раз (хранится в БД),
+    поэтому напоминания, пропущенные пока бот перезапускался, тоже отправляются.
     """
     now_tyumen = datetime.datetime.now(TYUMEN_TZ)
-    remind_at_24h_from = now_tyumen + datetime.timedelta(hours=24, minutes=-1)
+    async with session_pool() as session:
+        last_run = await get_job_last_run(session, REMINDERS_JOB)
+    window_start = now_tyumen - REMINDER_RETRY_WINDOW
+    if last_run:
+        window_start = min(window_start, max(last_run.replace(tzinfo=TYUMEN_TZ), now_tyumen - REMINDER_MAX_CATCH_UP))
+    remind_at_24h_from = window_start + datetime.timedelta(hours=24)
     remind_at_24h_to = now_tyumen + datetime.timedelta(hours=24)
-    remind_at_2h_from = now_tyumen + datetime.timedelta(hours=2, minutes=-1)
+    remind_at_2h_from = window_start + datetime.timedelta(hours=2)
     remind_at_2h_to = now_tyumen + datetime.timedelta(hours=2)
 
     client_bot = bots.get("client")
     executor_bot = bots.get("executor")
+    notifier = get_notifier()
 
-    async with session_pool() as session:
-        # --- Поиск заказов для 24-часового напоминания ---
-        stmt_24h = select(Order).where(
-            Order.status.in_([OrderStatus.accepted]),  # Напоминаем только по принятым заказам
-            Order.reminder_24h_sent == False
-        )
-        orders_to_check_24h = await session.execute(stmt_24h)
-        for order in orders_to_check_24h.scalars().all():
+    # --- 24-часовое напоминание (только по принятым заказам) ---
+    async for orders in _claim_orders_for_reminder(
+            session_pool, [OrderStatus.accepted], Order.reminder_24h_sent, remind_at_24h_from, remind_at_24h_to
+    ):
+        for order in orders:
             try:
-                order_time_str = f"{order.selected_date} {order.selected_time.split(' ')[0]}"
-                aware_order_datetime = datetime.datetime.strptime(order_time_str, "%Y-%m-%d %H:%M").replace(
-                    tzinfo=TYUMEN_TZ)
+                selected_date = datetime.datetime.strptime(order.selected_date, "%Y-%m-%d")
+            except ValueError as e:
+                print(f"Ошибка при обработке 24h напоминания для заказа {order.id}: {e}")
+                continue
+            formatted_date = f"{selected_date.day} {RUSSIAN_MONTHS_GENITIVE.get(selected_date.month)} {selected_date.year}"
+            retry = _reminder_retry(session_pool, order.id, Order.reminder_24h_sent)
 
-                if remind_at_24h_from < aware_order_datetime <= remind_at_24h_to:
-                    selected_date = datetime.datetime.strptime(order.selected_date, "%Y-%m-%d")
-                    formatted_date = f"{selected_date.day} {RUSSIAN_MONTHS_GENITIVE.get(selected_date.month)} {selected_date.year}"
+            # Напоминание клиенту
+            client_text = f"👋 Напоминаем, что завтра, {formatted_date} в {order.selected_time}, у вас запланирована уборка по адресу: {html.escape(order.address_text)}."
+            notifier.enqueue(client_bot, order.client_tg_id, client_text, on_failure=retry)
 
-                    # Напоминание клиенту
-                    client_text = f"👋 Напоминаем, что завтра, {formatted_date} в {order.selected_time}, у вас запланирована уборка по адресу: {order.address_text}."
-                    await client_bot.send_message(chat_id=order.client_tg_id, text=client_text)
+            # Напоминание исполнителю
+            if order.executor_tg_id:
+                executor_text = f"👋 Напоминаем: завтра, {formatted_date} в {order.selected_time}, у вас запланирован заказ №{order.id} по адресу: {html.escape(order.address_text)}."
+                notifier.enqueue(executor_bot, order.executor_tg_id, executor_text, on_failure=retry)
 
-                    # Напоминание исполнителю
-                    if order.executor_tg_id:
-                        executor_text = f"👋 Напоминаем: завтра, {formatted_date} в {order.selected_time}, у вас запланирован заказ №{order.id} по адресу: {order.address_text}."
-                        await executor_bot.send_message(chat_id=order.executor_tg_id, text=executor_text)
+    # --- 2-часовое напоминание ---
+    async for orders in _claim_orders_for_reminder(
+            session_pool, [OrderStatus.new, OrderStatus.accepted], Order.reminder_2h_sent, remind_at_2h_from, remind_at_2h_to
+    ):
+        for order in orders:
+            retry = _reminder_retry(session_pool, order.id, Order.reminder_2h_sent)
+            if order.status == OrderStatus.accepted:
+                # Напоминание клиенту
+                client_text = f"🕒 Уборка начнется через 2 часа! Наш клинер скоро будет у вас по адресу: {html.escape(order.address_text)}."
+                notifier.enqueue(client_bot, order.client_tg_id, client_text, on_failure=retry)
 
-                    order.reminder_24h_sent = True
-            except Exception as e:
-                print(f"Ошибка при обработке 24h напоминания для заказа {order.id}: {e}")
+                # Напоминание исполнителю
+                if order.executor_tg_id:
+                    executor_text = f"🕒 Уборка по заказу №{order.id} начнется через 2 часа! Не забудьте вовремя нажать '🚀 В пути'."
+                    notifier.enqueue(executor_bot, order.executor_tg_id, executor_text, on_failure=retry)
 
-        # --- Поиск заказов для 2-часового напоминания ---
-        stmt_2h = select(Order).where(
-            Order.status.in_([OrderStatus.new, OrderStatus.accepted]),
-            Order.reminder_2h_sent == False
-        )
-        orders_to_check_2h = await session.execute(stmt_2h)
-        for order in orders_to_check_2h.scalars().all():
-            try:
-                order_time_str = f"{order.selected_date} {order.selected_time.split(' ')[0]}"
-                aware_order_datetime = datetime.datetime.strptime(order_time_str, "%Y-%m-%d %H:%M").replace(
-                    tzinfo=TYUMEN_TZ)
-
-                if remind_at_2h_from < aware_order_datetime <= remind_at_2h_to:
-                    if order.status == OrderStatus.accepted:
-                        # Напоминание клиенту
-                        client_text = f"🕒 Уборка начнется через 2 часа! Наш клинер скоро будет у вас по адресу: {order.address_text}."
-                        await client_bot.send_message(chat_id=order.client_tg_id, text=client_text)
-
-                        # Напоминание исполнителю
-                        if order.executor_tg_id:
-                            executor_text = f"🕒 Уборка по заказу №{order.id} начнется через 2 часа! Не забудьте вовремя нажать '🚀 В пути'."
-                            await executor_bot.send_message(chat_id=order.executor_tg_id, text=executor_text)
-
-                    elif order.status == OrderStatus.new:
-                        # Если исполнитель НЕ назначен - бьем тревогу админу
-                        text = f"⚠️ <b>СРОЧНО!</b> Не найден исполнитель для заказа №{order.id}, который начинается через 2 часа!"
-                        await bots["admin"].send_message(chat_id=admin_id, text=text)
-                    order.reminder_2h_sent = True
-            except Exception as e:
-                print(f"Ошибка при обработке 2h напоминания для заказа {order.id}: {e}")
+            elif order.status == OrderStatus.new:
+                # Если исполнитель НЕ назначен - бьем тревогу админу
+                text = f"⚠️ <b>СРОЧНО!</b> Не найден исполнитель для заказа №{order.id}, который начинается через 2 часа!"
+                notifier.enqueue(bots["admin"], admin_id, text, on_failure=retry)
+
+    async with session_pool() as session:
+        await set_job_last_run(session, REMINDERS_JOB, now_tyumen.replace(tzinfo=None))
 
-        await session.commit()
 
 async def check_and_auto_close_tickets(bot: Bot, session_pool):
     """
     Проверяет тикеты со статусом 'Ответ получен' и закрывает их, если нет активности.
+    Каждый переход (напоминание, закрытие) - один UPDATE ... RETURNING, а уведомления уходят через очередь отправки.
     """
     now = datetime.datetime.now()
     # Временные рамки
@@ -95,91 +166,115 @@ async def check_and_auto_close_tickets(bot: Bot, session_pool):
     h48_ago = now - datetime.timedelta(hours=48)
 
     async with session_pool() as session:
-        # 1. Ищем тикеты для отправки 24-часового предупреждения
-        stmt_remind = select(Ticket).where(
-            Ticket.status == TicketStatus.answered,
-            Ticket.updated_at < h24_ago,
-            Ticket.autoclose_reminder_sent == False
+        # 1. Отмечаем тикеты для отправки 24-часового предупреждения
+        result = await session.execute(
+            update(Ticket)
+            .where(
+                Ticket.status == TicketStatus.answered,
+                Ticket.updated_at < h24_ago,
+                Ticket.autoclose_reminder_sent == False
+            )
+            .values(autoclose_reminder_sent=True)
+            .returning(Ticket.id, Ticket.user_tg_id)
+            .execution_options(synchronize_session=False)
         )
-        tickets_to_remind = await session.execute(stmt_remind)
-        for ticket in tickets_to_remind.scalars().all():
-            try:
-                text = (
-                    f"👋 Напоминаем по вашему обращению №{ticket.id}.\n\n"
-                    f"Если ваш вопрос не решен, пожалуйста, ответьте на это сообщение. "
-                    f"В противном случае, обращение будет автоматически закрыто через 24 часа."
-                )
-                await bot.send_message(chat_id=ticket.user_tg_id, text=text)
-                ticket.autoclose_reminder_sent = True
-            except Exception as e:
-                print(f"Ошибка при отправке 24ч напоминания по тикету {ticket.id}: {e}")
+        tickets_to_remind = result.all()
+        await session.commit()
 
-        # 2. Ищем тикеты для автозакрытия
-        stmt_close = select(Ticket).where(
-            Ticket.status == TicketStatus.answered,
-            Ticket.updated_at < h48_ago
+        # 2. Закрываем тикеты без активности
+        result = await session.execute(
+            update(Ticket)
+            .where(Ticket.status == TicketStatus.answered, Ticket.updated_at < h48_ago)
+            .values(status=TicketStatus.closed, was_autoclosed=True)
+            .returning(Ticket.id, Ticket.user_tg_id)
+            .execution_options(synchronize_session=False)
         )
-        tickets_to_close = await session.execute(stmt_close)
-        for ticket in tickets_to_close.scalars().all():
-            try:
-                ticket.status = TicketStatus.closed
-                ticket.was_autoclosed = True
-                text = (
-                    f"✅ Ваше обращение №{ticket.id} было автоматически закрыто, "
-                    f"так как мы не получили от вас ответа в течение 48 часов. "
-                    f"Если проблема осталась, создайте, пожалуйста, новое обращение."
-                )
-                await bot.send_message(chat_id=ticket.user_tg_id, text=text)
-            except Exception as e:
-                print(f"Ошибка при автозакрытии тикета {ticket.id}: {e}")
-
+        tickets_to_close = result.all()
         await session.commit()
 
+    notifier = get_notifier()
+    for ticket in tickets_to_remind:
+        notifier.enqueue(bot, ticket.user_tg_id, (
+            f"👋 Напоминаем по вашему обращению №{ticket.id}.\n\n"
+            f"Если ваш вопрос не решен, пожалуйста, ответьте на это сообщение. "
+            f"В противном случае, обращение будет автоматически закрыто через 24 часа."
+        ))
+    for ticket in tickets_to_close:
+        notifier.enqueue(bot, ticket.user_tg_id, (
+            f"✅ Ваше обращение №{ticket.id} было автоматически закрыто, "
+            f"так как мы не получили от вас ответа в течение 48 часов. "
+            f"Если проблема осталась, создайте, пожалуйста, новое обращение."
+        ))
+
 
 async def check_expired_offers(bots: dict, session_pool, admin_id: int, config: Settings):
     """
-    Проверяет истекшие предложения по заказам и передает их следующим исполнителям.
+    Проверяет истекшие предложения по заказам и передает заказы следующим исполнителям.
+    Предложения забираются порциями (SKIP LOCKED), а каждый заказ обрабатывается в своей короткой сессии.
     """
     now = datetime.datetime.now()
-    async with session_pool() as session:
-        # Ищем активные предложения, у которых вышло время
-        stmt = select(OrderOffer).where(
-            OrderOffer.status == 'active',
-            OrderOffer.expires_at < now
-        )
-        expired_offers = await session.execute(stmt)
+    # В режиме parallel у заказа может истечь сразу несколько предложений - обрабатываем заказ один раз
+    processed_order_ids = set()
+    while True:
+        async with session_pool() as session:
+            # Активные предложения, у которых вышло время
+            result = await session.execute(
+                select(OrderOffer)
+                .where(OrderOffer.status == 'active', OrderOffer.expires_at < now)
+                .order_by(OrderOffer.id)
+                .limit(CLAIM_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            expired_offers = result.scalars().all()
+            if not expired_offers:
+                return
+            for offer in expired_offers:
+                offer.status = 'expired'  # Помечаем предложение как истекшее
+            await session.commit()
 
-        for offer in expired_offers.scalars().all():
-            offer.status = 'expired'  # Помечаем текущее предложение как истекшее
+        order_ids = sorted({offer.order_id for offer in expired_offers} - processed_order_ids)
+        processed_order_ids.update(order_ids)
+        for order_id in order_ids:
+            try:
+                async with session_pool() as session:
+                    order = await get_order_by_id(session, order_id)
+                    if not order or order.status != OrderStatus.new:
+                        continue  # Если заказ уже приняли или отменили, ничего не делаем
 
-            order = await get_order_by_id(session, offer.order_id)
-            if not order or order.status != OrderStatus.new:
-                continue  # Если заказ уже приняли или отменили, ничего не делаем
+                    # Предлагаем заказ следующим в очереди исполнителям
+                    sent = await find_and_notify_executors(session, order_id, bots["executor"], config)
+                    if not sent and not await count_active_offers(session, order_id):
+                        # Если следующий не найден (очередь закончилась)
+                        await bots["admin"].send_message(
+                            admin_id,
+                            f"❗️<b>Никто не принял заказ №{order.id} вовремя.</b>\n"
+                            "Очередь исполнителей закончилась. Рекомендуется ручное назначение."
+                        )
+                    await session.commit()
+            except Exception as e:
+                print(f"Ошибка при передаче заказа {order_id} следующему исполнителю: {e}")
 
-            # Получаем полный список подходящих исполнителей (он уже отсортирован)
-            all_executors = await get_matching_executors(
-                session, order.selected_date, order.selected_time
-            )
 
-            # Находим, каким по счету был исполнитель, чей оффер истек
-            current_executor_index = -1
-            for i, executor in enumerate(all_executors):
-                if executor.telegram_id == offer.executor_tg_id:
-                    current_executor_index = i
-                    break
-
-            # Ищем следующего исполнителя
-            if current_executor_index != -1 and current_executor_index + 1 < len(all_executors):
-                next_executor = all_executors[current_executor_index + 1]
-                # Рекурсивно вызываем функцию, чтобы отправить предложение следующему
-                from app.handlers.client import offer_order_to_executor  # Локальный импорт
-                await offer_order_to_executor(session, bots, order, next_executor, config)
-            else:
-                # Если следующий не найден (очередь закончилась)
-                await bots["admin"].send_message(
-                    admin_id,
-                    f"❗️<b>Никто не принял заказ №{order.id} вовремя.</b>\n"
-                    "Очередь исполнителей закончилась. Рекомендуется ручное назначение."
-                )
+async def run_scheduled_batch_assignment(bots: dict, session_pool, config: Settings):
+    """Периодическое пакетное распределение новых заказов между исполнителями."""
+    await run_batch_assignment_job(session_pool, bots["executor"], config)
+
 
-        await session.commit()
\ No newline at end of file
+async def refresh_memory_indexes(session_pool, config: Settings):
+    """
+    Перечитывает из БД данные, которые каждая копия бота держит в памяти: базы исполнителей, занятые слоты,
+    а также системные настройки (тарифы, комиссию, доп. услуги), от которых зависят цены.
+    Нужно при нескольких копиях бота: изменения, сделанные другой копией, попадают в память этой.
+    """
+    try:
+        async with session_pool() as session:
+            locations = await get_executor_locations(session)
+            bookings = await get_executor_slot_bookings(session)
+            system_settings = await get_system_settings(session)
+    except Exception as e:
+        print(f"Ошибка при обновлении индексов исполнителей: {e}")
+        return
+    get_executor_geo_index().load(locations)
+    get_occupancy_index().load(bookings)
+    if system_settings:
+        apply_system_settings(config, system_settings)
@@ -0,0 +1,181 @@
+import datetime
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from app.services.geo_index import KM_PER_DEGREE, effective_radius_km, DISTANCE_WEIGHT, PRIORITY_WEIGHT, RATING_WEIGHT
+
+# Штраф за загрузку: исполнитель с наибольшим числом активных заказов теряет столько очков ранга
+LOAD_WEIGHT = 0.3
+# Стоимость запрещенной пары (исполнитель занят, не работает в этот слот, заказ вне радиуса, уже отказывался).
+# Больше суммы любых допустимых стоимостей, поэтому решение сначала максимизирует число назначений
+FORBIDDEN_COST = 1e6
+
+
+@dataclass(frozen=True)
+class BatchOrder:
+    """Заказ, ожидающий назначения в пакетном режиме."""
+    order_id: int
+    scheduled_date: str
+    slot: str
+    lat: float | None
+    lon: float | None
+    excluded: frozenset[int] = frozenset()  # Исполнители, которым заказ уже предлагался
+
+
+@dataclass(frozen=True)
+class BatchExecutor:
+    """Исполнитель-кандидат для пакетного назначения."""
+    telegram_id: int
+    priority: int
+    rating: float
+    base_lat: float | None
+    base_lon: float | None
+    radius_km: float | None
+    # Слоты по дням недели (0 - понедельник); None - графика нет, исполнитель доступен всегда
+    schedule: dict[int, frozenset[str]] | None
+    load: int  # Количество активных заказов
+
+
+def solve_assignment(cost: np.ndarray) -> np.ndarray:
+    """
+    Решает задачу о назначениях (минимум суммарной стоимости) для прямоугольной матрицы.
+    Алгоритм кратчайших увеличивающих путей (Джонкер-Волгенант) с векторизованным по столбцам внутренним циклом.
+    Возвращает для каждой строки номер назначенного столбца или -1, если столбцов меньше, чем строк.
+    """
+    n_rows, n_cols = cost.shape
+    if n_rows == 0 or n_cols == 0:
+        return np.full(n_rows, -1, dtype=np.int64)
+    if n_rows > n_cols:
+        # Назначаем столбцы строкам и переворачиваем ответ
+        row_for_col = solve_assignment(cost.T)
+        col_for_row = np.full(n_rows, -1, dtype=np.int64)
+        col_for_row[row_for_col] = np.arange(n_cols)
+        return col_for_row
+
+    u = np.zeros(n_rows)
+    v = np.zeros(n_cols)
+    col_for_row = np.full(n_rows, -1, dtype=np.int64)
+    row_for_col = np.full(n_cols, -1, dtype=np.int64)
+
+    for current_row in range(n_rows):
+        shortest = np.full(n_cols, np.inf)
+        path = np.full(n_cols, -1, dtype=np.int64)
+        remaining = np.ones(n_cols, dtype=bool)
+        visited_rows = []
+        min_value = 0.0
+        row = current_row
+        sink = -1
+        while sink == -1:
+            visited_rows.append(row)
+            reduced = min_value + cost[row] - u[row] - v
+            improved = remaining & (reduced < shortest)
+            path[improved] = row
+            shortest[improved] = reduced[improved]
+
+            candidates = np.where(remaining, shortest, np.inf)
+            column = int(np.argmin(candidates))
+            min_value = float(candidates[column])
+            remaining[column] = False
+            if row_for_col[column] == -1:
+                sink = column
+            else:
+                row = int(row_for_col[column])
+
+        # Обновляем потенциалы
+        u[current_row] += min_value
+        if len(visited_rows) > 1:
+            other_rows = np.asarray(visited_rows[1:])
+            u[other_rows] += min_value - shortest[col_for_row[other_rows]]
+        scanned = ~remaining
+        v[scanned] -= min_value - shortest[scanned]
+
+        # Перекладываем назначения вдоль найденного пути
+        column = sink
+        while True:
+            row = int(path[column])
+            row_for_col[column] = row
+            col_for_row[row], column = column, int(col_for_row[row])
+            if row == current_row:
+                break
+
+    return col_for_row
+
+
+def _weekday(scheduled_date: str) -> int | None:
+    try:
+        return datetime.datetime.strptime(scheduled_date, "%Y-%m-%d").weekday()
+    except (TypeError, ValueError):
+        return None
+
+
+def plan_batch_assignment(orders: list[BatchOrder], executors: list[BatchExecutor],
+                          is_busy: Callable[[int, str, str], bool] | None = None) -> list[tuple[int, int]]:
+    """
+    Строит оптимальный план назначений: каждому заказу - не более одного исполнителя,
+    каждому исполнителю - не более одного заказа в одни дата и слот.
+    Заказы разбиваются на группы по (дата, слот), для каждой группы строится матрица стоимостей
+    (ранг по близости, приоритету и рейтингу плюс штраф за загрузку) и решается задача о назначениях.
+    Загрузка исполнителя учитывает назначения из уже решенных групп, поэтому заказы распределяются равномернее.
+    Возвращает список пар (order_id, executor_tg_id).
+    """
+    if not orders or not executors:
+        return []
+
+    executor_ids = np.array([executor.telegram_id for executor in executors], dtype=np.int64)
+    column_by_executor = {executor.telegram_id: index for index, executor in enumerate(executors)}
+    base_lat = np.array([np.nan if e.base_lat is None else e.base_lat for e in executors])
+    base_lon = np.array([np.nan if e.base_lon is None else e.base_lon for e in executors])
+    radius = np.array([effective_radius_km(e.radius_km) for e in executors])
+    priority = np.array([e.priority or 0 for e in executors], dtype=float)
+    max_priority = priority.max()
+    # Часть ранга, не зависящая от заказа
+    static_score = RATING_WEIGHT * np.array([(e.rating or 0) / 5 for e in executors])
+    if max_priority > 0:
+        static_score += PRIORITY_WEIGHT * priority / max_priority
+    load = np.array([e.load for e in executors], dtype=float)
+
+    groups = defaultdict(list)
+    for order in orders:
+        groups[(order.scheduled_date, order.slot)].append(order)
+
+    plan = []
+    # Сначала ближайшие даты: им достаются лучшие исполнители
+    for (scheduled_date, slot), group in sorted(groups.items(), key=lambda item: (item[0][0] or "", item[0][1] or "")):
+        weekday = _weekday(scheduled_date)
+        available = np.array([
+            (executor.schedule is None or slot in executor.schedule.get(weekday, ()))
+            and not (is_busy and is_busy(executor.telegram_id, scheduled_date, slot))
+            for executor in executors
+        ])
+        if not available.any():
+            continue
+
+        order_lat = np.array([np.nan if order.lat is None else order.lat for order in group])
+        order_lon = np.array([np.nan if order.lon is None else order.lon for order in group])
+        lon_scale = np.cos(np.radians(np.nan_to_num(order_lat)))[:, None]
+        distance = np.hypot((base_lon - order_lon[:, None]) * lon_scale, base_lat - order_lat[:, None]) * KM_PER_DEGREE
+        known = ~np.isnan(distance)
+        distance_score = np.where(known, np.clip(1 - np.nan_to_num(distance) / radius, 0, 1), 0.0)
+
+        max_load = load.max()
+        load_penalty = LOAD_WEIGHT * load / max_load if max_load > 0 else np.zeros_like(load)
+        cost = load_penalty - static_score - DISTANCE_WEIGHT * distance_score
+
+        forbidden = ~available | (known & (np.nan_to_num(distance) > radius))
+        for row, order in enumerate(group):
+            for executor_tg_id in order.excluded:
+                column = column_by_executor.get(executor_tg_id)
+                if column is not None:
+                    forbidden[row, column] = True
+        cost[forbidden] = FORBIDDEN_COST
+
+        assignment = solve_assignment(cost)
+        for row, column in enumerate(assignment):
+            if column >= 0 and not forbidden[row, column]:
+                plan.append((group[row].order_id, int(executor_ids[column])))
+                load[column] += 1
+
+    return plan
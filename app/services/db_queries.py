@@ -1,15 +1,24 @@
 import datetime
-from sqlalchemy import func
+from sqlalchemy import func, delete, update, insert, values, column, case, Integer, Float
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from app.database.models import (User, UserRole, Order, OrderItem, OrderStatus, Ticket, TicketMessage, MessageAuthor,
                                  TicketStatus, UserStatus, ExecutorSchedule, DeclinedOrder, OrderOffer, OrderLog,
-                                 SystemSettings)
+                                 SystemSettings, MediaRelayCache, GeocodeCache, OrderFinancialSnapshot,
+                                 ExecutorSlotBooking, SchedulerJobState)
 import random
 import string
 from app.common.texts import STATUS_MAPPING
 from app.keyboards.executor_kb import WEEKDAYS
+from app.services.price_calculator import get_pricing_engine
+from app.services.geo_index import get_executor_geo_index
+from app.services.occupancy import get_occupancy_index, SlotConflictError
+
+# Статусы, в которых заказ занимает слот исполнителя
+ACTIVE_ASSIGNMENT_STATUSES = (OrderStatus.accepted, OrderStatus.pending_confirmation,
+                              OrderStatus.on_the_way, OrderStatus.in_progress)
 
 async def get_user(session: AsyncSession, telegram_id: int) -> User | None:
     """Возвращает пользователя по его telegram_id или None, если пользователь не найден."""
@@ -29,6 +38,15 @@ async def create_user(session: AsyncSession, telegram_id: int, name: str, userna
     await session.commit()
     return new_user
 
+async def get_users_by_ids(session: AsyncSession, telegram_ids: list[int]) -> list[User]:
+    """Возвращает пользователей по списку telegram_id в том же порядке (отсутствующие пропускаются)."""
+    if not telegram_ids:
+        return []
+    result = await session.execute(select(User).where(User.telegram_id.in_(telegram_ids)))
+    users = {user.telegram_id: user for user in result.scalars().all()}
+    return [users[telegram_id] for telegram_id in telegram_ids if telegram_id in users]
+
+
 async def get_users_by_role(session: AsyncSession, role: UserRole) -> list[User]:
     """Возвращает список пользователей по их роли."""
     result = await session.execute(
@@ -107,6 +125,9 @@ async def create_order(session: AsyncSession, data: dict, client_tg_id: int, is_
         log_message += " (ТЕСТОВЫЙ РЕЖИM)"
     session.add(OrderLog(order_id=new_order.id, message=log_message))
 
+    # Первая версия финансового снимка заказа
+    await add_order_financial_snapshot(session, new_order, "Создание заказа")
+
     # Создаем записи для доп. услуг
     selected_services = data.get("selected_services", {})
     for service_key, quantity in selected_services.items():
@@ -116,6 +137,136 @@ async def create_order(session: AsyncSession, data: dict, client_tg_id: int, is_
     await session.commit()
     return new_order
 
+async def get_order_financials(session: AsyncSession, order_id: int) -> OrderFinancialSnapshot | None:
+    """Возвращает последнюю версию финансового снимка заказа."""
+    result = await session.execute(
+        select(OrderFinancialSnapshot)
+        .where(OrderFinancialSnapshot.order_id == order_id)
+        .order_by(OrderFinancialSnapshot.version.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_order_financials_map(session: AsyncSession, order_ids: list[int]) -> dict[int, OrderFinancialSnapshot]:
+    """Возвращает последние финансовые снимки нескольких заказов одним запросом."""
+    if not order_ids:
+        return {}
+    result = await session.execute(
+        select(OrderFinancialSnapshot)
+        .where(OrderFinancialSnapshot.order_id.in_(order_ids))
+        .distinct(OrderFinancialSnapshot.order_id)
+        .order_by(OrderFinancialSnapshot.order_id, OrderFinancialSnapshot.version.desc())
+    )
+    return {snapshot.order_id: snapshot for snapshot in result.scalars()}
+
+
+async def add_order_financial_snapshot(session: AsyncSession, order: Order, reason: str,
+                                       executor_payment: float | None = None, bonus: float = 0.0,
+                                       manual_payment: bool = False) -> OrderFinancialSnapshot:
+    """
+    Добавляет в сессию новую версию финансового снимка заказа (commit делает вызывающая функция).
+    Выплата считается по текущей комиссии; если она передана явно (ручное изменение, бонус),
+    условия комиссии переносятся из предыдущей версии. bonus - новый бонус, он прибавляется к бонусам
+    предыдущих версий. manual_payment отмечает выплату, заданную администратором; при явно переданной выплате
+    отметка переносится из предыдущей версии. У назначенного заказа обновляется Order.executor_payment.
+    Номер версии выдается под блокировкой строки заказа (до конца транзакции вызывающего),
+    поэтому параллельные изменения одного заказа получают разные версии.
+    """
+    engine = get_pricing_engine()
+    await session.execute(select(Order.id).where(Order.id == order.id).with_for_update())
+    latest = await get_order_financials(session, order.id)
+    commission_type, commission_value = engine.commission_type, engine.commission_value
+    if executor_payment is None:
+        executor_payment = engine.executor_payment(order.total_price or 0)
+    elif latest:
+        commission_type, commission_value = latest.commission_type, latest.commission_value
+        manual_payment = manual_payment or latest.manual_payment
+
+    snapshot = OrderFinancialSnapshot(
+        order_id=order.id,
+        version=latest.version + 1 if latest else 1,
+        total_price=order.total_price or 0,
+        commission_type=commission_type,
+        commission_value=commission_value,
+        executor_payment=executor_payment,
+        bonus=(latest.bonus if latest else 0.0) + bonus,
+        manual_payment=manual_payment,
+        reason=reason
+    )
+    session.add(snapshot)
+    if order.executor_tg_id:
+        order.executor_payment = executor_payment
+    return snapshot
+
+
+def _transient_financial_snapshot(order: Order) -> OrderFinancialSnapshot:
+    """Несохраненный снимок по текущим данным заказа - для заказа, у которого снимка еще нет."""
+    engine = get_pricing_engine()
+    return OrderFinancialSnapshot(
+        order_id=order.id,
+        version=0,
+        total_price=order.total_price or 0,
+        commission_type=engine.commission_type,
+        commission_value=engine.commission_value,
+        executor_payment=order.executor_payment if order.executor_payment is not None
+        else engine.executor_payment(order.total_price or 0),
+        bonus=0.0,
+        manual_payment=False
+    )
+
+
+async def get_order_financial_snapshot(session: AsyncSession, order: Order) -> OrderFinancialSnapshot:
+    """
+    Возвращает последний финансовый снимок заказа, ничего не записывая.
+    Снимок создается вместе с заказом, а старым заказам - при старте (backfill_order_financial_snapshots);
+    если снимка все же нет, возвращает несохраненный снимок по текущим данным заказа.
+    """
+    snapshot = await get_order_financials(session, order.id)
+    return snapshot or _transient_financial_snapshot(order)
+
+
+async def get_order_financial_snapshots(session: AsyncSession, orders: list[Order]) -> dict[int, OrderFinancialSnapshot]:
+    """То же, что get_order_financial_snapshot, для нескольких заказов одним запросом: {order_id: снимок}."""
+    snapshots = await get_order_financials_map(session, list({order.id for order in orders}))
+    return {order.id: snapshots.get(order.id) or _transient_financial_snapshot(order) for order in orders}
+
+
+async def backfill_order_financial_snapshots(session: AsyncSession) -> int:
+    """
+    Записывает первую версию финансового снимка заказам, созданным до появления снимков.
+    Вызывается при старте, после загрузки комиссии. Возвращает количество записанных снимков.
+    """
+    result = await session.execute(
+        select(Order.id, Order.total_price, Order.executor_payment)
+        .where(~select(OrderFinancialSnapshot.id).where(OrderFinancialSnapshot.order_id == Order.id).exists())
+    )
+    rows = result.all()
+    if not rows:
+        return 0
+    engine = get_pricing_engine()
+    # Другая копия бота могла записать те же снимки параллельно - такие строки пропускаются
+    await session.execute(
+        pg_insert(OrderFinancialSnapshot).on_conflict_do_nothing(constraint='uq_order_financial_version'),
+        [
+            {
+                "order_id": order_id,
+                "version": 1,
+                "total_price": total_price or 0,
+                "commission_type": engine.commission_type,
+                "commission_value": engine.commission_value,
+                "executor_payment": executor_payment if executor_payment is not None
+                else engine.executor_payment(total_price or 0),
+                "bonus": 0.0,
+                "reason": "Перенос существующего заказа"
+            }
+            for order_id, total_price, executor_payment in rows
+        ]
+    )
+    await session.commit()
+    return len(rows)
+
+
 async def get_user_orders(session: AsyncSession, client_tg_id: int):
     """Возвращает список заказов пользователя."""
     result = await session.execute(
@@ -130,7 +281,12 @@ async def update_order_status(session: AsyncSession, order_id: int, status: Orde
     if order:
         order.status = status
         session.add(OrderLog(order_id=order.id, message=f"Статус изменен на '{STATUS_MAPPING.get(status, status.value)}'"))
+        releases_slot = status not in ACTIVE_ASSIGNMENT_STATUSES
+        if releases_slot:
+            await session.execute(delete(ExecutorSlotBooking).where(ExecutorSlotBooking.order_id == order_id))
         await session.commit()
+        if releases_slot:
+            get_occupancy_index().release(order_id)
         return order
     return None
 
@@ -163,18 +319,99 @@ async def get_orders_by_status(session: AsyncSession, status: OrderStatus, execu
     return result.scalars().all()
 
 async def assign_executor_to_order(session: AsyncSession, order_id: int, executor_tg_id: int, payment_amount: float) -> Order | None:
-    """Назначает исполнителя на заказ, обновляет статус, сумму выплаты и добавляет лог."""
-    order = await session.get(Order, order_id)
-    if order and order.status == OrderStatus.new:
-        order.executor_tg_id = executor_tg_id
-        order.status = OrderStatus.accepted
-        order.executor_payment = payment_amount
+    """
+    Назначает исполнителя на заказ, обновляет статус, сумму выплаты и добавляет лог.
+    Назначение атомарное (UPDATE ... WHERE status = 'new'): если несколько исполнителей принимают
+    заказ одновременно, он достается первому, остальные получают None.
+    В той же транзакции занимается слот исполнителя: если у него уже есть активный заказ на эти дату и время,
+    назначение откатывается и выбрасывается SlotConflictError.
+    Неудачное назначение откатывается до точки сохранения (SAVEPOINT), а не целиком: прочие несохраненные
+    изменения в сессии вызывающего остаются.
+    """
+    savepoint = await session.begin_nested()
+    result = await session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == OrderStatus.new)
+        .values(executor_tg_id=executor_tg_id, status=OrderStatus.accepted, executor_payment=payment_amount)
+        .returning(Order.selected_date, Order.selected_time)
+        .execution_options(synchronize_session=False)
+    )
+    assigned = result.one_or_none()
+    if assigned is None:
+        await savepoint.rollback()
+        return None
 
-        session.add(OrderLog(order_id=order.id, message="✅ Исполнитель назначен"))
+    occupancy = get_occupancy_index()
+    if not await _book_executor_slot(session, order_id, executor_tg_id, assigned.selected_date, assigned.selected_time):
+        await savepoint.rollback()
+        occupancy.conflicts_rejected += 1
+        raise SlotConflictError(
+            f"Исполнитель {executor_tg_id} уже занят {assigned.selected_date} {assigned.selected_time}"
+        )
+    await savepoint.commit()
 
-        await session.commit()
-        return order
-    return None
+    session.add(OrderLog(order_id=order_id, message="✅ Исполнитель назначен"))
+    await session.commit()
+    occupancy.occupy(order_id, executor_tg_id, assigned.selected_date, assigned.selected_time)
+    # Перечитываем заказ: в сессии мог остаться объект со старым статусом
+    return await session.get(Order, order_id, populate_existing=True)
+
+
+async def _book_executor_slot(session: AsyncSession, order_id: int, executor_tg_id: int,
+                              scheduled_date: str | None, slot: str | None) -> bool:
+    """
+    Занимает слот исполнителя под заказ в текущей транзакции (без коммита), заменяя прежний слот этого заказа.
+    Возвращает False, если слот уже занят другим активным заказом исполнителя.
+    """
+    await session.execute(delete(ExecutorSlotBooking).where(ExecutorSlotBooking.order_id == order_id))
+    if not scheduled_date or not slot:
+        return True
+    result = await session.execute(
+        pg_insert(ExecutorSlotBooking)
+        .values(order_id=order_id, executor_tg_id=executor_tg_id, scheduled_date=scheduled_date, slot=slot,
+                created_at=datetime.datetime.now())
+        .on_conflict_do_nothing()
+        .returning(ExecutorSlotBooking.id)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+async def sync_executor_slot_bookings(session: AsyncSession) -> list:
+    """
+    Приводит таблицу занятости в соответствие с заказами (удаляет слоты неактивных заказов и добавляет
+    недостающие) и возвращает все занятые слоты - для загрузки индекса занятости при старте.
+    Если у исполнителя уже есть два активных заказа на один слот, занятым считается только первый из них.
+    """
+    active_orders = select(Order.id).where(
+        Order.status.in_(ACTIVE_ASSIGNMENT_STATUSES), Order.executor_tg_id.is_not(None)
+    )
+    await session.execute(delete(ExecutorSlotBooking).where(ExecutorSlotBooking.order_id.notin_(active_orders)))
+    await session.execute(
+        pg_insert(ExecutorSlotBooking)
+        .from_select(
+            ["order_id", "executor_tg_id", "scheduled_date", "slot", "created_at"],
+            select(Order.id, Order.executor_tg_id, Order.selected_date, Order.selected_time, func.now())
+            .where(
+                Order.status.in_(ACTIVE_ASSIGNMENT_STATUSES),
+                Order.executor_tg_id.is_not(None),
+                Order.selected_date.is_not(None),
+                Order.selected_time.is_not(None)
+            )
+            .order_by(Order.id)
+        )
+        .on_conflict_do_nothing()
+    )
+    await session.commit()
+    return await get_executor_slot_bookings(session)
+
+
+async def get_executor_slot_bookings(session: AsyncSession) -> list:
+    """Возвращает все занятые слоты исполнителей (для загрузки индекса занятости)."""
+    result = await session.execute(
+        select(ExecutorSlotBooking.order_id, ExecutorSlotBooking.executor_tg_id,
+               ExecutorSlotBooking.scheduled_date, ExecutorSlotBooking.slot)
+    )
+    return result.all()
 
 
 async def add_photo_to_order(session: AsyncSession, order_id: int, photo_file_id: str) -> Order | None:
@@ -209,8 +446,9 @@ async def get_executor_active_orders(session: AsyncSession, executor_tg_id: int)
     return result.scalars().all()
 
 async def update_order_services_and_price(session: AsyncSession, order_id: int, new_services: dict,
-                                          new_total_price: float, admin_id: int, admin_username: str) -> Order | None:
-    """Обновляет доп. услуги и итоговую стоимость заказа."""
+                                          new_total_price: float, admin_id: int | None = None,
+                                          admin_username: str | None = None) -> Order | None:
+    """Обновляет доп. услуги и итоговую стоимость заказа и записывает новую версию финансового снимка."""
     order = await get_order_by_id(session, order_id)
     if not order:
         return None
@@ -227,24 +465,44 @@ async def update_order_services_and_price(session: AsyncSession, order_id: int,
 
     # Обновляем цену
     order.total_price = new_total_price
+    await add_order_financial_snapshot(session, order, "Изменение доп. услуг")
 
     # Добавляем лог
-    log_message = f"📝 Администратор @{admin_username} изменил доп. услуги. Новая цена: {new_total_price} ₽"
+    author = f"Администратор @{admin_username}" if admin_id else "Клиент"
+    log_message = f"📝 {author} изменил доп. услуги. Новая цена: {new_total_price} ₽"
     session.add(OrderLog(order_id=order_id, message=log_message, admin_id=admin_id))
 
     await session.commit()
     return order
 
 
-async def update_order_datetime(session: AsyncSession, order_id: int, new_date: str, new_time: str, admin_id: int, admin_username: str) -> Order | None:
-    """Обновляет дату и время заказа."""
+async def update_order_datetime(session: AsyncSession, order_id: int, new_date: str, new_time: str,
+                                admin_id: int | None = None, admin_username: str | None = None) -> Order | None:
+    """
+    Обновляет дату и время заказа. Если на заказ назначен исполнитель, его слот переносится;
+    при пересечении с другим его активным заказом изменение откатывается и выбрасывается SlotConflictError.
+    Откатывается только сам перенос (точка сохранения), несохраненные изменения вызывающего остаются в сессии.
+    """
     order = await session.get(Order, order_id)
     if order:
+        savepoint = await session.begin_nested()
         order.selected_date = new_date
         order.selected_time = new_time
-        log_message = f"📅 Администратор @{admin_username} изменил дату на {new_date} и время на {new_time}"
+        author = f"Администратор @{admin_username}" if admin_id else "Клиент"
+        log_message = f"📅 {author} изменил дату на {new_date} и время на {new_time}"
         session.add(OrderLog(order_id=order_id, message=log_message, admin_id=admin_id))
+
+        executor_tg_id = order.executor_tg_id if order.status in ACTIVE_ASSIGNMENT_STATUSES else None
+        occupancy = get_occupancy_index()
+        if executor_tg_id and not await _book_executor_slot(session, order_id, executor_tg_id, new_date, new_time):
+            await savepoint.rollback()
+            occupancy.conflicts_rejected += 1
+            raise SlotConflictError(f"Исполнитель {executor_tg_id} уже занят {new_date} {new_time}")
+        await savepoint.commit()
+
         await session.commit()
+        if executor_tg_id:
+            occupancy.occupy(order_id, executor_tg_id, new_date, new_time)
         return order
     return None
 
@@ -262,14 +520,17 @@ async def update_order_address(session: AsyncSession, order_id: int, new_address
         return order
     return None
 
-async def update_order_rooms_and_price(session: AsyncSession, order_id: int, new_room_count: str, new_bathroom_count: str, new_total_price: float, admin_id: int, admin_username: str):
-    """Обновляет количество комнат, санузлов и итоговую стоимость заказа."""
+async def update_order_rooms_and_price(session: AsyncSession, order_id: int, new_room_count: str, new_bathroom_count: str, new_total_price: float,
+                                      admin_id: int | None = None, admin_username: str | None = None):
+    """Обновляет количество комнат, санузлов и итоговую стоимость заказа и записывает новую версию финансового снимка."""
     order = await session.get(Order, order_id)
     if order:
         order.room_count = new_room_count
         order.bathroom_count = new_bathroom_count
         order.total_price = new_total_price
-        log_message = f"🏠 Администратор @{admin_username} изменил кол-во комнат на {new_room_count} и санузлов на {new_bathroom_count}. Новая цена: {new_total_price} ₽"
+        await add_order_financial_snapshot(session, order, "Изменение комнат и санузлов")
+        author = f"Администратор @{admin_username}" if admin_id else "Клиент"
+        log_message = f"🏠 {author} изменил кол-во комнат на {new_room_count} и санузлов на {new_bathroom_count}. Новая цена: {new_total_price} ₽"
         session.add(OrderLog(order_id=order_id, message=log_message, admin_id=admin_id))
         await session.commit()
         return order
@@ -365,10 +626,15 @@ async def update_ticket_status(session: AsyncSession, ticket_id: int, status: Ti
     return ticket
 
 
-async def get_matching_executors(session: AsyncSession, order_date_str: str, order_time_slot: str) -> list[User]:
+async def get_matching_executors(session: AsyncSession, order_date_str: str, order_time_slot: str,
+                                 lat: float | None = None, lon: float | None = None) -> list[User]:
     """
     Возвращает список активных исполнителей, отсортированный по приоритету, затем по рейтингу и количеству отзывов,
     чей график соответствует заказу, либо всех, если у них нет графика.
+    Если известны координаты заказа, внутри каждой группы исполнители ранжируются с учетом расстояния до их базы,
+    а исполнители, в радиус выезда которых заказ не попадает, исключаются.
+    Координаты есть только у адресов, отправленных геолокацией: для адреса, введенного текстом, расстояние
+    не учитывается (геокодер возвращает только нормализованный адрес, без точки).
     """
     try:
         order_date = datetime.datetime.strptime(order_date_str, "%Y-%m-%d")
@@ -408,10 +674,51 @@ async def get_matching_executors(session: AsyncSession, order_date_str: str, ord
 
     # 3. Объединяем два отсортированных списка.
     # Сначала идут исполнители с подходящим графиком, потом все остальные.
-    # Внутри каждой группы сортировка по приоритету/рейтингу.
+    # Внутри каждой группы сортировка по приоритету/рейтингу (и расстоянию, если известен адрес).
+    # Исполнители, у которых на эти дату и слот уже есть активный заказ, пропускаются.
+    occupancy = get_occupancy_index()
+    executors_with_schedule = [
+        executor for executor in executors_with_schedule
+        if not occupancy.is_busy(executor.telegram_id, order_date_str, order_time_slot)
+    ]
+    executors_without_schedule = [
+        executor for executor in executors_without_schedule
+        if not occupancy.is_busy(executor.telegram_id, order_date_str, order_time_slot)
+    ]
+    if lat is not None and lon is not None:
+        geo_index = get_executor_geo_index()
+        executors_with_schedule = geo_index.rank(executors_with_schedule, lat, lon)
+        executors_without_schedule = geo_index.rank(executors_without_schedule, lat, lon)
     return executors_with_schedule + executors_without_schedule
 
 
+async def get_executor_locations(session: AsyncSession) -> list:
+    """Возвращает базы и радиусы выезда исполнителей, у которых они указаны (для загрузки геоиндекса)."""
+    result = await session.execute(
+        select(User.telegram_id, User.base_lat, User.base_lon, User.service_radius_km)
+        .where(
+            User.role == UserRole.executor,
+            User.base_lat.is_not(None),
+            User.base_lon.is_not(None)
+        )
+    )
+    return result.all()
+
+
+async def update_executor_base_location(session: AsyncSession, executor_tg_id: int, lat: float, lon: float,
+                                        radius_km: float) -> User | None:
+    """Сохраняет базу и радиус выезда исполнителя и обновляет геоиндекс."""
+    executor = await get_user(session, executor_tg_id)
+    if not executor:
+        return None
+    executor.base_lat = lat
+    executor.base_lon = lon
+    executor.service_radius_km = radius_km
+    await session.commit()
+    get_executor_geo_index().upsert(executor_tg_id, lat, lon, radius_km)
+    return executor
+
+
 async def get_executor_schedule(session: AsyncSession, executor_tg_id: int) -> ExecutorSchedule | None:
     """Возвращает график работы исполнителя."""
     result = await session.execute(
@@ -538,7 +845,9 @@ async def unassign_executor_from_order(session: AsyncSession, order_id: int) ->
     order.reminder_24h_sent = False # Сбрасываем флаги напоминаний
     order.reminder_2h_sent = False
     session.add(OrderLog(order_id=order_id, message="🔄 Исполнитель снят с заказа"))
+    await session.execute(delete(ExecutorSlotBooking).where(ExecutorSlotBooking.order_id == order_id))
     await session.commit()
+    get_occupancy_index().release(order_id)
     return order, previous_executor_id
 
 
@@ -594,32 +903,122 @@ async def add_declined_order(session: AsyncSession, order_id: int, executor_tg_i
     session.add(new_decline)
     await session.commit()
 
-async def create_order_offer(session: AsyncSession, order_id: int, executor_tg_id: int, expires_at: datetime.datetime) -> OrderOffer:
+async def create_order_offer(session: AsyncSession, order_id: int, executor_tg_id: int, expires_at: datetime.datetime,
+                             strategy: str | None = None, message_id: int | None = None) -> OrderOffer:
     """Создает новое предложение заказа для исполнителя."""
     new_offer = OrderOffer(
         order_id=order_id,
         executor_tg_id=executor_tg_id,
         expires_at=expires_at,
-        status='active'
+        status='active',
+        strategy=strategy,
+        message_id=message_id
     )
     session.add(new_offer)
     await session.commit()
     return new_offer
 
-async def get_active_offer_for_order(session: AsyncSession, order_id: int) -> OrderOffer | None:
-    """Возвращает активное предложение для конкретного заказа, если оно есть."""
+async def get_active_offer_for_order(session: AsyncSession, order_id: int, executor_tg_id: int) -> OrderOffer | None:
+    """Возвращает активное предложение заказа конкретному исполнителю, если оно есть."""
     result = await session.execute(
         select(OrderOffer).where(
             OrderOffer.order_id == order_id,
+            OrderOffer.executor_tg_id == executor_tg_id,
             OrderOffer.status == 'active'
         )
     )
-    return result.scalar_one_or_none()
+    return result.scalars().first()
+
+async def count_active_offers(session: AsyncSession, order_id: int) -> int:
+    """Возвращает количество активных предложений по заказу."""
+    result = await session.execute(
+        select(func.count(OrderOffer.id)).where(OrderOffer.order_id == order_id, OrderOffer.status == 'active')
+    )
+    return result.scalar_one()
+
+async def get_offered_executor_ids(session: AsyncSession, order_id: int) -> set[int]:
+    """Возвращает исполнителей, которым заказ уже предлагался или которые от него отказались."""
+    offered = await session.execute(select(OrderOffer.executor_tg_id).where(OrderOffer.order_id == order_id))
+    declined = await session.execute(select(DeclinedOrder.executor_tg_id).where(DeclinedOrder.order_id == order_id))
+    return set(offered.scalars().all()) | set(declined.scalars().all())
+
+async def get_offered_executor_ids_map(session: AsyncSession, order_ids: list[int]) -> dict[int, set[int]]:
+    """То же, что get_offered_executor_ids, но сразу для многих заказов: {order_id: {executor_tg_id, ...}}."""
+    excluded = {order_id: set() for order_id in order_ids}
+    if not order_ids:
+        return excluded
+    offered = await session.execute(
+        select(OrderOffer.order_id, OrderOffer.executor_tg_id).where(OrderOffer.order_id.in_(order_ids))
+    )
+    declined = await session.execute(
+        select(DeclinedOrder.order_id, DeclinedOrder.executor_tg_id).where(DeclinedOrder.order_id.in_(order_ids))
+    )
+    for order_id, executor_tg_id in [*offered.all(), *declined.all()]:
+        excluded[order_id].add(executor_tg_id)
+    return excluded
+
+
+async def get_orders_awaiting_dispatch(session: AsyncSession) -> list[Order]:
+    """Возвращает новые заказы, по которым нет активных предложений (кандидаты для пакетного назначения)."""
+    has_active_offer = (
+        select(OrderOffer.id)
+        .where(OrderOffer.order_id == Order.id, OrderOffer.status == 'active')
+        .exists()
+    )
+    result = await session.execute(
+        select(Order)
+        .where(
+            Order.status == OrderStatus.new,
+            Order.selected_date >= datetime.date.today().isoformat(),  # Прошедшие заказы не распределяем
+            ~has_active_offer
+        )
+        .order_by(Order.id)
+    )
+    return result.scalars().all()
+
+
+async def get_active_executors_with_schedules(session: AsyncSession) -> list[tuple[User, ExecutorSchedule | None]]:
+    """Возвращает активных исполнителей вместе с их графиками (None, если графика нет)."""
+    result = await session.execute(
+        select(User, ExecutorSchedule)
+        .outerjoin(ExecutorSchedule, User.telegram_id == ExecutorSchedule.executor_tg_id)
+        .where(User.role == UserRole.executor, User.status == UserStatus.active)
+    )
+    return result.all()
+
+
+async def get_executor_active_loads(session: AsyncSession) -> dict[int, int]:
+    """Возвращает количество активных заказов у каждого исполнителя: {executor_tg_id: count}."""
+    result = await session.execute(
+        select(Order.executor_tg_id, func.count(Order.id))
+        .where(Order.executor_tg_id.is_not(None), Order.status.in_(ACTIVE_ASSIGNMENT_STATUSES))
+        .group_by(Order.executor_tg_id)
+    )
+    return dict(result.all())
+
+
+async def close_order_offers(session: AsyncSession, order_id: int, winner_tg_id: int) -> list:
+    """
+    Закрывает все активные предложения заказа после его назначения: предложение победителя
+    помечается как 'accepted', остальные - как 'revoked'.
+    Возвращает строки (executor_tg_id, message_id, status, strategy, created_at) закрытых предложений.
+    """
+    result = await session.execute(
+        update(OrderOffer)
+        .where(OrderOffer.order_id == order_id, OrderOffer.status == 'active')
+        .values(status=case((OrderOffer.executor_tg_id == winner_tg_id, 'accepted'), else_='revoked'))
+        .returning(OrderOffer.executor_tg_id, OrderOffer.message_id, OrderOffer.status, OrderOffer.strategy,
+                   OrderOffer.created_at)
+        .execution_options(synchronize_session=False)
+    )
+    closed = result.all()
+    await session.commit()
+    return closed
 
 async def decline_active_offer(session: AsyncSession, order_id: int, executor_tg_id: int) -> OrderOffer | None:
-    """Находит активное предложение и меняет его статус на 'declined'."""
-    offer = await get_active_offer_for_order(session, order_id)
-    if offer and offer.executor_tg_id == executor_tg_id:
+    """Находит активное предложение исполнителя и меняет его статус на 'declined'."""
+    offer = await get_active_offer_for_order(session, order_id, executor_tg_id)
+    if offer:
         offer.status = 'declined'
         await session.commit()
         return offer
@@ -633,9 +1032,11 @@ async def add_bonus_to_executor(session: AsyncSession, executor_tg_id: int, amou
         # session.commit() здесь не нужен, т.к. он будет вызван в основной функции
 
 
-async def check_and_award_performance_bonus(session: AsyncSession, executor_tg_id: int) -> int | None:
+async def check_and_award_performance_bonus(session: AsyncSession, executor_tg_id: int,
+                                            order_id: int | None = None) -> int | None:
     """
     Проверяет, соответствует ли исполнитель критериям для получения бонуса, и начисляет его.
+    Если передан order_id, бонус фиксируется в финансовом снимке этого заказа.
     Возвращает сумму бонуса, если он был начислен, иначе None.
     """
     executor = await get_user(session, executor_tg_id)
@@ -666,6 +1067,12 @@ async def check_and_award_performance_bonus(session: AsyncSession, executor_tg_i
     if rated_orders_count >= executor.last_bonus_order_count + bonus_order_count_step:
         await add_bonus_to_executor(session, executor_tg_id, bonus_amount)
         executor.last_bonus_order_count += bonus_order_count_step
+        order = await session.get(Order, order_id) if order_id else None
+        if order:
+            await add_order_financial_snapshot(
+                session, order, "Бонус за производительность",
+                executor_payment=order.executor_payment or 0, bonus=bonus_amount
+            )
         # один commit в конце
         await session.commit()
         return bonus_amount
@@ -752,10 +1159,13 @@ async def unblock_executor_by_admin(session: AsyncSession, executor_tg_id: int)
     return None
 
 async def update_executor_payment(session: AsyncSession, order_id: int, new_payment: float, admin_id: int, admin_username: str) -> Order | None:
-    """Обновляет сумму выплаты исполнителю и логирует действие."""
+    """Обновляет сумму выплаты исполнителю (новой версией финансового снимка) и логирует действие."""
     order = await session.get(Order, order_id)
     if order and order.executor_tg_id:
-        order.executor_payment = new_payment
+        await add_order_financial_snapshot(
+            session, order, f"Выплата изменена администратором @{admin_username}", executor_payment=new_payment,
+            manual_payment=True
+        )
         log_message = f"💰 Администратор @{admin_username} изменил выплату на {new_payment} ₽"
         session.add(OrderLog(order_id=order_id, message=log_message, admin_id=admin_id))
         await session.commit()
@@ -970,4 +1380,244 @@ async def get_top_additional_services(session: AsyncSession, limit: int = 5) ->
         .limit(limit)
     )
     result = await session.execute(stmt)
-    return result.all()
\ No newline at end of file
+    return result.all()
+
+async def get_media_relay_file_id(session: AsyncSession, source_bot_id: int, file_unique_id: str, target_bot_id: int) -> str | None:
+    """Возвращает file_id файла у целевого бота из кэша пересылки (только чтение, без commit)."""
+    result = await session.execute(
+        select(MediaRelayCache.target_file_id).where(
+            MediaRelayCache.source_bot_id == source_bot_id,
+            MediaRelayCache.file_unique_id == file_unique_id,
+            MediaRelayCache.target_bot_id == target_bot_id
+        )
+    )
+    return result.scalar_one_or_none()
+
+async def get_media_relay_file_ids(session: AsyncSession, source_bot_id: int, file_unique_ids: list[str], target_bot_id: int) -> dict[str, str]:
+    """Пакетная версия get_media_relay_file_id: возвращает словарь {file_unique_id: file_id у целевого бота}."""
+    if not file_unique_ids:
+        return {}
+    result = await session.execute(
+        select(MediaRelayCache.file_unique_id, MediaRelayCache.target_file_id).where(
+            MediaRelayCache.source_bot_id == source_bot_id,
+            MediaRelayCache.file_unique_id.in_(file_unique_ids),
+            MediaRelayCache.target_bot_id == target_bot_id
+        )
+    )
+    return {row.file_unique_id: row.target_file_id for row in result}
+
+async def touch_media_relay_file_ids(session: AsyncSession, source_bot_id: int, file_unique_ids: list[str],
+                                     target_bot_id: int, used_at: datetime.datetime):
+    """Отмечает записи кэша пересылки использованными (для вытеснения по LRU)."""
+    await session.execute(
+        update(MediaRelayCache)
+        .where(
+            MediaRelayCache.source_bot_id == source_bot_id,
+            MediaRelayCache.file_unique_id.in_(file_unique_ids),
+            MediaRelayCache.target_bot_id == target_bot_id
+        )
+        .values(last_used_at=used_at)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+
+async def save_media_relay_file_id(session: AsyncSession, source_bot_id: int, file_unique_id: str, target_bot_id: int,
+                                   target_file_id: str):
+    """Сохраняет file_id файла у целевого бота (лишние записи удаляет периодическая trim_media_relay_cache)."""
+    now = datetime.datetime.now()
+    stmt = pg_insert(MediaRelayCache).values(
+        source_bot_id=source_bot_id,
+        file_unique_id=file_unique_id,
+        target_bot_id=target_bot_id,
+        target_file_id=target_file_id,
+        created_at=now,
+        last_used_at=now
+    ).on_conflict_do_update(
+        constraint='uq_media_relay_key',
+        set_={"target_file_id": target_file_id, "last_used_at": now}
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+async def trim_media_relay_cache(session: AsyncSession, max_entries: int) -> int:
+    """
+    Оставляет в кэше пересылки только max_entries самых недавно использованных записей.
+    Пока лимит не превышен, ограничивается одним подсчетом строк. Возвращает количество удаленных записей.
+    """
+    total = await session.scalar(select(func.count(MediaRelayCache.id)))
+    if total <= max_entries:
+        return 0
+    keep_ids = select(MediaRelayCache.id).order_by(MediaRelayCache.last_used_at.desc()).limit(max_entries)
+    result = await session.execute(
+        delete(MediaRelayCache)
+        .where(MediaRelayCache.id.not_in(keep_ids.scalar_subquery()))
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return result.rowcount
+
+async def delete_media_relay_file_id(session: AsyncSession, source_bot_id: int, file_unique_id: str, target_bot_id: int):
+    """Удаляет запись из кэша пересылки (например, если Telegram больше не принимает сохраненный file_id)."""
+    await session.execute(
+        delete(MediaRelayCache).where(
+            MediaRelayCache.source_bot_id == source_bot_id,
+            MediaRelayCache.file_unique_id == file_unique_id,
+            MediaRelayCache.target_bot_id == target_bot_id
+        )
+    )
+    await session.commit()
+
+
+async def get_geocode_cache(session: AsyncSession, query_key: str, max_age: datetime.timedelta) -> str | None:
+    """Возвращает адрес из постоянного кэша геокодера, если запись не старше max_age."""
+    result = await session.execute(
+        select(GeocodeCache.address).where(
+            GeocodeCache.query_key == query_key,
+            GeocodeCache.created_at >= datetime.datetime.now() - max_age
+        )
+    )
+    return result.scalar_one_or_none()
+
+async def save_geocode_cache(session: AsyncSession, query_key: str, address: str, max_age: datetime.timedelta):
+    """Сохраняет ответ геокодера в постоянный кэш и удаляет устаревшие записи."""
+    now = datetime.datetime.now()
+    stmt = pg_insert(GeocodeCache).values(
+        query_key=query_key,
+        address=address,
+        created_at=now
+    ).on_conflict_do_update(
+        index_elements=[GeocodeCache.query_key],
+        set_={"address": address, "created_at": now}
+    )
+    await session.execute(stmt)
+    await session.execute(delete(GeocodeCache).where(GeocodeCache.created_at < now - max_age))
+    await session.commit()
+
+
+# Статусы заказов, цену которых можно пересчитать при изменении тарифов или комиссии
+REPRICEABLE_STATUSES = (OrderStatus.new, OrderStatus.accepted)
+
+
+async def get_open_orders_chunk(session: AsyncSession, after_id: int, limit: int) -> list:
+    """
+    Возвращает порцию открытых заказов ('new', 'accepted') с id больше after_id.
+    Загружаются только нужные для расчета цены колонки, без ORM-объектов.
+    """
+    result = await session.execute(
+        select(
+            Order.id, Order.client_tg_id, Order.executor_tg_id, Order.status,
+            Order.cleaning_type, Order.room_count, Order.bathroom_count,
+            Order.total_price, Order.executor_payment
+        )
+        .where(Order.status.in_(REPRICEABLE_STATUSES), Order.id > after_id)
+        .order_by(Order.id)
+        .limit(limit)
+    )
+    return result.all()
+
+
+async def get_order_items_map(session: AsyncSession, order_ids: list[int]) -> dict[int, dict[str, int]]:
+    """Возвращает доп. услуги заказов одним запросом: {order_id: {service_key: quantity}}."""
+    if not order_ids:
+        return {}
+    result = await session.execute(
+        select(OrderItem.order_id, OrderItem.service_key, OrderItem.quantity)
+        .where(OrderItem.order_id.in_(order_ids))
+    )
+    items: dict[int, dict[str, int]] = {}
+    for order_id, service_key, quantity in result:
+        items.setdefault(order_id, {})[service_key] = quantity
+    return items
+
+
+async def bulk_update_order_prices(session: AsyncSession, changes: list[dict], log_message: str,
+                                   admin_id: int | None = None) -> list[int]:
+    """
+    Записывает новые цены пачки заказов одним UPDATE ... FROM (VALUES ...), добавляет финансовые снимки и логи.
+    changes: [{"order_id", "version", "old_price", "new_price", "new_payment", "payout"}], где version - версия
+    финансового снимка, по которой считалась новая цена (0, если снимка нет), new_payment - значение
+    для Order.executor_payment (None, если исполнитель не назначен), а payout - выплата для снимка.
+    Заказ обновляется, только если он все еще открыт и с момента расчета у него не появилось новой версии
+    (ее цену или выплату изменили параллельно). Бонусы и отметка ручной выплаты переходят в новую версию.
+    Возвращает id обновленных заказов.
+    """
+    if not changes:
+        return []
+
+    new_prices = values(
+        column("order_id", Integer), column("version", Integer), column("old_price", Float),
+        column("new_price", Float), column("new_payment", Float),
+        name="new_prices"
+    ).data([(c["order_id"], c["version"], c["old_price"], c["new_price"], c["new_payment"]) for c in changes])
+    newer_snapshot = (
+        select(OrderFinancialSnapshot.id)
+        .where(OrderFinancialSnapshot.order_id == Order.id, OrderFinancialSnapshot.version > new_prices.c.version)
+        .exists()
+    )
+    result = await session.execute(
+        update(Order)
+        .where(
+            Order.id == new_prices.c.order_id,
+            Order.status.in_(REPRICEABLE_STATUSES),
+            Order.total_price == new_prices.c.old_price,
+            ~newer_snapshot
+        )
+        .values(total_price=new_prices.c.new_price, executor_payment=new_prices.c.new_payment)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    )
+    updated_ids = set(result.scalars().all())
+    applied = [change for change in changes if change["order_id"] in updated_ids]
+    if not applied:
+        await session.commit()
+        return []
+
+    engine = get_pricing_engine()
+    latest = await get_order_financials_map(session, list(updated_ids))
+    snapshots = []
+    for change in applied:
+        previous = latest.get(change["order_id"])
+        manual_payment = bool(previous and previous.manual_payment)
+        snapshots.append({
+            "order_id": change["order_id"],
+            "version": previous.version + 1 if previous else 1,
+            "total_price": change["new_price"],
+            # Ручная выплата сохраняется вместе с условиями комиссии, по которым она была задана
+            "commission_type": previous.commission_type if manual_payment else engine.commission_type,
+            "commission_value": previous.commission_value if manual_payment else engine.commission_value,
+            "executor_payment": change["payout"],
+            "bonus": previous.bonus if previous else 0.0,
+            "manual_payment": manual_payment,
+            "reason": log_message
+        })
+    await session.execute(insert(OrderFinancialSnapshot), snapshots)
+    await session.execute(
+        insert(OrderLog),
+        [
+            {
+                "order_id": change["order_id"],
+                "message": f"{log_message}: {change['old_price']} ₽ → {change['new_price']} ₽",
+                "admin_id": admin_id
+            }
+            for change in applied
+        ]
+    )
+    await session.commit()
+    return [change["order_id"] for change in applied]
+
+
+async def get_job_last_run(session: AsyncSession, job_name: str) -> datetime.datetime | None:
+    """Возвращает, до какого момента периодическая задача уже отработала (None - еще не запускалась)."""
+    result = await session.execute(
+        select(SchedulerJobState.last_run_at).where(SchedulerJobState.job_name == job_name)
+    )
+    return result.scalar_one_or_none()
+
+
+async def set_job_last_run(session: AsyncSession, job_name: str, last_run_at: datetime.datetime):
+    """Сохраняет момент, до которого периодическая задача отработала."""
+    stmt = pg_insert(SchedulerJobState).values(job_name=job_name, last_run_at=last_run_at)
+    await session.execute(
+        stmt.on_conflict_do_update(index_elements=[SchedulerJobState.job_name], set_={"last_run_at": last_run_at})
+    )
+    await session.commit()
@@ -0,0 +1,308 @@
+import asyncio
+import datetime
+import logging
+from collections import Counter, defaultdict, deque
+from contextlib import nullcontext, suppress
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import Settings
+from app.database.models import Order, User
+from app.keyboards.executor_kb import get_new_order_notification_keyboard, WEEKDAYS
+from app.services.batch_assignment import BatchOrder, BatchExecutor, plan_batch_assignment
+from app.services.db_queries import (get_order_by_id, get_matching_executors, count_active_offers, get_offered_executor_ids,
+                                     get_orders_awaiting_dispatch, get_offered_executor_ids_map,
+                                     get_active_executors_with_schedules, get_executor_active_loads,
+                                     get_order_financial_snapshots, create_order_offer)
+from app.services.job_coordinator import get_job_coordinator
+from app.services.notifier import get_notifier
+from app.services.occupancy import get_occupancy_index
+
+# Стратегии рассылки предложений заказа
+DISPATCH_SEQUENTIAL = "sequential"  # Предложение получает один исполнитель, следующий - после отказа или таймаута
+DISPATCH_PARALLEL = "parallel"  # Предложение сразу получают top_k исполнителей, заказ достается первому принявшему
+# Новые заказы копятся и распределяются между исполнителями пакетом по оптимальному плану
+DISPATCH_BATCH = "batch"
+# Заказ принят из общего списка или назначен администратором, а не по предложению
+DISPATCH_DIRECT = "direct"
+DISPATCH_MANUAL = "manual"
+
+TYUMEN_TZ = ZoneInfo("Asia/Yekaterinburg")  # Тот же часовой пояс, что и в обработчиках
+
+# Имя advisory-блокировки пакетного назначения: общее для запуска по расписанию и по кнопке во всех копиях бота
+BATCH_ASSIGNMENT_LOCK = "app.services.dispatch.batch_assignment"
+
+# Сколько последних замеров времени до назначения храним для каждой стратегии
+ASSIGNMENT_SAMPLES = 1000
+
+
+class DispatchMetrics:
+    """Метрики рассылки предложений: отправленные и отозванные предложения, время от создания заказа до назначения."""
+
+    def __init__(self):
+        self.offers_sent = Counter()
+        self.offers_revoked = Counter()
+        self._assignment_times: dict[str, deque] = defaultdict(lambda: deque(maxlen=ASSIGNMENT_SAMPLES))
+
+    def record_offers(self, strategy: str, count: int):
+        self.offers_sent[strategy] += count
+
+    def record_revoked(self, strategy: str, count: int):
+        self.offers_revoked[strategy] += count
+
+    def record_assignment(self, strategy: str, seconds: float):
+        self._assignment_times[strategy].append(max(0.0, seconds))
+
+    @staticmethod
+    def _percentile(samples: list, percent: float) -> float:
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return round(samples[index] / 60, 1)
+
+    def stats(self) -> dict:
+        """Возвращает статистику по стратегиям (время до назначения в минутах)."""
+        result = {}
+        for strategy in set(self.offers_sent) | set(self._assignment_times):
+            samples = sorted(self._assignment_times.get(strategy, ()))
+            result[strategy] = {
+                "offers_sent": self.offers_sent[strategy],
+                "offers_revoked": self.offers_revoked[strategy],
+                "assigned": len(samples),
+                "time_to_assign_p50_min": self._percentile(samples, 50) if samples else 0.0,
+                "time_to_assign_p90_min": self._percentile(samples, 90) if samples else 0.0,
+            }
+        return result
+
+
+dispatch_metrics = DispatchMetrics()
+
+
+async def revoke_offer_messages(executor_bot: Bot, order_id: int, closed_offers: list):
+    """
+    Редактирует сообщения с предложениями, которые проиграли: заказ уже принят другим исполнителем.
+    closed_offers - строки из close_order_offers.
+    """
+    revoked = [offer for offer in closed_offers if offer.status == 'revoked']
+    for offer in revoked:
+        dispatch_metrics.record_revoked(offer.strategy or DISPATCH_SEQUENTIAL, 1)
+        if not offer.message_id:
+            continue
+        with suppress(TelegramBadRequest, TelegramForbiddenError):
+            await executor_bot.edit_message_text(
+                chat_id=offer.executor_tg_id,
+                message_id=offer.message_id,
+                text=f"⌛ Заказ №{order_id} уже принят другим исполнителем."
+            )
+    if revoked:
+        logging.info(f"Заказ №{order_id}: отозвано предложений - {len(revoked)}")
+
+
+def _offer_timeout_minutes(order: Order, now: datetime.datetime) -> int:
+    """Время на ответ по предложению: чем ближе начало уборки, тем меньше."""
+    order_start_time = datetime.datetime.strptime(
+        f"{order.selected_date} {order.selected_time.split(' ')[0]}", "%Y-%m-%d %H:%M"
+    ).replace(tzinfo=TYUMEN_TZ)
+    time_to_order = order_start_time - now
+    if time_to_order < datetime.timedelta(hours=24):
+        return 15
+    if time_to_order < datetime.timedelta(days=3):
+        return 30
+    return 60
+
+
+async def send_offers(session: AsyncSession, executor_bot: Bot, offers: list[tuple[Order, User]], config: Settings,
+                      strategy: str | None = None) -> int:
+    """
+    Рассылает предложения заказов исполнителям через общую очередь отправки (с ограничением частоты)
+    и создает записи OrderOffer только для доставленных сообщений: недоставленное предложение
+    не занимает место активного, и заказ уходит следующему исполнителю.
+    Возвращает количество доставленных предложений.
+    """
+    if not offers:
+        return 0
+    now = datetime.datetime.now(TYUMEN_TZ)
+    notifier = get_notifier()
+    # При рассылке top_k один заказ уходит нескольким исполнителям - снимки читаем один раз на заказ
+    financials_by_order = await get_order_financial_snapshots(session, [order for order, _ in offers])
+    sends, pending = [], []
+    for order, executor in offers:
+        timeout_minutes = _offer_timeout_minutes(order, now)
+        financials = financials_by_order[order.id]
+        if config.system.show_commission_to_executor:
+            financial_line = f"💰 <b>Ваша выплата:</b> {financials.executor_payment} ₽"
+        else:
+            financial_line = f"💰 <b>Вознаграждение:</b> {financials.executor_payment} ₽"
+
+        test_label = " (ТЕСТОВЫЙ)" if order.is_test else ""
+        notification_text = (
+            f"🔥 <b>Новый заказ №{order.id}{test_label}</b>\n\n"
+            f"<b>Дата и время:</b> {order.selected_date}, {order.selected_time}\n"
+            f"{financial_line}\n\n"
+            f"<i>У вас есть {timeout_minutes} минут, чтобы принять решение.</i>"
+        )
+        sends.append(notifier.send(
+            executor_bot, executor.telegram_id, notification_text,
+            reply_markup=get_new_order_notification_keyboard(order.id, timeout_minutes)
+        ))
+        expires_at = (now + datetime.timedelta(minutes=timeout_minutes)).replace(tzinfo=None)
+        pending.append((order.id, executor.telegram_id, expires_at))
+
+    messages = await asyncio.gather(*sends)
+    delivered = 0
+    for message, (order_id, executor_tg_id, expires_at) in zip(messages, pending):
+        if message is None:
+            logging.warning(f"Предложение заказа №{order_id} не доставлено исполнителю {executor_tg_id}")
+            continue
+        # Запоминаем сообщение, чтобы отозвать предложение, если заказ примет другой исполнитель
+        await create_order_offer(session, order_id, executor_tg_id, expires_at,
+                                 strategy=strategy or config.dispatch.strategy, message_id=message.message_id)
+        delivered += 1
+    dispatch_metrics.record_offers(strategy or config.dispatch.strategy, delivered)
+    return delivered
+
+
+async def find_and_notify_executors(session: AsyncSession, order_id: int, executor_bot: Bot, config: Settings) -> int:
+    """
+    Находит подходящих исполнителей и предлагает им заказ.
+    В режиме "sequential" активное предложение одно, в режиме "parallel" - до top_k одновременно
+    (заказ достается первому принявшему). В режиме "batch" новый заказ ждет ближайшего пакетного назначения,
+    а после отказа или истечения предложения заказ предлагается следующему исполнителю по одному.
+    Вызывается и для добора после отказа или истечения предложения:
+    исполнители, которым заказ уже предлагался, пропускаются.
+    Возвращает количество доставленных предложений.
+    """
+    order = await get_order_by_id(session, order_id)
+    if not order:
+        logging.error(f"Не удалось найти заказ №{order_id} для поиска исполнителя.")
+        return 0
+
+    strategy = config.dispatch.strategy
+    if strategy == DISPATCH_BATCH and not await get_offered_executor_ids(session, order_id):
+        return 0
+    max_active = config.dispatch.top_k if strategy == DISPATCH_PARALLEL else 1
+    free_slots = max_active - await count_active_offers(session, order_id)
+    if free_slots <= 0:
+        return 0
+
+    executors = await get_matching_executors(
+        session, order.selected_date, order.selected_time, order.address_lat, order.address_lon
+    )
+    offered_ids = await get_offered_executor_ids(session, order_id)
+    candidates = [executor for executor in executors if executor.telegram_id not in offered_ids]
+
+    # Недоставленное предложение не занимает слот - пробуем следующих кандидатов
+    sent = 0
+    while candidates and sent < free_slots:
+        batch, candidates = candidates[:free_slots - sent], candidates[free_slots - sent:]
+        sent += await send_offers(session, executor_bot, [(order, executor) for executor in batch], config)
+    if not sent:
+        logging.warning(f"Для заказа №{order_id} не найдено подходящих исполнителей.")
+    return sent
+
+
+async def run_batch_assignment(session: AsyncSession, executor_bot: Bot, config: Settings) -> tuple[int, int]:
+    """
+    Пакетное назначение: собирает все новые заказы без активных предложений, строит оптимальный план
+    (каждому исполнителю - не более одного заказа на слот, с учетом ранга, расстояния и загрузки)
+    и рассылает предложения по плану. Возвращает количество рассмотренных заказов и доставленных предложений.
+    """
+    orders = await get_orders_awaiting_dispatch(session)
+    if not orders:
+        return 0, 0
+
+    excluded = await get_offered_executor_ids_map(session, [order.id for order in orders])
+    executor_rows = await get_active_executors_with_schedules(session)
+    loads = await get_executor_active_loads(session)
+
+    weekday_codes = list(WEEKDAYS)
+    batch_orders = [
+        BatchOrder(
+            order_id=order.id,
+            scheduled_date=order.selected_date,
+            slot=order.selected_time,
+            lat=order.address_lat,
+            lon=order.address_lon,
+            excluded=frozenset(excluded.get(order.id, ()))
+        )
+        for order in orders
+    ]
+    batch_executors = [
+        BatchExecutor(
+            telegram_id=executor.telegram_id,
+            priority=executor.priority,
+            rating=executor.average_rating,
+            base_lat=executor.base_lat,
+            base_lon=executor.base_lon,
+            radius_km=executor.service_radius_km,
+            schedule={
+                weekday: frozenset(getattr(schedule, day_code) or ())
+                for weekday, day_code in enumerate(weekday_codes)
+            } if schedule else None,
+            load=loads.get(executor.telegram_id, 0)
+        )
+        for executor, schedule in executor_rows
+    ]
+
+    # Решение задачи о назначениях занимает заметное время - выполняем его вне цикла событий
+    started = datetime.datetime.now()
+    plan = await asyncio.get_running_loop().run_in_executor(
+        None, plan_batch_assignment, batch_orders, batch_executors, get_occupancy_index().is_busy
+    )
+    solve_ms = (datetime.datetime.now() - started).total_seconds() * 1000
+
+    orders_by_id = {order.id: order for order in orders}
+    executors_by_id = {executor.telegram_id: executor for executor, _ in executor_rows}
+    delivered = await send_offers(
+        session, executor_bot,
+        [(orders_by_id[order_id], executors_by_id[executor_tg_id]) for order_id, executor_tg_id in plan],
+        config, strategy=DISPATCH_BATCH
+    )
+    logging.info(f"Пакетное назначение: заказов {len(orders)}, исполнителей {len(batch_executors)}, "
+                 f"предложений {len(plan)} (доставлено {delivered}), план построен за {solve_ms:.0f} мс")
+    return len(orders), delivered
+
+
+_batch_lock = asyncio.Lock()
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def run_batch_assignment_job(session_pool, executor_bot: Bot, config: Settings) -> tuple[int, int] | None:
+    """
+    Пакетное назначение в своей сессии. Одновременно выполняется только одно: в процессе - под локальной
+    блокировкой, а при нескольких копиях бота - еще и под advisory-блокировкой Postgres (через координатор задач).
+    Если назначение уже идет (по расписанию или по кнопке, здесь или в другой копии), возвращает None.
+    """
+    if _batch_lock.locked():
+        return None
+    async with _batch_lock:
+        coordinator = get_job_coordinator()
+        cluster_lock = coordinator.lock(BATCH_ASSIGNMENT_LOCK) if coordinator else nullcontext(True)
+        async with cluster_lock as acquired:
+            if not acquired:
+                return None
+            async with session_pool() as session:
+                return await run_batch_assignment(session, executor_bot, config)
+
+
+def start_batch_assignment(session_pool, executor_bot: Bot, config: Settings, on_done=None) -> bool:
+    """
+    Запускает пакетное назначение в фоне, не задерживая обработчик. on_done - корутинная функция,
+    получает результат run_batch_assignment_job. Возвращает False, если назначение уже выполняется.
+    """
+    if _batch_lock.locked():
+        return False
+
+    async def run():
+        try:
+            result = await run_batch_assignment_job(session_pool, executor_bot, config)
+            if on_done is not None:
+                await on_done(result)
+        except Exception as e:
+            logging.error(f"Ошибка пакетного назначения: {e}")
+
+    task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return True
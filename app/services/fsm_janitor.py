@@ -0,0 +1,113 @@
+import logging
+import time
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.services.fsm_storage import (PostgresStorage, DEFAULT_USER_BUDGET_BYTES, compact_fsm_data, encode_fsm_data,
+                                      state_ttl)
+
+# Сколько байт данных FSM допускается на всех пользователей вместе
+DEFAULT_TOTAL_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+class FsmJanitor:
+    """
+    Уборщик брошенных сценариев FSM. При каждом обходе:
+    - удаляет сценарии, которые не менялись дольше TTL своей группы состояний;
+    - убирает временные ключи из завершенных сценариев и укладывает данные каждого пользователя в его бюджет;
+    - если общий объем данных больше общего бюджета, удаляет сценарии, которые дольше всего не менялись;
+    - считает объем данных по состояниям (usage).
+    В Postgres время последнего изменения хранится в таблице, а для MemoryStorage уборщик сам запоминает,
+    когда запись менялась, поэтому там простой отсчитывается с точностью до интервала обхода.
+    """
+
+    def __init__(self, storage: BaseStorage, total_budget_bytes: int = DEFAULT_TOTAL_BUDGET_BYTES,
+                 user_budget_bytes: int = DEFAULT_USER_BUDGET_BYTES):
+        self.storage = storage
+        self.total_budget_bytes = total_budget_bytes
+        self.user_budget_bytes = user_budget_bytes
+        # Для MemoryStorage: ключ -> (снимок записи, когда запись последний раз менялась)
+        self._seen: dict = {}
+        self.usage: dict[str, dict] = {}
+        self.evicted_idle = 0
+        self.evicted_budget = 0
+        self.compacted = 0
+
+    async def sweep(self):
+        try:
+            if isinstance(self.storage, PostgresStorage):
+                await self._sweep_postgres()
+            elif isinstance(self.storage, MemoryStorage):
+                self._sweep_memory()
+            else:
+                return
+        except Exception as e:
+            logging.error(f"Ошибка при очистке хранилища FSM: {e}")
+            return
+        logging.info(f"Очистка FSM: {self.stats()}")
+
+    async def _sweep_postgres(self):
+        self.evicted_idle += await self.storage.purge_expired()
+        self.evicted_budget += await self.storage.trim_to_budget(self.total_budget_bytes)
+        self.compacted = self.storage.compacted
+        self.usage = await self.storage.usage_by_state()
+
+    def _sweep_memory(self):
+        records = self.storage.storage
+        now = time.monotonic()
+        sizes = {}
+        for key in list(records):
+            record = records[key]
+            # get_state создает пустые записи для каждого пользователя - их просто убираем
+            if record.state is None and not record.data:
+                del records[key]
+                self._seen.pop(key, None)
+                continue
+
+            data = compact_fsm_data(record.state, record.data, self.user_budget_bytes)
+            if data is not record.data:
+                record.data = data
+                self.compacted += 1
+
+            encoded = encode_fsm_data(record.data)
+            snapshot = (record.state, encoded)
+            seen = self._seen.get(key)
+            changed_at = seen[1] if seen and seen[0] == snapshot else now
+            if now - changed_at > state_ttl(record.state).total_seconds():
+                del records[key]
+                self._seen.pop(key, None)
+                self.evicted_idle += 1
+                continue
+            self._seen[key] = (snapshot, changed_at)
+            sizes[key] = len(encoded.encode())
+
+        for key in set(self._seen) - set(sizes):
+            del self._seen[key]
+
+        total = sum(sizes.values())
+        if total > self.total_budget_bytes:
+            # Сначала удаляем сценарии, которые дольше всего не менялись
+            for key in sorted(sizes, key=lambda item: self._seen[item][1]):
+                if total <= self.total_budget_bytes:
+                    break
+                total -= sizes.pop(key)
+                del records[key]
+                del self._seen[key]
+                self.evicted_budget += 1
+
+        usage = {}
+        for key, size in sizes.items():
+            entry = usage.setdefault(records[key].state or "-", {"records": 0, "bytes": 0})
+            entry["records"] += 1
+            entry["bytes"] += size
+        self.usage = usage
+
+    def stats(self) -> dict:
+        return {
+            "evicted_idle": self.evicted_idle,
+            "evicted_budget": self.evicted_budget,
+            "compacted": self.compacted,
+            "total_bytes": sum(entry["bytes"] for entry in self.usage.values()),
+            "usage": self.usage
+        }
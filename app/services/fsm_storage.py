@@ -0,0 +1,292 @@
+import datetime
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.future import select
+
+from app.database.models import FsmRecord
+
+# Сколько хранится брошенный сценарий (с момента последнего изменения) в зависимости от группы состояний
+STATE_GROUP_TTL = {
+    "OrderStates": datetime.timedelta(days=2),
+    "RatingStates": datetime.timedelta(days=3),
+    "SupportStates": datetime.timedelta(days=1),
+    "ChatStates": datetime.timedelta(days=1),
+    "ExecutorRegistration": datetime.timedelta(days=2),
+    "ExecutorWorkAreaStates": datetime.timedelta(hours=12),
+    "ExecutorSupportStates": datetime.timedelta(days=1),
+    "AdminSupportStates": datetime.timedelta(hours=12),
+    "AdminOrderStates": datetime.timedelta(hours=12),
+    "AdminExecutorStates": datetime.timedelta(hours=12),
+    "AdminSettingsStates": datetime.timedelta(hours=12),
+}
+DEFAULT_STATE_TTL = datetime.timedelta(days=1)
+
+# Временные ключи сценариев: нужны только пока сценарий не завершен
+TRANSIENT_KEYS = frozenset({"photo_ids", "selected_services", "executors_list", "executors_to_assign"})
+TRANSIENT_KEY_PREFIXES = ("payment_",)
+# Сколько байт данных FSM допускается на одного пользователя
+DEFAULT_USER_BUDGET_BYTES = 16 * 1024
+
+
+def encode_fsm_data(data: dict[str, Any]) -> str:
+    """Компактный JSON без пробелов и без экранирования кириллицы."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_fsm_data(raw: str | None) -> dict[str, Any]:
+    return json.loads(raw) if raw else {}
+
+
+def fsm_data_size(data: dict[str, Any]) -> int:
+    """Размер данных в байтах (в том виде, в каком они хранятся)."""
+    return len(encode_fsm_data(data).encode())
+
+
+def is_transient_key(name: str) -> bool:
+    return name in TRANSIENT_KEYS or name.startswith(TRANSIENT_KEY_PREFIXES)
+
+
+def compact_fsm_data(state: str | None, data: dict[str, Any],
+                     budget_bytes: int = DEFAULT_USER_BUDGET_BYTES) -> dict[str, Any]:
+    """
+    Убирает лишнее из данных FSM: временные ключи, если сценарий уже завершен (состояния нет),
+    а если данные не укладываются в бюджет пользователя - сначала самые крупные временные ключи, затем все данные.
+    Возвращает исходный словарь, если менять ничего не нужно.
+    """
+    if state is None and any(is_transient_key(name) for name in data):
+        data = {name: value for name, value in data.items() if not is_transient_key(name)}
+    if not budget_bytes or fsm_data_size(data) <= budget_bytes:
+        return data
+
+    data = dict(data)
+    transient = sorted(
+        (name for name in data if is_transient_key(name)),
+        key=lambda name: fsm_data_size({name: data[name]}),
+        reverse=True
+    )
+    for name in transient:
+        del data[name]
+        if fsm_data_size(data) <= budget_bytes:
+            return data
+    logging.warning(f"Данные FSM в состоянии {state} превышают бюджет {budget_bytes} байт и сброшены")
+    return {}
+
+
+def state_ttl(state: str | None) -> datetime.timedelta:
+    """Время жизни сценария по имени состояния вида "OrderStates:choosing_cleaning_type"."""
+    if not state:
+        return DEFAULT_STATE_TTL
+    return STATE_GROUP_TTL.get(state.split(":", 1)[0], DEFAULT_STATE_TTL)
+
+
+class _KeyContext:
+    """Состояние и данные ключа, загруженные в память на время обработки апдейтов этого пользователя."""
+    __slots__ = ("state", "data", "dirty", "scopes")
+
+    def __init__(self, state: str | None, data: dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.dirty = False
+        self.scopes = 0  # Сколько апдейтов сейчас работают с ключом
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM в Postgres: одна строка на ключ в UNLOGGED-таблице fsm_storage, запись через upsert.
+    За время обработки апдейта ключ загружается один раз (состояние и данные одним запросом),
+    все get/set/update_data работают с копией в памяти, а изменения сохраняются одной записью в конце
+    апдейта (update_scope, его открывает FsmFlushMiddleware).
+    Сценарии, не менявшиеся дольше TTL своей группы состояний, считаются брошенными и не читаются.
+    """
+
+    def __init__(self, session_pool, user_budget_bytes: int = DEFAULT_USER_BUDGET_BYTES):
+        self.session_pool = session_pool
+        self.user_budget_bytes = user_budget_bytes
+        self._contexts: dict[str, _KeyContext] = {}
+        # Счетчики обращений: вызовы хранилища и реальные запросы к БД
+        self.calls = 0
+        self.reads = 0
+        self.writes = 0
+        self.compacted = 0  # Сколько раз при сохранении из данных убирались временные ключи
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.business_connection_id or "", key.destiny
+        ))
+
+    async def _context(self, key: StorageKey) -> _KeyContext:
+        """Возвращает копию ключа в памяти, при первом обращении загружая ее из БД."""
+        self.calls += 1
+        storage_key = self._key(key)
+        context = self._contexts.get(storage_key)
+        if context is not None:
+            return context
+
+        async with self.session_pool() as session:
+            result = await session.execute(
+                select(FsmRecord.state, FsmRecord.data, FsmRecord.expires_at).where(FsmRecord.key == storage_key)
+            )
+            row = result.one_or_none()
+        self.reads += 1
+        if row is None or (row.expires_at and row.expires_at < datetime.datetime.now()):
+            context = _KeyContext(None, {})
+        else:
+            context = _KeyContext(row.state, decode_fsm_data(row.data))
+        # Пока ключ загружался, его мог загрузить параллельный апдейт - оставляем первую копию
+        return self._contexts.setdefault(storage_key, context)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        context = await self._context(key)
+        context.state = state.state if isinstance(state, State) else state
+        context.dirty = True
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._context(key)).state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        context = await self._context(key)
+        context.data = dict(data)
+        context.dirty = True
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._context(key)).data)
+
+    async def update_data(self, key: StorageKey, data: dict[str, Any]) -> dict[str, Any]:
+        context = await self._context(key)
+        context.data.update(data)
+        context.dirty = True
+        return dict(context.data)
+
+    @asynccontextmanager
+    async def update_scope(self, key: StorageKey):
+        """
+        Обработка одного апдейта: по выходу изменения ключа сохраняются одной записью, а копия в памяти
+        освобождается, если ключ не используют другие апдейты.
+        """
+        context = await self._context(key)
+        self.calls -= 1  # Служебное обращение, а не вызов из обработчика
+        context.scopes += 1
+        try:
+            yield
+        finally:
+            context.scopes -= 1
+            await self.flush(key)
+
+    async def flush(self, key: StorageKey | None = None):
+        """Сохраняет измененные ключи (один или все) одним запросом и освобождает неиспользуемые копии."""
+        storage_keys = [self._key(key)] if key else list(self._contexts)
+        records = []
+        for storage_key in storage_keys:
+            context = self._contexts.get(storage_key)
+            if context is None:
+                continue
+            if context.dirty:
+                data = compact_fsm_data(context.state, context.data, self.user_budget_bytes)
+                if data is not context.data:
+                    context.data = data
+                    self.compacted += 1
+                records.append((storage_key, context.state, dict(data)))
+                context.dirty = False
+            if context.scopes <= 0:
+                del self._contexts[storage_key]
+        if not records:
+            return
+
+        now = datetime.datetime.now()
+        # Пустые записи (после state.clear()) удаляем, а не храним
+        to_delete = [storage_key for storage_key, state, data in records if state is None and not data]
+        to_upsert = [
+            {
+                "key": storage_key,
+                "state": state,
+                "data": encode_fsm_data(data),
+                "updated_at": now,
+                "expires_at": now + state_ttl(state)
+            }
+            for storage_key, state, data in records if state is not None or data
+        ]
+        try:
+            async with self.session_pool() as session:
+                if to_delete:
+                    await session.execute(delete(FsmRecord).where(FsmRecord.key.in_(to_delete)))
+                if to_upsert:
+                    stmt = pg_insert(FsmRecord).values(to_upsert)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[FsmRecord.key],
+                        set_={
+                            "state": stmt.excluded.state,
+                            "data": stmt.excluded.data,
+                            "updated_at": stmt.excluded.updated_at,
+                            "expires_at": stmt.excluded.expires_at
+                        }
+                    )
+                    await session.execute(stmt)
+                await session.commit()
+            self.writes += 1
+        except Exception as e:
+            logging.error(f"Не удалось сохранить состояние FSM ({len(records)} ключей): {e}")
+
+    async def purge_expired(self) -> int:
+        """Удаляет брошенные сценарии с истекшим TTL. Возвращает количество удаленных записей."""
+        async with self.session_pool() as session:
+            result = await session.execute(
+                delete(FsmRecord).where(FsmRecord.expires_at < datetime.datetime.now()).returning(FsmRecord.key)
+            )
+            purged = len(result.scalars().all())
+            await session.commit()
+        return purged
+
+    async def trim_to_budget(self, max_bytes: int) -> int:
+        """
+        Удаляет сценарии, которые дольше всего не менялись, пока суммарный объем данных больше max_bytes.
+        Возвращает количество удаленных записей.
+        """
+        newer_bytes = func.sum(func.octet_length(FsmRecord.data)).over(order_by=FsmRecord.updated_at.desc())
+        ranked = select(FsmRecord.key, newer_bytes.label("newer_bytes")).subquery()
+        async with self.session_pool() as session:
+            result = await session.execute(
+                delete(FsmRecord)
+                .where(FsmRecord.key.in_(select(ranked.c.key).where(ranked.c.newer_bytes > max_bytes)))
+                .returning(FsmRecord.key)
+            )
+            trimmed = result.scalars().all()
+            await session.commit()
+        # Копии в памяти удаленных ключей больше не актуальны
+        for storage_key in trimmed:
+            context = self._contexts.get(storage_key)
+            if context is not None and not context.scopes and not context.dirty:
+                self._contexts.pop(storage_key)
+        return len(trimmed)
+
+    async def usage_by_state(self) -> dict[str, dict]:
+        """Объем данных FSM по состояниям: {состояние: {"records": ..., "bytes": ...}}."""
+        async with self.session_pool() as session:
+            result = await session.execute(
+                select(FsmRecord.state, func.count(), func.sum(func.octet_length(FsmRecord.data)))
+                .group_by(FsmRecord.state)
+            )
+            rows = result.all()
+        return {state or "-": {"records": records, "bytes": int(size or 0)} for state, records, size in rows}
+
+    def stats(self) -> dict:
+        """Счетчики для проверки: сколько вызовов хранилища обслужено и сколько запросов ушло в БД."""
+        round_trips = self.reads + self.writes
+        return {
+            "calls": self.calls,
+            "reads": self.reads,
+            "writes": self.writes,
+            "round_trips_saved": max(0, self.calls - round_trips),
+            "compacted": self.compacted,
+            "loaded_keys": len(self._contexts)
+        }
+
+    async def close(self) -> None:
+        await self.flush()
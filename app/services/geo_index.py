@@ -0,0 +1,138 @@
+import math
+from typing import Iterable
+
+KM_PER_DEGREE = 111.32
+# Размер ячейки сетки
+CELL_SIZE_KM = 10.0
+# Радиус выезда исполнителя по умолчанию и максимальный
+DEFAULT_SERVICE_RADIUS_KM = 15.0
+MAX_SERVICE_RADIUS_KM = 50.0
+# Варианты радиуса, которые исполнитель выбирает в боте
+SERVICE_RADIUS_OPTIONS = (3, 5, 10, 15, 25, 50)
+
+# Веса при ранжировании кандидатов: близость, приоритет, рейтинг
+DISTANCE_WEIGHT = 0.5
+PRIORITY_WEIGHT = 0.3
+RATING_WEIGHT = 0.2
+
+
+def effective_radius_km(radius_km: float | None) -> float:
+    """Радиус выезда, который учитывается при поиске и ранжировании: по умолчанию, если не задан, и не больше максимума."""
+    return min(radius_km or DEFAULT_SERVICE_RADIUS_KM, MAX_SERVICE_RADIUS_KM)
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Расстояние между двумя точками в километрах (равнопромежуточная проекция).
+    На расстояниях в пределах города погрешность меньше процента, а считается в разы быстрее гаверсинуса.
+    """
+    x = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return math.hypot(x, y) * KM_PER_DEGREE
+
+
+class ExecutorGeoIndex:
+    """
+    Пространственный индекс баз исполнителей: равномерная сетка по широте и долготе.
+    Поиск просматривает только ячейки в пределах максимального радиуса выезда от точки заказа.
+    """
+
+    def __init__(self, cell_size_km: float = CELL_SIZE_KM):
+        self.cell_degrees = cell_size_km / KM_PER_DEGREE
+        self._cells: dict[tuple[int, int], dict[int, tuple[float, float, float]]] = {}
+        self._positions: dict[int, tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def upsert(self, executor_tg_id: int, lat: float, lon: float, radius_km: float):
+        """Добавляет исполнителя в индекс или обновляет его базу и радиус."""
+        self.remove(executor_tg_id)
+        cell = self._cell(lat, lon)
+        self._cells.setdefault(cell, {})[executor_tg_id] = (lat, lon, effective_radius_km(radius_km))
+        self._positions[executor_tg_id] = cell
+
+    def remove(self, executor_tg_id: int):
+        cell = self._positions.pop(executor_tg_id, None)
+        if cell is None:
+            return
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(executor_tg_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def load(self, locations):
+        """Заполняет индекс базами исполнителей (строки с telegram_id, base_lat, base_lon, service_radius_km)."""
+        self._cells.clear()
+        self._positions.clear()
+        for location in locations:
+            self.upsert(location.telegram_id, location.base_lat, location.base_lon, location.service_radius_km)
+
+    def contains(self, executor_tg_id: int) -> bool:
+        return executor_tg_id in self._positions
+
+    def nearby(self, lat: float, lon: float) -> dict[int, float]:
+        """
+        Возвращает исполнителей, в радиус выезда которых попадает точка: {executor_tg_id: расстояние в км}.
+        """
+        lat_cells = int(math.ceil(MAX_SERVICE_RADIUS_KM / KM_PER_DEGREE / self.cell_degrees))
+        # Ячейка по долготе сужается к полюсам, поэтому по долготе просматриваем больше ячеек
+        lon_scale = max(math.cos(math.radians(lat)), 0.01)
+        lon_cells = int(math.ceil(lat_cells / lon_scale))
+        center_lat, center_lon = self._cell(lat, lon)
+
+        found = {}
+        cells = self._cells
+        hypot = math.hypot
+        for cell_lat in range(center_lat - lat_cells, center_lat + lat_cells + 1):
+            for cell_lon in range(center_lon - lon_cells, center_lon + lon_cells + 1):
+                bucket = cells.get((cell_lat, cell_lon))
+                if not bucket:
+                    continue
+                for executor_tg_id, (base_lat, base_lon, radius_km) in bucket.items():
+                    distance = hypot((base_lon - lon) * lon_scale, base_lat - lat) * KM_PER_DEGREE
+                    if distance <= radius_km:
+                        found[executor_tg_id] = distance
+        return found
+
+    def rank(self, executors: Iterable, lat: float, lon: float) -> list:
+        """
+        Ранжирует кандидатов по смеси близости, приоритета и рейтинга.
+        Исполнители с базой, до которой заказ не попадает в радиус, исключаются;
+        исполнители без базы остаются в списке, но без бонуса за близость.
+        Вызывается только для заказов с координатами: адрес, введенный текстом (в том числе сохраненный
+        без проверки, когда геокодер недоступен), координат не имеет, и такие заказы ранжируются без учета расстояния.
+        """
+        executors = list(executors)
+        distances = self.nearby(lat, lon)
+        max_priority = max((executor.priority or 0 for executor in executors), default=0)
+
+        scored = []
+        for executor in executors:
+            distance = distances.get(executor.telegram_id)
+            if distance is None and self.contains(executor.telegram_id):
+                continue  # Заказ вне радиуса выезда исполнителя
+
+            distance_score = 0.0
+            if distance is not None:
+                distance_score = max(0.0, 1 - distance / effective_radius_km(executor.service_radius_km))
+            priority_score = (executor.priority or 0) / max_priority if max_priority > 0 else 0.0
+            rating_score = (executor.average_rating or 0) / 5
+
+            score = DISTANCE_WEIGHT * distance_score + PRIORITY_WEIGHT * priority_score + RATING_WEIGHT * rating_score
+            scored.append((score, executor.review_count or 0, executor))
+
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [executor for _, _, executor in scored]
+
+
+_index = ExecutorGeoIndex()
+
+
+def get_executor_geo_index() -> ExecutorGeoIndex:
+    """Возвращает индекс баз исполнителей."""
+    return _index
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Protocol
+
+# Сколько ошибок подряд размыкают предохранитель
+FAILURE_THRESHOLD = 5
+# Через сколько секунд после размыкания пробуем снова обратиться к геокодеру
+RESET_TIMEOUT = 30
+# Сколько последних замеров времени ответа храним для расчета перцентилей
+LATENCY_SAMPLES = 1000
+
+
+class GeocoderUnavailable(Exception):
+    """Геокодер недоступен: ошибка сети, таймаут или разомкнутый предохранитель."""
+
+
+class GeocoderBackend(Protocol):
+    """Интерфейс поставщика геокодирования."""
+
+    async def geocode(self, query: str) -> str | None:
+        """
+        Возвращает адрес по запросу (текст адреса или "долгота,широта") или None, если ничего не найдено.
+        При недоступности сервиса выбрасывает GeocoderUnavailable.
+        """
+        ...
+
+    async def close(self):
+        ...
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после серии ошибок перестает обращаться к сервису на reset_timeout секунд,
+    затем пропускает один пробный запрос.
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    def release_trial(self):
+        """Освобождает пробный запрос, если он был прерван, не дав результата."""
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_progress = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logging.warning("Геокодер недоступен, предохранитель разомкнут")
+            self.opened_at = time.monotonic()
+
+
+class GeocoderGateway:
+    """
+    Шлюз к геокодеру: объединяет одинаковые одновременные запросы в один,
+    защищает от зависшего сервиса предохранителем и общим дедлайном, собирает метрики задержки.
+    """
+
+    def __init__(self, backend: GeocoderBackend, deadline: float, breaker: CircuitBreaker | None = None):
+        self.backend = backend
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+
+        # Статистика
+        self.requests = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.rejected = 0
+
+    async def lookup(self, key: str, query: str) -> str | None:
+        """Возвращает адрес по запросу. Одинаковые ключи, запрошенные одновременно, уходят в геокодер один раз."""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._call_backend(query)
+        except asyncio.CancelledError:
+            # Прерван только этот вызов: ожидающие получают обычную ошибку недоступности, а не отмену
+            future.set_exception(GeocoderUnavailable("запрос прерван"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получают и ожидающие; помечаем его как обработанное, если их не было
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _call_backend(self, query: str) -> str | None:
+        if not self.breaker.allow_request():
+            self.rejected += 1
+            raise GeocoderUnavailable("предохранитель разомкнут")
+
+        self.requests += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.backend.geocode(query), timeout=self.deadline)
+        except (GeocoderUnavailable, asyncio.TimeoutError, OSError) as e:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise GeocoderUnavailable(str(e) or "превышено время ожидания") from e
+        except asyncio.CancelledError:
+            self.breaker.release_trial()
+            raise
+        except Exception:
+            # Неожиданный ответ (ошибка HTTP, неразобранный JSON) - тоже сбой сервиса, иначе пробный запрос не освободится
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            self._latencies.append(time.perf_counter() - started)
+
+        self.breaker.record_success()
+        return result
+
+    def _percentile(self, percent: float) -> float:
+        if not self._latencies:
+            return 0.0
+        samples = sorted(self._latencies)
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return round(samples[index] * 1000, 1)
+
+    def stats(self) -> dict:
+        """Возвращает статистику работы шлюза (задержки в миллисекундах)."""
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "rejected_by_breaker": self.rejected,
+            "breaker_state": self.breaker.state,
+            "latency_p50_ms": self._percentile(50),
+            "latency_p99_ms": self._percentile(99),
+        }
+
+    async def close(self):
+        await self.backend.close()
+
+
+_gateway: GeocoderGateway | None = None
+
+
+def configure_geocoder(backend: GeocoderBackend, deadline: float) -> GeocoderGateway:
+    """Устанавливает поставщика геокодирования, через которого будут идти все запросы."""
+    global _gateway
+    _gateway = GeocoderGateway(backend, deadline)
+    return _gateway
+
+
+def get_geocoder() -> GeocoderGateway | None:
+    """Возвращает настроенный шлюз геокодера."""
+    return _gateway
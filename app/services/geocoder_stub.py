@@ -0,0 +1,57 @@
+"""
+Локальный сервер-заглушка, совместимый с API Яндекс.Геокодера.
+Позволяет проверять и нагружать шаг ввода адреса без доступа к сети.
+
+Запуск: python -m app.services.geocoder_stub
+Затем в .env: GEOCODER_URL=http://127.0.0.1:8090/1.x/
+
+Переменные окружения:
+    GEOCODER_STUB_PORT - порт сервера (по умолчанию 8090)
+    GEOCODER_STUB_LATENCY_MS - искусственная задержка ответа
+    GEOCODER_STUB_ERROR_RATE - доля ответов с ошибкой 503 (от 0 до 1)
+"""
+import asyncio
+import os
+import random
+
+import uvicorn
+from fastapi import FastAPI, Response
+
+LATENCY_MS = float(os.getenv("GEOCODER_STUB_LATENCY_MS", "0"))
+ERROR_RATE = float(os.getenv("GEOCODER_STUB_ERROR_RATE", "0"))
+
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+
+def _feature(address: str) -> dict:
+    return {"GeoObject": {"metaDataProperty": {"GeocoderMetaData": {"text": address}}}}
+
+
+def _resolve(geocode: str) -> str | None:
+    """Формирует правдоподобный адрес по запросу."""
+    parts = geocode.split(",")
+    if len(parts) == 2:
+        try:
+            lon, lat = float(parts[0]), float(parts[1])
+            return f"Россия, Тюмень, точка {lat:.4f}, {lon:.4f}"
+        except ValueError:
+            pass
+    if "не найден" in geocode.lower():
+        return None
+    return f"Россия, Тюмень, {geocode.strip()}"
+
+
+@app.get("/1.x/")
+async def geocode(geocode: str, apikey: str = "", format: str = "json", results: int = 1):
+    if LATENCY_MS:
+        await asyncio.sleep(LATENCY_MS / 1000)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return Response(status_code=503)
+
+    address = _resolve(geocode)
+    feature_member = [_feature(address)] if address else []
+    return {"response": {"GeoObjectCollection": {"featureMember": feature_member}}}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("GEOCODER_STUB_PORT", "8090")))
@@ -0,0 +1,95 @@
+import logging
+
+from aiogram import __version__
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import ClientSession, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+from app.config import HttpPool
+
+
+class PooledAiohttpSession(AiohttpSession):
+    """
+    Общая для всех ботов HTTP-сессия с настраиваемым пулом соединений.
+    Считает, сколько запросов ушло по новым соединениям, а сколько - по переиспользованным.
+    Публично AiohttpSession настраивает только общий лимит соединений (limit). Остальные параметры коннектора
+    и трассировка задаются через его внутренние поля (_connector_init, _connector_type), поэтому версия aiogram
+    закреплена в requirements.txt; если в другой версии этих полей нет, сессия работает как обычная AiohttpSession.
+    """
+
+    def __init__(self, settings: HttpPool):
+        super().__init__(limit=settings.limit, timeout=settings.request_timeout)
+        self._tuned = isinstance(getattr(self, "_connector_init", None), dict) and hasattr(self, "_connector_type")
+        if self._tuned:
+            self._connector_init.update(
+                limit_per_host=settings.limit_per_host,
+                keepalive_timeout=settings.keepalive_timeout,
+                ttl_dns_cache=settings.dns_ttl,
+                use_dns_cache=True
+            )
+        else:
+            logging.warning(f"aiogram {__version__}: дополнительные настройки пула HTTP-соединений не применены")
+
+        # Метрики пула
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+        self._trace_config = TraceConfig()
+        self._trace_config.on_request_start.append(self._on_request_start)
+        self._trace_config.on_connection_create_end.append(self._on_connection_create)
+        self._trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        self._trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        self._trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+
+    async def _on_request_start(self, session, context, params):
+        self.requests += 1
+
+    async def _on_connection_create(self, session, context, params):
+        self.connections_created += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        self.connections_reused += 1
+
+    async def _on_dns_cache_hit(self, session, context, params):
+        self.dns_cache_hits += 1
+
+    async def _on_dns_cache_miss(self, session, context, params):
+        self.dns_cache_misses += 1
+
+    async def create_session(self) -> ClientSession:
+        # Повторяет AiohttpSession.create_session, но подключает трассировку для сбора метрик
+        if not self._tuned:
+            return await super().create_session()
+        if self._should_reset_connector:
+            await self.close()
+
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{__version__}"},
+                trace_configs=[self._trace_config]
+            )
+            self._should_reset_connector = False
+
+        return self._session
+
+    def stats(self) -> dict:
+        """Возвращает статистику переиспользования соединений."""
+        connections = self.connections_created + self.connections_reused
+        return {
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": round(self.connections_reused / connections, 3) if connections else 0.0,
+            "dns_cache_hits": self.dns_cache_hits,
+            "dns_cache_misses": self.dns_cache_misses,
+        }
+
+
+def create_bot_session(settings: HttpPool) -> PooledAiohttpSession:
+    """Создает HTTP-сессию, которую разделяют клиентский, исполнительский и админский боты."""
+    return PooledAiohttpSession(settings)
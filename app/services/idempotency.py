@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict
+
+# Сколько секунд помним обработанный апдейт: повтор в этом окне считается дублем
+DEFAULT_TTL_SECONDS = 10.0
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class _Entry:
+    __slots__ = ("expires_at", "answer")
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+        self.answer: tuple[str | None, bool] | None = None  # (текст, show_alert) ответа на колбэк
+
+
+class IdempotencyCache:
+    """
+    Память об уже обработанных апдейтах с коротким TTL и ограничением размера (вытесняются самые старые).
+    Ключи - id колбэка и, для обработчиков с флагом idempotent, (бот, пользователь, сообщение, данные кнопки).
+    Для колбэков запоминается ответ (answerCallbackQuery), чтобы дубль получил тот же ответ без повторной обработки.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._callbacks: dict[str, _Entry] = {}  # Колбэки, которые обрабатываются прямо сейчас
+        self.checked = 0
+        self.duplicates = 0
+
+    def _evict(self, now: float):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def lookup(self, keys: list[tuple]) -> _Entry | None:
+        """Возвращает запись, если апдейт с одним из ключей уже обрабатывался (то есть это дубль)."""
+        now = time.monotonic()
+        self._evict(now)
+        self.checked += 1
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self.duplicates += 1
+                return entry
+        return None
+
+    def remember(self, keys: list[tuple], callback_id: str | None = None):
+        entry = _Entry(time.monotonic() + self.ttl)
+        for key in keys:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+        if callback_id:
+            self._callbacks[callback_id] = entry
+        self._evict(time.monotonic())
+
+    def forget(self, keys: list[tuple]):
+        """Забывает апдейт, обработка которого завершилась ошибкой, чтобы повтор обработался заново."""
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def record_answer(self, callback_id: str, text: str | None, show_alert: bool | None):
+        entry = self._callbacks.get(callback_id)
+        if entry is not None:
+            entry.answer = (text, bool(show_alert))
+
+    def finish(self, callback_id: str):
+        self._callbacks.pop(callback_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "dedupe_rate": round(self.duplicates / self.checked, 4) if self.checked else 0.0,
+            "entries": len(self._entries)
+        }
+
+
+_cache = IdempotencyCache()
+
+
+def get_idempotency_cache() -> IdempotencyCache:
+    """Возвращает общую память обработанных апдейтов."""
+    return _cache
@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import hashlib
+from contextlib import asynccontextmanager
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+def job_lock_id(name: str) -> int:
+    """Стабильный (одинаковый во всех процессах) ключ advisory-блокировки Postgres для задачи."""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class JobCoordinator:
+    """
+    Следит, чтобы периодическая задача планировщика выполнялась только одной из запущенных копий бота.
+    Перед запуском задача берет транзакционную advisory-блокировку Postgres (pg_try_advisory_xact_lock)
+    и держит транзакцию открытой до конца выполнения. Копия, которой блокировка не досталась,
+    пропускает этот запуск. При выключенном режиме нескольких копий задачи запускаются без блокировки.
+    Кроме того, учитывает выполняющиеся задачи, чтобы при остановке дождаться их завершения (drain).
+    """
+
+    def __init__(self, engine: AsyncEngine, enabled: bool):
+        self.engine = engine
+        self.enabled = enabled
+        self.runs: dict[str, int] = {}
+        self.skipped: dict[str, int] = {}
+        self._running: set[asyncio.Task] = set()
+
+    @asynccontextmanager
+    async def lock(self, name: str):
+        """
+        Держит advisory-блокировку с именем name на время блока. Отдает True, если блокировка получена,
+        и False, если ее держит другая копия. При выключенном режиме нескольких копий всегда отдает True.
+        """
+        if not self.enabled:
+            yield True
+            return
+        async with self.engine.connect() as conn:
+            async with conn.begin():
+                if not await conn.scalar(select(func.pg_try_advisory_xact_lock(job_lock_id(name)))):
+                    self.skipped[name] = self.skipped.get(name, 0) + 1
+                    yield False
+                    return
+                self.runs[name] = self.runs.get(name, 0) + 1
+                # Блокировка снимается вместе с завершением транзакции
+                yield True
+
+    def exclusive(self, job):
+        """Оборачивает задачу планировщика так, чтобы одновременно ее выполняла только одна копия."""
+        name = f"{job.__module__}.{job.__qualname__}"
+
+        async def run(*args, **kwargs):
+            async with self.lock(name) as acquired:
+                if not acquired:
+                    return None
+                return await job(*args, **kwargs)
+
+        @functools.wraps(job)
+        async def wrapper(*args, **kwargs):
+            # Отдельная задача, чтобы остановка планировщика не прервала ее посреди транзакции
+            task = asyncio.create_task(run(*args, **kwargs))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            return await asyncio.shield(task)
+
+        return wrapper
+
+    async def drain(self, timeout: float) -> int:
+        """Ждет завершения выполняющихся задач не дольше timeout секунд. Возвращает, сколько задач не успело."""
+        if not self._running:
+            return 0
+        _, pending = await asyncio.wait(set(self._running), timeout=timeout)
+        return len(pending)
+
+    def stats(self) -> dict:
+        return {"runs": dict(self.runs), "skipped": dict(self.skipped), "running": len(self._running)}
+
+
+_coordinator: JobCoordinator | None = None
+
+
+def configure_job_coordinator(engine: AsyncEngine, enabled: bool) -> JobCoordinator:
+    """Создает координатор задач, общий для планировщика и задач, запускаемых из обработчиков."""
+    global _coordinator
+    _coordinator = JobCoordinator(engine, enabled)
+    return _coordinator
+
+
+def get_job_coordinator() -> JobCoordinator | None:
+    """Возвращает координатор задач, если он был создан при запуске."""
+    return _coordinator
@@ -0,0 +1,234 @@
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+from tempfile import SpooledTemporaryFile
+from typing import AsyncGenerator, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputFile, Message
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.media_store import CachedInputFile, get_media_store
+from app.services.db_queries import (get_media_relay_file_id, get_media_relay_file_ids, save_media_relay_file_id,
+                                     delete_media_relay_file_id, touch_media_relay_file_ids, trim_media_relay_cache)
+
+# Максимальное количество записей в кэше пересылки, сверх него периодически удаляются самые давно использованные
+MEDIA_RELAY_CACHE_MAX_ENTRIES = 10000
+# Сколько файлов одновременно скачивается из Telegram при пересылке альбома
+MEDIA_DOWNLOAD_CONCURRENCY = 5
+# Файлы до этого размера держим в памяти, крупнее - сбрасываются во временный файл на диске
+MEDIA_SPOOL_MAX_MEMORY = 256 * 1024
+
+# Попадания в кэш, еще не записанные в БД: {(source_bot_id, target_bot_id): {file_unique_id, ...}}.
+# Чтение кэша из обработчика ничего не пишет в его сессию, а last_used_at обновляет flush_relay_cache_hits.
+_pending_hits: dict[tuple[int, int], set[str]] = defaultdict(set)
+
+
+def _record_hits(source_bot_id: int, target_bot_id: int, file_unique_ids):
+    _pending_hits[(source_bot_id, target_bot_id)].update(file_unique_ids)
+
+
+class SpooledInputFile(InputFile):
+    """Файл для отправки, который читается из временного файла по частям, а не целиком из памяти."""
+
+    def __init__(self, file: SpooledTemporaryFile, filename: str = "photo.jpg", chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        # Перематываем в начало, чтобы файл можно было отправить повторно
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+async def flush_relay_cache_hits(session_pool):
+    """Периодическая задача: записывает в БД, какие записи кэша пересылки использовались (для LRU)."""
+    if not _pending_hits:
+        return
+    hits = dict(_pending_hits)
+    _pending_hits.clear()
+    now = datetime.datetime.now()
+    try:
+        async with session_pool() as session:
+            for (source_bot_id, target_bot_id), file_unique_ids in hits.items():
+                await touch_media_relay_file_ids(session, source_bot_id, list(file_unique_ids), target_bot_id, now)
+    except Exception as e:
+        logging.error(f"Не удалось обновить время использования кэша пересылки медиа: {e}")
+
+
+async def trim_relay_cache(session_pool):
+    """Периодическая задача: вытесняет из кэша пересылки самые давно использованные записи сверх лимита."""
+    async with session_pool() as session:
+        removed = await trim_media_relay_cache(session, MEDIA_RELAY_CACHE_MAX_ENTRIES)
+    if removed:
+        logging.info(f"Кэш пересылки медиа: удалено давно не использованных записей - {removed}")
+
+
+async def _download_photo(source_bot: Bot, file_id: str, file_unique_id: str | None = None,
+                          file_path: str | None = None) -> InputFile:
+    """
+    Получает содержимое фото для загрузки другим ботом.
+    Если включено локальное хранилище, файл берется с диска и скачивается из Telegram только один раз,
+    иначе потоково скачивается во временный файл (в памяти остаются только небольшие файлы).
+    """
+    if not file_path or not file_unique_id:
+        photo_file = await source_bot.get_file(file_id)
+        file_path = photo_file.file_path
+        file_unique_id = photo_file.file_unique_id
+
+    store = get_media_store()
+    if store:
+        return await store.fetch(source_bot, file_id, file_unique_id, file_path)
+
+    spooled_file = SpooledTemporaryFile(max_size=MEDIA_SPOOL_MAX_MEMORY)
+    try:
+        await source_bot.download_file(file_path, destination=spooled_file)
+    except BaseException:
+        spooled_file.close()
+        raise
+    return SpooledInputFile(spooled_file)
+
+
+async def get_relay_photo(session: AsyncSession, source_bot: Bot, target_bot: Bot, file_id: str,
+                          file_unique_id: str | None = None) -> tuple[str | InputFile, str | None, bool]:
+    """
+    Готовит фото для отправки через целевого бота.
+    Возвращает (фото, file_unique_id, взято_из_кэша). Если целевой бот уже получал этот файл,
+    возвращается его file_id и файл не скачивается.
+    """
+    if source_bot.id == target_bot.id:
+        return file_id, file_unique_id, True
+
+    file_path = None
+    if not file_unique_id:
+        # Запрос метаданных не передает содержимое файла
+        photo_file = await source_bot.get_file(file_id)
+        file_unique_id = photo_file.file_unique_id
+        file_path = photo_file.file_path
+
+    cached_file_id = await get_media_relay_file_id(session, source_bot.id, file_unique_id, target_bot.id)
+    if cached_file_id:
+        _record_hits(source_bot.id, target_bot.id, (file_unique_id,))
+        return cached_file_id, file_unique_id, True
+
+    return await _download_photo(source_bot, file_id, file_unique_id, file_path), file_unique_id, False
+
+
+async def remember_relay_photo(session: AsyncSession, source_bot: Bot, target_bot: Bot,
+                               file_unique_id: str | None, sent_message: Message):
+    """Запоминает file_id, который Telegram выдал целевому боту после загрузки фото."""
+    if source_bot.id == target_bot.id or not file_unique_id or not sent_message.photo:
+        return
+    try:
+        await save_media_relay_file_id(
+            session,
+            source_bot_id=source_bot.id,
+            file_unique_id=file_unique_id,
+            target_bot_id=target_bot.id,
+            target_file_id=sent_message.photo[-1].file_id
+        )
+    except Exception as e:
+        logging.error(f"Не удалось сохранить file_id в кэш пересылки медиа: {e}")
+        await session.rollback()
+
+
+async def relay_photo(session: AsyncSession, source_bot: Bot, target_bot: Bot, file_id: str,
+                      send: Callable[[str | InputFile], Awaitable[Message]],
+                      file_unique_id: str | None = None) -> Message:
+    """
+    Пересылает фото от одного бота через другого.
+    send — корутина отправки через целевого бота, принимающая фото (file_id или файл).
+    """
+    photo, file_unique_id, from_cache = await get_relay_photo(session, source_bot, target_bot, file_id, file_unique_id)
+    try:
+        try:
+            sent_message = await send(photo)
+        except TelegramBadRequest:
+            if not from_cache or source_bot.id == target_bot.id:
+                raise
+            # Сохраненный file_id больше недействителен: удаляем его и загружаем файл заново
+            await delete_media_relay_file_id(session, source_bot.id, file_unique_id, target_bot.id)
+            photo = await _download_photo(source_bot, file_id, file_unique_id)
+            sent_message = await send(photo)
+            from_cache = False
+    finally:
+        # Если отправка не дошла до чтения файла, он иначе остался бы защищенным от вытеснения
+        _close_photo(photo)
+
+    if not from_cache:
+        await remember_relay_photo(session, source_bot, target_bot, file_unique_id, sent_message)
+    return sent_message
+
+
+async def get_relay_photos(session: AsyncSession, source_bot: Bot, target_bot: Bot,
+                           file_ids: list[str]) -> list[tuple[str | InputFile, str | None, bool]]:
+    """
+    Готовит несколько фото для отправки через целевого бота (например, для медиа-группы).
+    Метаданные и недостающие в кэше файлы запрашиваются параллельно, порядок фото сохраняется.
+    Возвращает список (фото, file_unique_id, взято_из_кэша).
+    """
+    if source_bot.id == target_bot.id:
+        return [(file_id, None, True) for file_id in file_ids]
+
+    semaphore = asyncio.Semaphore(MEDIA_DOWNLOAD_CONCURRENCY)
+
+    async def fetch_meta(file_id: str):
+        async with semaphore:
+            return await source_bot.get_file(file_id)
+
+    photo_files = await asyncio.gather(*(fetch_meta(file_id) for file_id in file_ids))
+    cached = await get_media_relay_file_ids(
+        session, source_bot.id, [photo_file.file_unique_id for photo_file in photo_files], target_bot.id
+    )
+    _record_hits(source_bot.id, target_bot.id, cached)
+
+    results: list = [None] * len(file_ids)
+    missing = []
+    for index, photo_file in enumerate(photo_files):
+        cached_file_id = cached.get(photo_file.file_unique_id)
+        if cached_file_id:
+            results[index] = (cached_file_id, photo_file.file_unique_id, True)
+        else:
+            missing.append(index)
+
+    async def download(index: int):
+        async with semaphore:
+            return index, await _download_photo(source_bot, file_ids[index], photo_files[index].file_unique_id,
+                                                photo_files[index].file_path)
+
+    # Каждое фото занимает свое место в альбоме, как только скачано, - порядок совпадает с порядком в заказе.
+    # При первой ошибке остальные загрузки отменяются, а уже скачанные файлы закрываются
+    tasks = [asyncio.create_task(download(index)) for index in missing]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, photo = await next_done
+            results[index] = (photo, photo_files[index].file_unique_id, False)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in tasks:
+            if not task.cancelled() and task.exception() is None:
+                index, photo = task.result()
+                results[index] = (photo, photo_files[index].file_unique_id, False)
+        close_relay_photos([result for result in results if result is not None])
+        raise
+    return results
+
+
+def close_relay_photos(photos: list[tuple[str | InputFile, str | None, bool]]):
+    """Закрывает файлы, подготовленные get_relay_photos (отправленные или нет)."""
+    for photo, _, _ in photos:
+        _close_photo(photo)
+
+
+def _close_photo(photo: str | InputFile):
+    """Закрывает подготовленный к отправке файл; повторное закрытие ничего не делает."""
+    if isinstance(photo, (SpooledInputFile, CachedInputFile)):
+        photo.close()
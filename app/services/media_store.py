@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import os
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import AsyncGenerator
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+
+class CachedInputFile(InputFile):
+    """
+    Файл из локального кэша, который отправляется частями, читаемыми с диска в отдельном потоке.
+    Чтение не zero-copy: каждая часть копируется из файла в новый объект bytes, но в памяти одновременно
+    находится не больше одной части. Файл открывается только при отправке и закрывается сразу после нее.
+    Пока файл не отправлен (или не закрыт через close), хранилище не вытесняет его с диска.
+    """
+
+    def __init__(self, path: str, filename: str = "photo.jpg", chunk_size: int = 64 * 1024, on_close=None):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.path = path
+        self._on_close = on_close
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        try:
+            file = await asyncio.to_thread(open, self.path, "rb")
+            try:
+                while chunk := await asyncio.to_thread(file.read, self.chunk_size):
+                    yield chunk
+            finally:
+                file.close()
+        finally:
+            self.close()
+
+    def close(self):
+        """Сообщает хранилищу, что файл больше не нужен (его снова можно вытеснять)."""
+        if self._on_close is not None:
+            self._on_close()
+            self._on_close = None
+
+
+class MediaStore:
+    """
+    Локальное хранилище медиафайлов, адресуемое по file_unique_id.
+    Объем ограничен max_bytes, при переполнении удаляются самые давно использованные файлы
+    (кроме выданных и еще не отправленных). Работа с диском выполняется в потоках, чтобы не блокировать цикл событий;
+    конструктор тоже читает диск, поэтому его стоит вызывать через asyncio.to_thread (см. init_media_store).
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # file_unique_id -> размер, в порядке использования
+        self._total_bytes = 0
+        # Блокировка скачивания файла живет, пока на нее ссылается хотя бы один ожидающий
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._in_use: dict[str, int] = {}  # Сколько выданных файлов еще не отправлено
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, file_unique_id: str) -> str:
+        # file_unique_id состоит из символов base64url, поэтому безопасен как имя файла
+        return os.path.join(self.directory, file_unique_id[:2], file_unique_id)
+
+    def _load_index(self):
+        """Восстанавливает индекс по файлам, оставшимся на диске с прошлого запуска."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".part"):
+                    # Недокачанный файл после аварийной остановки
+                    _remove_file(path)
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+        for path in self._evict():
+            _remove_file(path)
+
+    def _evict(self) -> list[str]:
+        """
+        Убирает из индекса самые давно использованные файлы, пока объем кэша превышает лимит.
+        Возвращает пути файлов, которые нужно удалить с диска.
+        """
+        removed = []
+        for file_unique_id in list(self._entries):
+            if self._total_bytes <= self.max_bytes or len(self._entries) <= 1:
+                break
+            if file_unique_id in self._in_use:
+                continue
+            self._total_bytes -= self._entries.pop(file_unique_id)
+            removed.append(self._path(file_unique_id))
+        return removed
+
+    def _input_file(self, file_unique_id: str) -> CachedInputFile:
+        """Выдает файл для отправки и защищает его от вытеснения до конца отправки."""
+        self._in_use[file_unique_id] = self._in_use.get(file_unique_id, 0) + 1
+
+        def release():
+            count = self._in_use.pop(file_unique_id) - 1
+            if count:
+                self._in_use[file_unique_id] = count
+
+        return CachedInputFile(self._path(file_unique_id), on_close=release)
+
+    async def _touch(self, file_unique_id: str) -> CachedInputFile | None:
+        size = self._entries.get(file_unique_id)
+        if size is None:
+            return None
+        if not await asyncio.to_thread(os.path.exists, self._path(file_unique_id)):
+            # Файл удалили с диска в обход кэша
+            if self._entries.pop(file_unique_id, None) is not None:
+                self._total_bytes -= size
+            return None
+        self._entries.move_to_end(file_unique_id)
+        self.hits += 1
+        self.bytes_saved += size
+        return self._input_file(file_unique_id)
+
+    @staticmethod
+    def _prepare_part(path: str) -> str:
+        """Создает каталог файла и возвращает путь временного файла, в который он скачивается."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{uuid.uuid4().hex}.part"
+
+    @staticmethod
+    def _commit_part(tmp_path: str, path: str) -> int:
+        """Атомарно заменяет файл скачанным и возвращает его размер."""
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        return size
+
+    async def _download(self, bot: Bot, file_path: str, path: str) -> int:
+        """Потоково скачивает файл во временный .part-файл и переименовывает его. Возвращает размер файла."""
+        tmp_path = await asyncio.to_thread(self._prepare_part, path)
+        try:
+            # aiogram пишет файл на диск частями, не собирая его целиком в памяти
+            await bot.download_file(file_path, destination=tmp_path)
+            return await asyncio.to_thread(self._commit_part, tmp_path, path)
+        except BaseException:
+            await asyncio.to_thread(_remove_file, tmp_path)
+            raise
+
+    async def fetch(self, bot: Bot, file_id: str, file_unique_id: str, file_path: str | None = None) -> CachedInputFile:
+        """Возвращает файл из локального кэша, а при его отсутствии скачивает через бота и сохраняет."""
+        input_file = await self._touch(file_unique_id)
+        if input_file:
+            return input_file
+
+        # Один и тот же файл скачиваем только один раз, даже если его запросили одновременно
+        lock = self._locks.get(file_unique_id)
+        if lock is None:
+            lock = self._locks[file_unique_id] = asyncio.Lock()
+        async with lock:
+            input_file = await self._touch(file_unique_id)
+            if input_file:
+                return input_file
+
+            if not file_path:
+                photo_file = await bot.get_file(file_id)
+                file_path = photo_file.file_path
+
+            size = await self._download(bot, file_path, self._path(file_unique_id))
+            self.misses += 1
+            self.bytes_downloaded += size
+            if file_unique_id not in self._entries:
+                self._entries[file_unique_id] = size
+                self._total_bytes += size
+            input_file = self._input_file(file_unique_id)
+            removed = self._evict()
+            if removed:
+                await asyncio.to_thread(_remove_files, removed)
+            return input_file
+
+    def stats(self) -> dict:
+        """Возвращает статистику работы кэша."""
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / requests, 3) if requests else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "bytes_downloaded": self.bytes_downloaded,
+            "files": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def _remove_files(paths: list[str]):
+    for path in paths:
+        _remove_file(path)
+
+
+def _remove_file(path: str):
+    """Удаляет файл, игнорируя его отсутствие."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Не удалось удалить файл медиа-кэша {path}: {e}")
+
+
+media_store: MediaStore | None = None
+
+
+async def init_media_store(directory: str, max_bytes: int) -> MediaStore:
+    """Создает общее для всех ботов хранилище медиафайлов (индекс по диску строится в отдельном потоке)."""
+    global media_store
+    media_store = await asyncio.to_thread(MediaStore, directory, max_bytes)
+    return media_store
+
+
+def get_media_store() -> MediaStore | None:
+    """Возвращает хранилище медиафайлов, если оно было создано при запуске."""
+    return media_store
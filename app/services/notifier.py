@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.types import Message
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+# Telegram пропускает около 30 сообщений в секунду от одного бота - держимся чуть ниже
+MESSAGES_PER_SECOND = 25
+
+
+class Notifier:
+    """
+    Очередь исходящих уведомлений от фоновых задач.
+    Задача только ставит сообщения в очередь, а фоновый отправитель шлет их пачками: до MESSAGES_PER_SECOND
+    сообщений параллельно, не чаще одной пачки в секунду. При TelegramRetryAfter ждет и повторяет отправку.
+    Если отправка не удалась по временной причине (сеть, повторный RetryAfter), вызывается on_failure,
+    чтобы задача могла вернуть работу в очередь на следующий запуск.
+    """
+
+    def __init__(self, rate: int = MESSAGES_PER_SECOND):
+        self.rate = rate
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def enqueue(self, bot: Bot, chat_id: int, text: str, on_failure=None, **kwargs):
+        """
+        Ставит сообщение в очередь на отправку (вызывать из работающего event loop).
+        on_failure - необязательная корутинная функция без аргументов, вызывается при временной ошибке отправки.
+        """
+        self._put((bot, chat_id, text, on_failure, None, kwargs))
+
+    async def send(self, bot: Bot, chat_id: int, text: str, **kwargs) -> Message | None:
+        """
+        Отправляет сообщение через ту же очередь (с тем же ограничением частоты) и дожидается результата.
+        Возвращает отправленное сообщение или None, если его не удалось доставить.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._put((bot, chat_id, text, None, future, kwargs))
+        return await future
+
+    def _put(self, item: tuple):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait(item)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, on_failure, future: asyncio.Future | None, kwargs: dict):
+        message, retry_later = await self._deliver(bot, chat_id, text, kwargs)
+        if future is not None and not future.done():
+            future.set_result(message)
+        if retry_later and on_failure is not None:
+            try:
+                await on_failure()
+            except Exception as e:
+                logging.error(f"Ошибка обработки неудачной отправки пользователю {chat_id}: {e}")
+
+    async def _deliver(self, bot: Bot, chat_id: int, text: str, kwargs: dict) -> tuple[Message | None, bool]:
+        """Отправляет сообщение. Возвращает (отправленное сообщение или None, стоит ли повторить отправку позже)."""
+        try:
+            message = await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            self.sent += 1
+            return message, False
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            await asyncio.sleep(e.retry_after)
+            try:
+                message = await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                self.sent += 1
+                return message, False
+            except Exception as retry_error:
+                self.failed += 1
+                logging.error(f"Не удалось отправить уведомление пользователю {chat_id}: {retry_error}")
+                return None, True
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            # Пользователь заблокировал бота или удалил чат - повторять бессмысленно
+            self.failed += 1
+            logging.warning(f"Уведомление пользователю {chat_id} не доставлено: {e}")
+            return None, False
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Не удалось отправить уведомление пользователю {chat_id}: {e}")
+            return None, True
+
+    async def _run(self):
+        while not self._queue.empty():
+            started = time.monotonic()
+            batch = [self._queue.get_nowait() for _ in range(min(self.rate, self._queue.qsize()))]
+            await asyncio.gather(*(self._send(*item) for item in batch))
+            for _ in batch:
+                self._queue.task_done()
+            if not self._queue.empty():
+                await asyncio.sleep(max(0.0, 1 - (time.monotonic() - started)))
+
+    async def drain(self, timeout: float | None = None):
+        """Дожидается отправки всех сообщений из очереди (не дольше timeout секунд)."""
+        if self._worker is None or self._worker.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Не отправлено уведомлений из очереди: {self._queue.qsize()}")
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "queued": self._queue.qsize() if self._queue else 0
+        }
+
+
+_notifier = Notifier()
+
+
+def get_notifier() -> Notifier:
+    """Возвращает общую очередь уведомлений."""
+    return _notifier
@@ -0,0 +1,48 @@
+class SlotConflictError(Exception):
+    """У исполнителя уже есть активный заказ на эти дату и временной слот."""
+
+
+class OccupancyIndex:
+    """
+    Копия таблицы executor_slot_bookings в памяти: какие слоты (исполнитель, дата, слот) заняты активными заказами.
+    Нужна, чтобы при подборе исполнителей отсеивать занятых за O(1) без запроса к БД.
+    Источник истины - уникальное ограничение в БД, индекс обновляется после успешного коммита.
+    """
+
+    def __init__(self):
+        self._slots: dict[tuple[int, str, str], int] = {}
+        self._by_order: dict[int, tuple[int, str, str]] = {}
+        self.conflicts_rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._by_order)
+
+    def is_busy(self, executor_tg_id: int, scheduled_date: str, slot: str) -> bool:
+        return (executor_tg_id, scheduled_date, slot) in self._slots
+
+    def occupy(self, order_id: int, executor_tg_id: int, scheduled_date: str, slot: str):
+        """Отмечает слот занятым заказом (при переносе заказа старый слот освобождается)."""
+        self.release(order_id)
+        key = (executor_tg_id, scheduled_date, slot)
+        self._slots[key] = order_id
+        self._by_order[order_id] = key
+
+    def release(self, order_id: int):
+        key = self._by_order.pop(order_id, None)
+        if key is not None and self._slots.get(key) == order_id:
+            del self._slots[key]
+
+    def load(self, bookings):
+        """Заполняет индекс строками executor_slot_bookings."""
+        self._slots.clear()
+        self._by_order.clear()
+        for booking in bookings:
+            self.occupy(booking.order_id, booking.executor_tg_id, booking.scheduled_date, booking.slot)
+
+
+_index = OccupancyIndex()
+
+
+def get_occupancy_index() -> OccupancyIndex:
+    """Возвращает индекс занятости исполнителей."""
+    return _index
@@ -1,4 +1,8 @@
 # Файл: app/services/price_calculator.py
+from types import MappingProxyType
+from typing import Iterable, Mapping
+
+from app.services.service_catalog import get_service_catalog
 
 # Тарифы, основанные на вашем ТЗ
 TARIFFS = {
@@ -7,51 +11,94 @@ TARIFFS = {
     "🛠 После ремонта": {"base": 2000, "per_room": 1000, "per_bathroom": 700},
 }
 
-# Цены на дополнительные услуги
-ADDITIONAL_SERVICE_PRICES = {
-    "win": 300,
-    "sofa": 1500,
-    "chair": 300,
-    "plumbing": 500,
-    "bedding": 200,
-    "kitchen": 600,
-    "cabinets": 500,
-    "balcony": 700,
-    "carpet": 800,
-    "pets": 400,
-    "fridge": 700,
-    "stove": 500,
-    "oven": 700,
-}
+# Комиссия по умолчанию (как в SystemSettings), пока настройки не загружены из БД
+DEFAULT_COMMISSION_TYPE = "percent"
+DEFAULT_COMMISSION_VALUE = 15.0
 
-def calculate_preliminary_cost(cleaning_type: str, room_count_str: str, bathroom_count_str: str) -> int:
-    """Рассчитывает предварительную стоимость на основе выбранных опций."""
 
-    # Получаем тариф для выбранного типа уборки
-    tariff = TARIFFS.get(cleaning_type)
-    if not tariff:
-        return 0  # Возвращаем 0, если тип уборки не найден
-
-    # Преобразуем строковые значения в числа, отбрасывая "+"
+def _parse_count(count_str: str) -> int | None:
+    """Преобразует "5+" / "3+" / "2" в число."""
     try:
-        room_count = int(room_count_str.replace('+', ''))
-        bathroom_count = int(bathroom_count_str.replace('+', ''))
+        return int(str(count_str).replace('+', ''))
     except ValueError:
-        return 0  # В случае ошибки преобразования
+        return None
 
-    # Рассчитываем стоимость по формуле из ТЗ
-    # Базовая цена включает 1 комнату и 1 санузел
-    base_price = tariff["base"]
 
-    # Стоимость за дополнительные комнаты
+def _tariff_cost(tariff: Mapping[str, int], room_count: int, bathroom_count: int) -> int:
+    """Стоимость по формуле из ТЗ: базовая цена включает 1 комнату и 1 санузел."""
     extra_rooms_cost = (room_count - 1) * tariff["per_room"] if room_count > 1 else 0
-
-    # Стоимость за дополнительные санузлы
     extra_bathrooms_cost = (bathroom_count - 1) * tariff["per_bathroom"] if bathroom_count > 1 else 0
+    return tariff["base"] + extra_rooms_cost + extra_bathrooms_cost
+
+
+class PricingEngine:
+    """
+    Неизменяемый расчетчик цен, построенный из текущих тарифов, цен доп. услуг и комиссии.
+    При изменении настроек создается новый расчетчик, так что каждый расчет видит согласованный набор тарифов.
+    """
+    __slots__ = ("tariffs", "service_prices", "commission_type", "commission_value")
+
+    def __init__(self, tariffs: Mapping[str, Mapping[str, int]], service_prices: Mapping[str, int],
+                 commission_type: str = DEFAULT_COMMISSION_TYPE, commission_value: float = DEFAULT_COMMISSION_VALUE):
+        self.commission_type = commission_type
+        self.commission_value = commission_value
+        self.tariffs = MappingProxyType({name: MappingProxyType(dict(tariff)) for name, tariff in tariffs.items()})
+        self.service_prices = MappingProxyType(dict(service_prices))
+
+    def quote(self, cleaning_type: str, room_count_str: str, bathroom_count_str: str) -> int:
+        """Возвращает стоимость уборки без доп. услуг (0, если тип уборки или параметры неизвестны)."""
+        tariff = self.tariffs.get(cleaning_type)
+        room_count, bathroom_count = _parse_count(room_count_str), _parse_count(bathroom_count_str)
+        if not tariff or room_count is None or bathroom_count is None:
+            return 0
+        return _tariff_cost(tariff, room_count, bathroom_count)
+
+    def services_cost(self, selected_services: Mapping[str, int] | None) -> int:
+        """Возвращает стоимость выбранных доп. услуг."""
+        if not selected_services:
+            return 0
+        prices = self.service_prices
+        return sum(prices.get(service_key, 0) * quantity for service_key, quantity in selected_services.items())
 
-    total_cost = base_price + extra_rooms_cost + extra_bathrooms_cost
+    def quote_many(self, orders: Iterable[tuple[str, str, str, Mapping[str, int] | None]]) -> list[int]:
+        """
+        Пакетный расчет итоговой стоимости.
+        Принимает кортежи (тип уборки, комнаты, санузлы, {услуга: количество}).
+        """
+        return [
+            self.quote(cleaning_type, rooms, bathrooms) + self.services_cost(services)
+            for cleaning_type, rooms, bathrooms, services in orders
+        ]
 
-    return total_cost
+    def executor_payment(self, total_price: float) -> float:
+        """Выплата исполнителю по текущей комиссии."""
+        return calculate_executor_payment(total_price, self.commission_type, self.commission_value)
+
+
+# Текущий расчетчик. Заменяется целиком (одним присваиванием) при изменении тарифов
+_engine = PricingEngine(TARIFFS, get_service_catalog().prices())
+
+
+def get_pricing_engine() -> PricingEngine:
+    """Возвращает текущий расчетчик цен."""
+    return _engine
+
+
+def rebuild_pricing_engine(system) -> PricingEngine:
+    """
+    Перестраивает расчетчик из тарифов и комиссии (config.system) и каталога доп. услуг
+    и атомарно подменяет расчетчик.
+    """
+    global _engine
+    _engine = PricingEngine(
+        system.tariffs or TARIFFS, get_service_catalog().prices(), system.commission_type, system.commission_value
+    )
+    return _engine
+
+
+def calculate_preliminary_cost(cleaning_type: str, room_count_str: str, bathroom_count_str: str) -> int:
+    """Рассчитывает предварительную стоимость на основе выбранных опций."""
+    return _engine.quote(cleaning_type, room_count_str, bathroom_count_str)
 
 
 def calculate_total_cost(preliminary_cost: int, selected_services: dict) -> int:
@@ -59,13 +106,7 @@ def calculate_total_cost(preliminary_cost: int, selected_services: dict) -> int:
     Рассчитывает итоговую стоимость, добавляя к предварительной стоимости
     цену выбранных дополнительных услуг.
     """
-    additional_cost = 0
-    if selected_services:
-        for service_key, quantity in selected_services.items():
-            price = ADDITIONAL_SERVICE_PRICES.get(service_key, 0)
-            additional_cost += price * quantity
-
-    return preliminary_cost + additional_cost
+    return preliminary_cost + _engine.services_cost(selected_services)
 
 def calculate_executor_payment(total_price: float, commission_type: str, commission_value: float) -> float:
     """
@@ -0,0 +1,175 @@
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.models import OrderStatus
+from app.services.db_queries import (get_open_orders_chunk, get_order_items_map, get_order_financials_map,
+                                     bulk_update_order_prices)
+from app.services.notifier import get_notifier
+from app.services.price_calculator import get_pricing_engine
+
+# Сколько заказов загружаем и обновляем за один раз
+REPRICE_CHUNK_SIZE = 500
+# Сколько изменений показываем администратору в отчете
+REPORT_PREVIEW_LIMIT = 15
+
+
+@dataclass(frozen=True)
+class PriceChange:
+    """Изменение цены одного открытого заказа."""
+    order_id: int
+    client_tg_id: int
+    executor_tg_id: int | None
+    status: OrderStatus
+    old_price: float
+    new_price: float
+    old_payment: float | None
+    new_payment: float
+    version: int = 0  # Версия финансового снимка, по которой посчитано изменение
+
+
+@dataclass
+class RepricingReport:
+    """Результат пересчета (или пробного пересчета) открытых заказов."""
+    dry_run: bool
+    checked: int = 0
+    changes: list[PriceChange] = field(default_factory=list)
+
+    def summary(self) -> str:
+        """Текст отчета для администратора."""
+        title = "🔎 <b>Пробный пересчет открытых заказов</b>" if self.dry_run else "🔄 <b>Открытые заказы пересчитаны</b>"
+        lines = [title, "", f"Проверено заказов: {self.checked}", f"Изменится цена или выплата: {len(self.changes)}"]
+        if not self.changes:
+            lines.append("\nЦены всех открытых заказов соответствуют текущим тарифам.")
+            return "\n".join(lines)
+
+        delta = sum(change.new_price - change.old_price for change in self.changes)
+        lines.append(f"Суммарное изменение: {delta:+.0f} ₽\n")
+        for change in self.changes[:REPORT_PREVIEW_LIMIT]:
+            line = f"№{change.order_id}: {change.old_price:.0f} ₽ → {change.new_price:.0f} ₽"
+            if change.new_payment != change.old_payment:
+                line += f" (выплата {change.old_payment or 0:.0f} → {change.new_payment:.0f} ₽)"
+            lines.append(line)
+        if len(self.changes) > REPORT_PREVIEW_LIMIT:
+            lines.append(f"... и еще {len(self.changes) - REPORT_PREVIEW_LIMIT}")
+        return "\n".join(lines)
+
+
+def _price_changes(rows: list, items: dict[int, dict[str, int]], financials: dict) -> list[PriceChange]:
+    """
+    Считает новые цены и выплаты для порции заказов одним проходом по текущему PricingEngine
+    и сравнивает их с последними финансовыми снимками заказов. Выплата, заданная администратором вручную,
+    не пересчитывается - меняется только цена для клиента.
+    """
+    engine = get_pricing_engine()
+    new_prices = engine.quote_many(
+        (row.cleaning_type, row.room_count, row.bathroom_count, items.get(row.id)) for row in rows
+    )
+
+    changes = []
+    for row, new_price in zip(rows, new_prices):
+        if not new_price:
+            # Тип уборки не найден в тарифах - такой заказ не трогаем
+            continue
+        snapshot = financials.get(row.id)
+        old_payment = snapshot.executor_payment if snapshot else row.executor_payment
+        if snapshot and snapshot.manual_payment:
+            new_payment = snapshot.executor_payment
+        else:
+            new_payment = engine.executor_payment(new_price)
+        if new_price != row.total_price or new_payment != old_payment:
+            changes.append(PriceChange(
+                order_id=row.id,
+                client_tg_id=row.client_tg_id,
+                executor_tg_id=row.executor_tg_id,
+                status=row.status,
+                old_price=row.total_price or 0,
+                new_price=new_price,
+                old_payment=old_payment,
+                new_payment=new_payment,
+                version=snapshot.version if snapshot else 0
+            ))
+    return changes
+
+
+async def reprice_open_orders(session: AsyncSession, dry_run: bool = True, admin_id: int | None = None,
+                              chunk_size: int = REPRICE_CHUNK_SIZE) -> RepricingReport:
+    """
+    Пересчитывает цены и выплаты открытых заказов ('new', 'accepted') по текущим тарифам и комиссии
+    (текущему PricingEngine). Заказы загружаются порциями по chunk_size, каждая порция записывается
+    одним UPDATE и новой версией финансовых снимков.
+    В режиме dry_run ничего не записывает и только возвращает отчет с изменениями.
+    """
+    report = RepricingReport(dry_run=dry_run)
+    last_id = 0
+    while True:
+        rows = await get_open_orders_chunk(session, last_id, chunk_size)
+        if not rows:
+            break
+        last_id = rows[-1].id
+        report.checked += len(rows)
+
+        order_ids = [row.id for row in rows]
+        items = await get_order_items_map(session, order_ids)
+        financials = await get_order_financials_map(session, order_ids)
+        changes = _price_changes(rows, items, financials)
+
+        if changes and not dry_run:
+            updated_ids = await bulk_update_order_prices(
+                session,
+                [
+                    {
+                        "order_id": change.order_id,
+                        "version": change.version,
+                        "old_price": change.old_price,
+                        "new_price": change.new_price,
+                        "new_payment": change.new_payment if change.executor_tg_id else None,
+                        "payout": change.new_payment
+                    }
+                    for change in changes
+                ],
+                "💱 Цена пересчитана по новым тарифам",
+                admin_id=admin_id
+            )
+            # Заказы, измененные параллельно, пропускаются и в отчет не попадают
+            updated_ids = set(updated_ids)
+            changes = [change for change in changes if change.order_id in updated_ids]
+        report.changes.extend(changes)
+
+    logging.info(f"Пересчет открытых заказов (dry_run={dry_run}): проверено {report.checked}, "
+                 f"изменений {len(report.changes)}")
+    return report
+
+
+def notify_repriced_orders(bots: dict[str, Bot], changes: list[PriceChange]):
+    """
+    Ставит в очередь отправки каждому клиенту и исполнителю одно сводное сообщение по всем его пересчитанным заказам.
+    """
+    notifier = get_notifier()
+    by_client = defaultdict(list)
+    by_executor = defaultdict(list)
+    for change in changes:
+        if change.new_price != change.old_price:
+            by_client[change.client_tg_id].append(change)
+        if change.executor_tg_id and change.new_payment != change.old_payment:
+            by_executor[change.executor_tg_id].append(change)
+
+    for client_id, client_changes in by_client.items():
+        lines = [f"№{change.order_id}: {change.old_price:.0f} ₽ → {change.new_price:.0f} ₽" for change in client_changes]
+        notifier.enqueue(
+            bots["client"], client_id,
+            "ℹ️ Стоимость ваших заказов пересчитана по актуальным тарифам:\n\n" + "\n".join(lines)
+        )
+
+    for executor_id, executor_changes in by_executor.items():
+        lines = [
+            f"№{change.order_id}: {change.old_payment or 0:.0f} ₽ → {change.new_payment:.0f} ₽"
+            for change in executor_changes
+        ]
+        notifier.enqueue(
+            bots["executor"], executor_id,
+            "ℹ️ Выплата по вашим заказам пересчитана:\n\n" + "\n".join(lines)
+        )
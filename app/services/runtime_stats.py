@@ -0,0 +1,42 @@
+import logging
+from typing import Any, Callable
+
+
+class RuntimeStats:
+    """
+    Реестр счетчиков сервисов (кэши, очереди, пулы, лимиты): каждый сервис регистрирует функцию, возвращающую
+    его статистику. Статистика пишется в лог периодической задачей и при остановке, так что ее видно
+    во время работы бота и она не теряется при аварийном завершении.
+    """
+
+    def __init__(self):
+        self._sources: dict[str, Callable[[], Any]] = {}
+
+    def register(self, title: str, source: Callable[[], Any]):
+        """Добавляет источник статистики; title - подпись в логе."""
+        self._sources[title] = source
+
+    def collect(self) -> dict[str, Any]:
+        stats = {}
+        for title, source in self._sources.items():
+            try:
+                stats[title] = source()
+            except Exception as e:
+                stats[title] = f"ошибка: {e}"
+        return stats
+
+    async def log(self):
+        """
+        Пишет в лог текущую статистику всех сервисов.
+        Корутина, чтобы планировщик выполнял ее в цикле событий, а не в потоке, параллельно с изменением счетчиков.
+        """
+        for title, stats in self.collect().items():
+            logging.info(f"{title}: {stats}")
+
+
+_runtime_stats = RuntimeStats()
+
+
+def get_runtime_stats() -> RuntimeStats:
+    """Возвращает общий реестр статистики сервисов."""
+    return _runtime_stats
@@ -0,0 +1,131 @@
+import json
+import re
+from dataclasses import dataclass, asdict, replace
+from types import MappingProxyType
+from typing import Iterator
+
+
+@dataclass(frozen=True)
+class ServiceItem:
+    """Дополнительная услуга из каталога."""
+    key: str
+    title: str
+    unit_price: int
+    per_unit: bool  # Услуга заказывается поштучно (окна, стулья)
+    sort_order: int
+
+    @property
+    def display_name(self) -> str:
+        """Название с ценой, например "🪞 Мойка окон (+300 ₽/шт)"."""
+        unit = "/шт" if self.per_unit else ""
+        return f"{self.title} (+{self.unit_price} ₽{unit})"
+
+
+DEFAULT_SERVICES = (
+    ServiceItem("win", "🪞 Мойка окон", 300, True, 10),
+    ServiceItem("sofa", "🛋 Химчистка дивана", 1500, False, 20),
+    ServiceItem("chair", "🪑 Химчистка стульев", 300, True, 30),
+    ServiceItem("plumbing", "🚿 Чистка сантехники", 500, False, 40),
+    ServiceItem("bedding", "🛏 Замена постельного белья", 200, False, 50),
+    ServiceItem("kitchen", "🧴 Мытье кухонной техники", 600, False, 60),
+    ServiceItem("cabinets", "🧼 Чистка шкафчиков внутри", 500, False, 70),
+    ServiceItem("balcony", "🧯 Уборка балкона", 700, False, 80),
+    ServiceItem("carpet", "🧹 Чистка ковров", 800, False, 90),
+    ServiceItem("pets", "🐾 Удаление шерсти животных", 400, False, 100),
+    ServiceItem("fridge", "❄ Мойка холодильника", 700, False, 110),
+    ServiceItem("stove", "🍳 Мойка плиты", 500, False, 120),
+    ServiceItem("oven", "🔥 Мойка духовки", 700, False, 130),
+)
+
+# Формат, в котором услуги хранились раньше: {"win": "🪞 Мойка окон (+300 ₽/шт)", ...}
+_LEGACY_SERVICE_PATTERN = re.compile(r'^(?P<title>.*?)\s*\(\s*\+\s*(?P<price>\d+)\s*₽?\s*(?P<unit>/\s*шт)?\s*\)\s*$')
+
+
+class ServiceCatalog:
+    """Неизменяемый каталог доп. услуг. При изменении цены создается новый каталог."""
+    __slots__ = ("items", "by_key")
+
+    def __init__(self, items):
+        self.items: tuple[ServiceItem, ...] = tuple(sorted(items, key=lambda item: (item.sort_order, item.key)))
+        self.by_key = MappingProxyType({item.key: item for item in self.items})
+
+    def __iter__(self) -> Iterator[ServiceItem]:
+        return iter(self.items)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.by_key
+
+    def get(self, key: str) -> ServiceItem | None:
+        return self.by_key.get(key)
+
+    def title(self, key: str) -> str:
+        item = self.by_key.get(key)
+        return item.title if item else key
+
+    def display_name(self, key: str) -> str:
+        item = self.by_key.get(key)
+        return item.display_name if item else "Неизвестная услуга"
+
+    def format_item(self, key: str, quantity: int) -> str:
+        """Строка для списка услуг в заказе: для поштучных услуг добавляется количество."""
+        item = self.by_key.get(key)
+        if item and item.per_unit and quantity > 1:
+            return f"{item.display_name} (x{quantity})"
+        return self.display_name(key)
+
+    def prices(self) -> dict[str, int]:
+        return {item.key: item.unit_price for item in self.items}
+
+    def with_price(self, key: str, unit_price: int) -> "ServiceCatalog":
+        """Возвращает новый каталог с измененной ценой услуги."""
+        return ServiceCatalog(
+            replace(item, unit_price=unit_price) if item.key == key else item for item in self.items
+        )
+
+    def to_json(self) -> str:
+        return json.dumps([asdict(item) for item in self.items], ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str | list | dict | None) -> "ServiceCatalog | None":
+        """
+        Загружает каталог из JSON, сохраненного в system_settings.additional_services.
+        Понимает и прежний формат со строками "Название (+цена ₽/шт)". Возвращает None, если данных нет.
+        """
+        data = json.loads(raw) if isinstance(raw, str) else raw
+        if not data:
+            return None
+
+        if isinstance(data, list):
+            return cls(ServiceItem(**item) for item in data)
+
+        defaults = {item.key: item for item in DEFAULT_SERVICES}
+        items = []
+        for sort_index, (key, text) in enumerate(data.items()):
+            match = _LEGACY_SERVICE_PATTERN.match(text)
+            default = defaults.get(key)
+            if match:
+                items.append(ServiceItem(
+                    key=key,
+                    title=match.group("title"),
+                    unit_price=int(match.group("price")),
+                    per_unit=bool(match.group("unit")),
+                    sort_order=(sort_index + 1) * 10
+                ))
+            elif default:
+                items.append(default)
+        return cls(items)
+
+
+# Текущий каталог. Заменяется целиком (одним присваиванием) при изменении цен
+_catalog = ServiceCatalog(DEFAULT_SERVICES)
+
+
+def get_service_catalog() -> ServiceCatalog:
+    """Возвращает текущий каталог доп. услуг."""
+    return _catalog
+
+
+def set_service_catalog(catalog: ServiceCatalog):
+    """Подменяет текущий каталог доп. услуг."""
+    global _catalog
+    _catalog = catalog
@@ -0,0 +1,38 @@
+import json
+
+from app.config import Settings, System
+from app.services.price_calculator import TARIFFS, rebuild_pricing_engine
+from app.services.service_catalog import DEFAULT_SERVICES, ServiceCatalog, set_service_catalog
+
+
+def parse_tariffs(raw) -> dict:
+    """Тарифы из JSON-строки настроек (пустой словарь, если их нет или строка повреждена)."""
+    try:
+        return json.loads(raw) if isinstance(raw, str) else raw or {}
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
+
+def parse_service_catalog(raw) -> ServiceCatalog | None:
+    """Каталог доп. услуг из настроек (None, если его нет или он поврежден)."""
+    try:
+        return ServiceCatalog.from_json(raw)
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return None
+
+
+def apply_system_settings(config: Settings, system_settings) -> None:
+    """
+    Применяет системные настройки из БД к этой копии бота: config.system, каталог доп. услуг и расчетчик цен.
+    Вызывается при старте и периодически при нескольких копиях бота, чтобы изменения тарифов и комиссии,
+    сделанные администратором через другую копию, дошли и до этой.
+    """
+    set_service_catalog(parse_service_catalog(system_settings.additional_services) or ServiceCatalog(DEFAULT_SERVICES))
+    config.system = System(
+        commission_type=system_settings.commission_type,
+        commission_value=system_settings.commission_value,
+        test_mode_enabled=system_settings.test_mode_enabled,
+        show_commission_to_executor=system_settings.show_commission_to_executor,
+        tariffs=parse_tariffs(system_settings.tariffs) or TARIFFS
+    )
+    rebuild_pricing_engine(config.system)
@@ -0,0 +1,73 @@
+import time
+from collections import Counter
+
+# Классы обработчиков: обычные и дорогие (тяжелые запросы к БД, отчеты)
+ROUTE_DEFAULT = "default"
+ROUTE_EXPENSIVE = "expensive"
+# Как часто удалять из памяти полные (давно не использованные) корзины
+CLEANUP_EVERY = 1000
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated_at", "warned")
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.warned = False  # Пользователю уже сказали, что он уперся в лимит
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов алгоритмом token bucket: своя корзина на каждую пару (пользователь, класс обработчика).
+    budgets - {класс: (пополнение токенов в секунду, размер корзины)}.
+    """
+
+    def __init__(self, budgets: dict[str, tuple[float, float]]):
+        self.budgets = budgets
+        self._buckets: dict[tuple[int, str], _Bucket] = {}
+        self._calls = 0
+        self.allowed = Counter()
+        self.throttled = Counter()
+
+    def hit(self, user_id: int, route_class: str) -> tuple[bool, bool]:
+        """
+        Списывает токен. Возвращает (разрешено ли, нужно ли предупредить пользователя):
+        предупреждение - только при первом отказе подряд, чтобы не отвечать на каждое нажатие.
+        """
+        rate, burst = self.budgets.get(route_class) or self.budgets[ROUTE_DEFAULT]
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % CLEANUP_EVERY == 0:
+            self._cleanup(now)
+
+        key = (user_id, route_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated_at) * rate)
+            bucket.updated_at = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.warned = False
+            self.allowed[route_class] += 1
+            return True, False
+
+        self.throttled[route_class] += 1
+        warn = not bucket.warned
+        bucket.warned = True
+        return False, warn
+
+    def _cleanup(self, now: float):
+        for key, bucket in list(self._buckets.items()):
+            rate, burst = self.budgets.get(key[1]) or self.budgets[ROUTE_DEFAULT]
+            if bucket.tokens + (now - bucket.updated_at) * rate >= burst:
+                del self._buckets[key]
+
+    def stats(self) -> dict:
+        return {
+            route_class: {"allowed": self.allowed[route_class], "throttled": self.throttled[route_class]}
+            for route_class in set(self.allowed) | set(self.throttled)
+        }
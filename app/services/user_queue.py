@@ -0,0 +1,94 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+
+# Сколько апдейтов разных пользователей обрабатывается одновременно по умолчанию
+DEFAULT_UPDATE_WORKERS = 32
+
+
+class UserQueueIsolation(BaseEventIsolation):
+    """
+    Изоляция апдейтов для встроенной FSM-мидлвари aiogram: апдейты одного пользователя (ключ FSM)
+    выполняются строго по очереди в порядке поступления, апдейты разных пользователей - параллельно,
+    но не больше workers одновременно. Состояние FSM читается уже после того, как подошла очередь апдейта,
+    поэтому двойное нажатие видит результат первого.
+    """
+
+    def __init__(self, workers: int = DEFAULT_UPDATE_WORKERS):
+        self.workers = workers
+        self._semaphore = asyncio.Semaphore(workers)
+        self._locks: dict[StorageKey, asyncio.Lock] = {}
+        self._depth: dict[StorageKey, int] = {}  # Апдейты пользователя в очереди, включая выполняемый
+        self._total = 0  # Сумма _depth: все принятые и еще не обработанные апдейты
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Метрики
+        self.in_flight = 0
+        self.processed = 0
+        self.max_depth = 0
+        self.max_queued = 0
+        self.wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey):
+        depth = self._depth.get(key, 0) + 1
+        self._depth[key] = depth
+        self._total += 1
+        self._idle.clear()
+        self.max_depth = max(self.max_depth, depth)
+        self.max_queued = max(self.max_queued, self.queued)
+        user_lock = self._locks.setdefault(key, asyncio.Lock())
+        queued_at = time.monotonic()
+        try:
+            async with user_lock:
+                async with self._semaphore:
+                    self.wait_seconds += time.monotonic() - queued_at
+                    self.in_flight += 1
+                    try:
+                        yield
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+        finally:
+            self._total -= 1
+            depth = self._depth[key] - 1
+            if depth:
+                self._depth[key] = depth
+            else:
+                del self._depth[key]
+                del self._locks[key]
+                if not self._total:
+                    self._idle.set()
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Ждет, пока обработаются все принятые апдейты (выполняемые и ожидающие очереди), не дольше timeout секунд.
+        Возвращает, сколько апдейтов не успело обработаться.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._total
+
+    @property
+    def queued(self) -> int:
+        """Сколько апдейтов ждут своей очереди (своего пользователя или свободного обработчика)."""
+        return self._total - self.in_flight
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "users_waiting": sum(1 for depth in self._depth.values() if depth > 1),
+            "max_user_queue_depth": self.max_depth,
+            "max_queued": self.max_queued,
+            "processed": self.processed,
+            "avg_wait_ms": round(self.wait_seconds / self.processed * 1000, 1) if self.processed else 0.0
+        }
+
+    async def close(self) -> None:
+        pass
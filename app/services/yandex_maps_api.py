@@ -1,59 +1,162 @@
-import httpx
+import datetime
+import re
+import time
+from collections import OrderedDict
 
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession
 
-async def get_address_from_coords(latitude: float, longitude: float, api_key: str) -> str | None:
-    """
-    Получает текстовый адрес по координатам через API Яндекс.Геокодер.
-    """
-    url = "https://geocode-maps.yandex.ru/1.x/"
-    params = {
-        "geocode": f"{longitude},{latitude}",
-        "apikey": api_key,
-        "format": "json",
-        "results": 1
-    }
+from app.services.db_queries import get_geocode_cache, save_geocode_cache
+from app.services.geocoder import GeocoderUnavailable, configure_geocoder, get_geocoder
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()  # Проверка на ошибки HTTP (4xx, 5xx)
+GEOCODER_URL = "https://geocode-maps.yandex.ru/1.x/"
+# Общий дедлайн на запрос к геокодеру, после которого пользователю предлагается ручной ввод
+GEOCODER_DEADLINE = 4.0
+# Сколько живет ответ геокодера в кэше
+GEOCODE_CACHE_TTL = datetime.timedelta(days=30)
+# Сколько ответов держим в памяти процесса
+GEOCODE_MEMORY_CACHE_SIZE = 1000
+# Точность округления координат: 4 знака после запятой - это примерно 10 метров
+COORDS_PRECISION = 4
 
-            data = response.json()
+# In-memory LRU: ключ -> (адрес, момент истечения по time.monotonic())
+_memory_cache: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
 
-            # Парсим ответ, чтобы достать адрес
-            address = data["response"]["GeoObjectCollection"]["featureMember"][0]["GeoObject"]["metaDataProperty"][
-                "GeocoderMetaData"]["text"]
-            return address
 
-    except (httpx.RequestError, KeyError, IndexError) as e:
-        print(f"Ошибка при запросе к Яндекс.API: {e}")
-        return None
+class YandexGeocoderBackend:
+    """Поставщик геокодирования на основе API Яндекс.Геокодер (или совместимого с ним сервера-заглушки)."""
 
+    def __init__(self, api_key: str, url: str = GEOCODER_URL):
+        self.api_key = api_key
+        self.url = url
+        # Общий клиент с пулом соединений: HTTP/2, keep-alive, явные таймауты
+        self.client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(5.0, connect=3.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+        )
 
-async def get_address_from_text(address_text: str, api_key: str) -> str | None:
-    """
-    Проверяет текстовый адрес и возвращает его стандартизированную версию.
-    """
-    url = "https://geocode-maps.yandex.ru/1.x/"
-    params = {
-        "geocode": address_text,
-        "apikey": api_key,
-        "format": "json",
-        "results": 1
-    }
+    async def geocode(self, query: str) -> str | None:
+        params = {
+            "geocode": query,
+            "apikey": self.api_key,
+            "format": "json",
+            "results": 1
+        }
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
+        try:
+            response = await self.client.get(self.url, params=params)
+            response.raise_for_status()  # Проверка на ошибки HTTP (4xx, 5xx)
             data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise GeocoderUnavailable(f"Ошибка при запросе к Яндекс.API: {e}") from e
+
+        try:
             # Находим первый результат
             feature_member = data["response"]["GeoObjectCollection"]["featureMember"]
             if not feature_member:
                 return None  # Адрес не найден
-            address = feature_member[0]["GeoObject"]["metaDataProperty"]["GeocoderMetaData"]["text"]
+            return feature_member[0]["GeoObject"]["metaDataProperty"]["GeocoderMetaData"]["text"]
+        except (KeyError, IndexError, TypeError) as e:
+            print(f"Неожиданный ответ Яндекс.API: {e}")
+            return None
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def close_geocoder_client():
+    """Закрывает HTTP-клиент геокодера."""
+    gateway = get_geocoder()
+    if gateway:
+        await gateway.close()
+
+
+def _text_cache_key(address_text: str) -> str:
+    """Нормализует адрес: регистр, ё/е, лишние пробелы и знаки препинания не влияют на ключ."""
+    normalized = address_text.lower().replace("ё", "е")
+    normalized = re.sub(r"[^\w\s]", " ", normalized)
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return f"text:{normalized}"
+
+
+def _coords_cache_key(latitude: float, longitude: float) -> str:
+    return f"coords:{round(latitude, COORDS_PRECISION)},{round(longitude, COORDS_PRECISION)}"
+
+
+def _memory_cache_get(key: str) -> str | None:
+    cached = _memory_cache.get(key)
+    if not cached:
+        return None
+    address, expires_at = cached
+    if expires_at < time.monotonic():
+        del _memory_cache[key]
+        return None
+    _memory_cache.move_to_end(key)
+    return address
+
+
+def _memory_cache_set(key: str, address: str):
+    _memory_cache[key] = (address, time.monotonic() + GEOCODE_CACHE_TTL.total_seconds())
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > GEOCODE_MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+async def _geocode(geocode: str, cache_key: str, api_key: str, session: AsyncSession | None) -> str | None:
+    """
+    Возвращает адрес из кэша (память, затем БД) или запрашивает его через шлюз геокодера.
+    Если геокодер недоступен, выбрасывает GeocoderUnavailable.
+    """
+    address = _memory_cache_get(cache_key)
+    if address:
+        return address
+
+    if session is not None:
+        address = await get_geocode_cache(session, cache_key, GEOCODE_CACHE_TTL)
+        if address:
+            _memory_cache_set(cache_key, address)
             return address
 
-    except (httpx.RequestError, KeyError, IndexError) as e:
-        print(f"Ошибка при запросе к Яндекс.API: {e}")
-        return None
\ No newline at end of file
+    gateway = get_geocoder()
+    if gateway is None:
+        # Шлюз не настроен при запуске - используем Яндекс.Геокодер по умолчанию
+        gateway = configure_geocoder(YandexGeocoderBackend(api_key), GEOCODER_DEADLINE)
+
+    try:
+        address = await gateway.lookup(cache_key, geocode)
+    except GeocoderUnavailable as e:
+        print(f"Геокодер недоступен: {e}")
+        raise
+    if not address:
+        return None
+
+    _memory_cache_set(cache_key, address)
+    if session is not None:
+        try:
+            await save_geocode_cache(session, cache_key, address, GEOCODE_CACHE_TTL)
+        except Exception as e:
+            print(f"Не удалось сохранить адрес в кэш геокодера: {e}")
+            await session.rollback()
+    return address
+
+
+async def get_address_from_coords(latitude: float, longitude: float, api_key: str,
+                                  session: AsyncSession | None = None) -> str | None:
+    """
+    Получает текстовый адрес по координатам через API Яндекс.Геокодер.
+    Если передана сессия БД, ответ дополнительно кэшируется в таблице geocode_cache.
+    При недоступности геокодера выбрасывает GeocoderUnavailable.
+    """
+    return await _geocode(
+        f"{longitude},{latitude}", _coords_cache_key(latitude, longitude), api_key, session
+    )
+
+
+async def get_address_from_text(address_text: str, api_key: str, session: AsyncSession | None = None) -> str | None:
+    """
+    Проверяет текстовый адрес и возвращает его стандартизированную версию.
+    Если передана сессия БД, ответ дополнительно кэшируется в таблице geocode_cache.
+    При недоступности геокодера выбрасывает GeocoderUnavailable.
+    """
+    return await _geocode(address_text, _text_cache_key(address_text), api_key, session)
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import secrets
+import socket
+
+import uvicorn
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import FastAPI, Request, Response
+
+from app.config import Webhook
+
+# Сколько секунд ждем освобождения слота обработки, прежде чем попросить Telegram повторить доставку
+ACQUIRE_TIMEOUT = 5
+
+
+def create_webhook_app(dispatchers: dict[str, tuple[Dispatcher, Bot]], settings: Webhook) -> FastAPI:
+    """
+    Создает ASGI-приложение, которое принимает вебхуки всех ботов
+    и направляет их в соответствующий Dispatcher по адресу /webhook/{client|executor|admin}.
+    """
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    # Ограничиваем число одновременно обрабатываемых апдейтов
+    semaphore = asyncio.Semaphore(settings.max_in_flight)
+    background_tasks = set()
+    app.state.background_tasks = background_tasks
+
+    async def process_update(dp: Dispatcher, bot: Bot, update: Update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            semaphore.release()
+
+    @app.post("/webhook/{bot_name}")
+    async def telegram_webhook(bot_name: str, request: Request):
+        target = dispatchers.get(bot_name)
+        if not target:
+            return Response(status_code=404)
+
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, settings.secret_token):
+            return Response(status_code=401)
+
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Telegram повторит доставку апдейта позже
+            logging.warning(f"Превышен лимит одновременной обработки апдейтов ({settings.max_in_flight})")
+            return Response(status_code=503)
+
+        dp, bot = target
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception:
+            semaphore.release()
+            return Response(status_code=400)
+
+        # Отвечаем Telegram сразу, а сам апдейт обрабатываем в фоне
+        task = asyncio.create_task(process_update(dp, bot, update))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        return Response(status_code=200)
+
+    return app
+
+
+async def run_webhook(dispatchers: dict[str, tuple[Dispatcher, Bot]], settings: Webhook, reuse_port: bool = False,
+                      stop_event: asyncio.Event | None = None, drain_timeout: float = 25):
+    """
+    Регистрирует вебхуки всех ботов в Telegram и запускает HTTP-сервер.
+    С reuse_port несколько процессов на одной машине слушают один порт, и ядро распределяет соединения между ними.
+    Сервер останавливается по сигналу или по stop_event, после чего ждет уже принятые апдейты не дольше drain_timeout.
+    """
+    for bot_name, (dp, bot) in dispatchers.items():
+        await bot.set_webhook(
+            url=f"{settings.base_url.rstrip('/')}/webhook/{bot_name}",
+            secret_token=settings.secret_token,
+            max_connections=settings.max_in_flight,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logging.info(f"Вебхук для бота '{bot_name}' установлен")
+
+    app = create_webhook_app(dispatchers, settings)
+    server = uvicorn.Server(uvicorn.Config(app, host=settings.host, port=settings.port, log_level="warning"))
+    sockets = None
+    if reuse_port:
+        sock = socket.socket(socket.AF_INET6 if ":" in settings.host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((settings.host, settings.port))
+        sockets = [sock]
+    async def stop_server():
+        await stop_event.wait()
+        server.should_exit = True
+
+    stop_watcher = asyncio.create_task(stop_server()) if stop_event else None
+    try:
+        await server.serve(sockets=sockets)
+    finally:
+        if stop_watcher:
+            stop_watcher.cancel()
+        # Дожидаемся апдейтов, которые уже приняты в обработку
+        if app.state.background_tasks:
+            _, pending = await asyncio.wait(set(app.state.background_tasks), timeout=drain_timeout)
+            if pending:
+                logging.warning(f"Не дождались обработки апдейтов: {len(pending)}")
@@ -0,0 +1,73 @@
+"""
+Пакетное назначение накопившихся заказов: время построения плана для 2000 заказов и 500 исполнителей
+и распределение заказов между исполнителями.
+
+Запуск из корня проекта: python -m benchmarks.assignment_benchmark
+"""
+import datetime
+import random
+import timeit
+from collections import Counter
+
+from app.services.batch_assignment import BatchOrder, BatchExecutor, plan_batch_assignment
+
+ORDERS_COUNT = 2000
+EXECUTORS_COUNT = 500
+DAYS = 7
+TIME_SLOTS = ["9:00 - 12:00", "12:00 - 15:00", "15:00 - 18:00", "18:00 - 21:00"]
+CITY_LAT, CITY_LON = 57.15, 65.53
+REPEATS = 3
+
+
+def make_instance():
+    random.seed(42)
+    today = datetime.date.today()
+    dates = [(today + datetime.timedelta(days=offset)).isoformat() for offset in range(1, DAYS + 1)]
+    orders = [
+        BatchOrder(
+            order_id=order_id,
+            scheduled_date=random.choice(dates),
+            slot=random.choice(TIME_SLOTS),
+            lat=CITY_LAT + random.uniform(-0.15, 0.15),
+            lon=CITY_LON + random.uniform(-0.25, 0.25)
+        )
+        for order_id in range(1, ORDERS_COUNT + 1)
+    ]
+    executors = []
+    for executor_id in range(1, EXECUTORS_COUNT + 1):
+        has_schedule = random.random() < 0.7
+        executors.append(BatchExecutor(
+            telegram_id=executor_id,
+            priority=random.randint(0, 10),
+            rating=random.uniform(3.5, 5.0),
+            base_lat=CITY_LAT + random.uniform(-0.15, 0.15) if random.random() < 0.8 else None,
+            base_lon=CITY_LON + random.uniform(-0.25, 0.25),
+            radius_km=random.choice([5, 10, 15, 25]),
+            schedule={
+                weekday: frozenset(random.sample(TIME_SLOTS, random.randint(1, 4))) for weekday in range(7)
+            } if has_schedule else None,
+            load=random.randint(0, 5)
+        ))
+    return orders, executors
+
+
+def main():
+    orders, executors = make_instance()
+
+    plan = plan_batch_assignment(orders, executors)
+    assigned_orders = [order_id for order_id, _ in plan]
+    slots = {order.order_id: (order.scheduled_date, order.slot) for order in orders}
+    assert len(set(assigned_orders)) == len(assigned_orders)
+    assert len({(executor_id, slots[order_id]) for order_id, executor_id in plan}) == len(plan)
+
+    elapsed = min(timeit.repeat(lambda: plan_batch_assignment(orders, executors), number=1, repeat=REPEATS))
+    per_executor = Counter(executor_id for _, executor_id in plan)
+
+    print(f"Заказов: {ORDERS_COUNT}, исполнителей: {EXECUTORS_COUNT}")
+    print(f"Построение плана: {elapsed * 1000:.0f} мс")
+    print(f"Назначено заказов: {len(plan)}, задействовано исполнителей: {len(per_executor)}")
+    print(f"Максимум заказов на исполнителя: {max(per_executor.values())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import asyncio
+import os
+
+import pytest
+
+
+class FakeClock:
+    """Часы для подмены time.monotonic: время идет только при изменении now."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """Возвращает функцию install(module), которая подменяет time.monotonic в модуле и отдает FakeClock."""
+
+    def install(module) -> FakeClock:
+        clock = FakeClock()
+        monkeypatch.setattr(module.time, "monotonic", clock)
+        return clock
+
+    return install
+
+
+@pytest.fixture
+def run_db():
+    """
+    Запускает сценарий scenario(session_pool) на чистой схеме Postgres из TEST_DATABASE_URL.
+    Без TEST_DATABASE_URL (или без драйвера) тест пропускается: блокировки строк и advisory-блокировки есть только в Postgres.
+    """
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    pytest.importorskip("asyncpg")
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.database.models import Base, SCHEMA_UPGRADES
+
+    def run(scenario, **engine_kwargs):
+        async def main():
+            engine = create_async_engine(url, echo=False, **engine_kwargs)
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.drop_all)
+                    await conn.run_sync(Base.metadata.create_all)
+                    for statement in SCHEMA_UPGRADES:
+                        await conn.execute(text(statement))
+                session_pool = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+                return await scenario(session_pool)
+            finally:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.drop_all)
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
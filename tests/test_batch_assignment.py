@@ -0,0 +1,101 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from app.services.batch_assignment import BatchExecutor, BatchOrder, plan_batch_assignment, solve_assignment
+
+# Центр Тюмени
+CENTER = (57.153, 65.534)
+
+
+def _brute_force_cost(cost: np.ndarray) -> float:
+    """Минимальная стоимость полным перебором (назначается min(строк, столбцов) пар)."""
+    n_rows, n_cols = cost.shape
+    if n_rows <= n_cols:
+        return min(sum(cost[row, col] for row, col in enumerate(cols))
+                   for cols in itertools.permutations(range(n_cols), n_rows))
+    return min(sum(cost[row, col] for col, row in enumerate(rows))
+               for rows in itertools.permutations(range(n_rows), n_cols))
+
+
+def _check_assignment(cost: np.ndarray, assignment: np.ndarray) -> float:
+    n_rows, n_cols = cost.shape
+    assigned = [(row, col) for row, col in enumerate(assignment) if col >= 0]
+    assert len(assigned) == min(n_rows, n_cols)
+    assert len({col for _, col in assigned}) == len(assigned)
+    return sum(cost[row, col] for row, col in assigned)
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (2, 5), (3, 6), (5, 2), (6, 3)])
+def test_solver_matches_brute_force(shape):
+    rng = np.random.default_rng(sum(shape))
+    for _ in range(20):
+        cost = rng.uniform(-1, 1, size=shape)
+        assignment = solve_assignment(cost)
+        assert _check_assignment(cost, assignment) == pytest.approx(_brute_force_cost(cost))
+
+
+def test_solver_handles_ties_and_integer_costs():
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        cost = rng.integers(0, 3, size=(5, 5)).astype(float)
+        assert _check_assignment(cost, solve_assignment(cost)) == _brute_force_cost(cost)
+
+
+def test_solver_empty_matrix():
+    assert solve_assignment(np.zeros((0, 3))).tolist() == []
+    assert solve_assignment(np.zeros((2, 0))).tolist() == [-1, -1]
+
+
+def _order(order_id: int, slot: str = "10:00-12:00", lat: float | None = CENTER[0], lon: float | None = CENTER[1],
+           excluded: frozenset[int] = frozenset()) -> BatchOrder:
+    return BatchOrder(order_id, "2025-06-02", slot, lat, lon, excluded)
+
+
+def _executor(telegram_id: int, lat_offset: float = 0.0, radius_km: float | None = 10, load: int = 0,
+              schedule: dict[int, frozenset[str]] | None = None) -> BatchExecutor:
+    return BatchExecutor(telegram_id, priority=0, rating=5.0, base_lat=CENTER[0] + lat_offset, base_lon=CENTER[1],
+                         radius_km=radius_km, schedule=schedule, load=load)
+
+
+def test_plan_assigns_each_executor_once_per_slot():
+    orders = [_order(1), _order(2), _order(3)]
+    executors = [_executor(100), _executor(200)]
+    plan = plan_batch_assignment(orders, executors)
+    assert len(plan) == 2
+    assert len({executor for _, executor in plan}) == 2
+    assert len({order for order, _ in plan}) == 2
+
+
+def test_plan_reuses_executor_in_different_slots():
+    orders = [_order(1, "10:00-12:00"), _order(2, "14:00-16:00")]
+    plan = plan_batch_assignment(orders, [_executor(100)])
+    assert sorted(plan) == [(1, 100), (2, 100)]
+
+
+def test_plan_maximizes_number_of_assignments():
+    # Жадный выбор отдал бы ближайшему исполнителю заказ 1, и заказ 2 остался бы без исполнителя
+    orders = [_order(1), _order(2, lat=CENTER[0] + 0.1)]
+    executors = [_executor(100, lat_offset=0.05), _executor(200, lat_offset=-0.05, radius_km=8)]
+    assert sorted(plan_batch_assignment(orders, executors)) == [(1, 200), (2, 100)]
+
+
+def test_plan_respects_forbidden_pairs():
+    orders = [_order(1, excluded=frozenset({100})), _order(2, lat=CENTER[0] + 1)]
+    schedule = {0: frozenset({"14:00-16:00"})}  # 2025-06-02 - понедельник
+    executors = [_executor(100), _executor(200, schedule=schedule), _executor(300)]
+
+    plan = plan_batch_assignment(orders, executors, is_busy=lambda executor, date, slot: executor == 300)
+
+    # 100 уже отказывался, у 200 нет этого слота, 300 занят; заказ 2 вне радиуса всех исполнителей
+    assert plan == []
+
+
+def test_plan_prefers_less_loaded_executor():
+    executors = [_executor(100, load=5), _executor(200, load=0)]
+    assert plan_batch_assignment([_order(1)], executors) == [(1, 200)]
+
+
+def test_plan_keeps_orders_without_coordinates():
+    assert plan_batch_assignment([_order(1, lat=None, lon=None)], [_executor(100)]) == [(1, 100)]
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiogram")
+
+from sqlalchemy import func, select
+
+from app.database.models import Order, OrderFinancialSnapshot
+from app.services.db_queries import (add_order_financial_snapshot, backfill_order_financial_snapshots, create_order,
+                                     create_user, get_order_financial_snapshot, get_order_financials)
+
+CLIENT_ID = 1001
+
+
+async def _new_order(session_pool, total_cost: float = 3000) -> int:
+    async with session_pool() as session:
+        await create_user(session, CLIENT_ID, "Клиент", None)
+        order = await create_order(session, {"cleaning_type": "🧼 Генеральная", "total_cost": total_cost}, CLIENT_ID)
+        return order.id
+
+
+async def _versions(session_pool, order_id: int) -> list[int]:
+    async with session_pool() as session:
+        result = await session.execute(
+            select(OrderFinancialSnapshot.version)
+            .where(OrderFinancialSnapshot.order_id == order_id)
+            .order_by(OrderFinancialSnapshot.version)
+        )
+        return list(result.scalars())
+
+
+async def _add_version(session_pool, order_id: int, reason: str, **kwargs) -> OrderFinancialSnapshot:
+    async with session_pool() as session:
+        order = await session.get(Order, order_id)
+        snapshot = await add_order_financial_snapshot(session, order, reason, **kwargs)
+        await session.commit()
+        return snapshot
+
+
+def test_versions_increase_by_one(run_db):
+    async def scenario(session_pool):
+        order_id = await _new_order(session_pool)
+        for reason in ("Изменение доп. услуг", "Изменение комнат и санузлов"):
+            await _add_version(session_pool, order_id, reason)
+        return await _versions(session_pool, order_id)
+
+    assert run_db(scenario) == [1, 2, 3]
+
+
+def test_concurrent_changes_get_distinct_versions(run_db):
+    async def scenario(session_pool):
+        order_id = await _new_order(session_pool)
+        await asyncio.gather(*(_add_version(session_pool, order_id, f"Изменение {i}") for i in range(5)))
+        return await _versions(session_pool, order_id)
+
+    assert run_db(scenario, pool_size=6) == [1, 2, 3, 4, 5, 6]
+
+
+def test_bonus_accumulates_and_manual_payment_is_carried(run_db):
+    async def scenario(session_pool):
+        order_id = await _new_order(session_pool)
+        await _add_version(session_pool, order_id, "Выплата изменена", executor_payment=2000, manual_payment=True)
+        await _add_version(session_pool, order_id, "Бонус", executor_payment=2000, bonus=300)
+        await _add_version(session_pool, order_id, "Бонус", executor_payment=2000, bonus=200)
+        async with session_pool() as session:
+            return await get_order_financials(session, order_id)
+
+    latest = run_db(scenario)
+    assert latest.version == 4
+    assert latest.bonus == 500
+    assert latest.manual_payment
+    assert latest.executor_payment == 2000
+
+
+def test_read_does_not_write_and_backfill_is_idempotent(run_db):
+    async def scenario(session_pool):
+        async with session_pool() as session:
+            await create_user(session, CLIENT_ID, "Клиент", None)
+            order = Order(client_tg_id=CLIENT_ID, total_price=3000)
+            session.add(order)
+            await session.commit()
+            transient = await get_order_financial_snapshot(session, order)
+            count_before = await session.scalar(select(func.count(OrderFinancialSnapshot.id)))
+        async with session_pool() as session:
+            written = await backfill_order_financial_snapshots(session)
+        async with session_pool() as session:
+            written_again = await backfill_order_financial_snapshots(session)
+        return transient.version, count_before, written, written_again, await _versions(session_pool, order.id)
+
+    assert run_db(scenario) == (0, 0, 1, 0, [1])
@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("aiogram")
+pytest.importorskip("sqlalchemy")
+
+from app.services.fsm_storage import (DEFAULT_STATE_TTL, compact_fsm_data, decode_fsm_data, encode_fsm_data,
+                                      fsm_data_size, state_ttl)
+
+
+def test_encoding_is_compact_and_round_trips():
+    data = {"address_text": "Тюмень", "selected_services": {"win": 2}}
+    raw = encode_fsm_data(data)
+    assert raw == '{"address_text":"Тюмень","selected_services":{"win":2}}'
+    assert decode_fsm_data(raw) == data
+    assert decode_fsm_data(None) == {}
+    assert fsm_data_size(data) == len(raw.encode())
+
+
+def test_unchanged_data_is_returned_as_is():
+    data = {"selected_services": {"win": 2}, "address_text": "Тюмень"}
+    assert compact_fsm_data("OrderStates:choosing_services", data) is data
+
+
+def test_finished_scenario_drops_transient_keys():
+    data = {"selected_services": {"win": 2}, "payment_message_id": 5, "photo_ids": ["a"], "order_name": "Анна"}
+    assert compact_fsm_data(None, data) == {"order_name": "Анна"}
+
+
+def test_over_budget_drops_largest_transient_keys_first():
+    data = {"photo_ids": ["x" * 50] * 20, "executors_list": [1, 2, 3], "address_text": "Тюмень"}
+    budget = fsm_data_size(data) - 100
+
+    compacted = compact_fsm_data("OrderStates:waiting_for_photo", data, budget)
+
+    assert compacted == {"executors_list": [1, 2, 3], "address_text": "Тюмень"}
+    assert fsm_data_size(compacted) <= budget
+    # Исходный словарь не меняется
+    assert "photo_ids" in data
+
+
+def test_over_budget_without_transient_keys_resets_data():
+    data = {"address_text": "Т" * 1000}
+    assert compact_fsm_data("OrderStates:waiting_for_address", data, 100) == {}
+
+
+def test_zero_budget_disables_limit():
+    data = {"address_text": "Т" * 1000}
+    assert compact_fsm_data("OrderStates:waiting_for_address", data, 0) is data
+
+
+def test_state_ttl_by_group():
+    assert state_ttl("OrderStates:choosing_cleaning_type") == datetime.timedelta(days=2)
+    assert state_ttl("ExecutorWorkAreaStates:choosing_service_radius") == datetime.timedelta(hours=12)
+    assert state_ttl("UnknownStates:step") == DEFAULT_STATE_TTL
+    assert state_ttl(None) == DEFAULT_STATE_TTL
@@ -0,0 +1,69 @@
+import random
+from types import SimpleNamespace
+
+from app.services.geo_index import (DEFAULT_SERVICE_RADIUS_KM, MAX_SERVICE_RADIUS_KM, ExecutorGeoIndex, distance_km,
+                                    effective_radius_km)
+
+# Центр Тюмени
+CENTER = (57.153, 65.534)
+
+
+def _executor(telegram_id: int, priority: int = 0, rating: float = 0.0, radius_km: float | None = None):
+    return SimpleNamespace(telegram_id=telegram_id, priority=priority, average_rating=rating, review_count=0,
+                           service_radius_km=radius_km)
+
+
+def test_effective_radius_defaults_and_clamps():
+    assert effective_radius_km(None) == DEFAULT_SERVICE_RADIUS_KM
+    assert effective_radius_km(0) == DEFAULT_SERVICE_RADIUS_KM
+    assert effective_radius_km(5) == 5
+    assert effective_radius_km(500) == MAX_SERVICE_RADIUS_KM
+
+
+def test_nearby_matches_full_scan():
+    rng = random.Random(7)
+    index = ExecutorGeoIndex()
+    bases = {}
+    for telegram_id in range(300):
+        lat = CENTER[0] + rng.uniform(-0.8, 0.8)
+        lon = CENTER[1] + rng.uniform(-1.5, 1.5)
+        radius = rng.choice((3, 5, 10, 15, 25, 50, None))
+        index.upsert(telegram_id, lat, lon, radius)
+        bases[telegram_id] = (lat, lon, effective_radius_km(radius))
+
+    for _ in range(50):
+        lat = CENTER[0] + rng.uniform(-0.5, 0.5)
+        lon = CENTER[1] + rng.uniform(-1.0, 1.0)
+        expected = {
+            telegram_id for telegram_id, (base_lat, base_lon, radius) in bases.items()
+            # Небольшой допуск: индекс считает масштаб долготы по широте заказа, а не по средней широте
+            if distance_km(base_lat, base_lon, lat, lon) <= radius * 0.99
+        }
+        found = index.nearby(lat, lon)
+        assert expected <= set(found)
+        for telegram_id, distance in found.items():
+            assert distance <= bases[telegram_id][2]
+
+
+def test_upsert_moves_and_remove_forgets_executor():
+    index = ExecutorGeoIndex()
+    index.upsert(1, *CENTER, 5)
+    index.upsert(1, CENTER[0] + 1, CENTER[1], 5)
+    assert len(index) == 1
+    assert 1 not in index.nearby(*CENTER)
+    index.remove(1)
+    assert not index.contains(1)
+    assert index.nearby(CENTER[0] + 1, CENTER[1]) == {}
+
+
+def test_rank_excludes_out_of_radius_and_prefers_closer():
+    index = ExecutorGeoIndex()
+    index.upsert(1, CENTER[0] + 0.01, CENTER[1], 10)  # ~1 км
+    index.upsert(2, CENTER[0] + 0.05, CENTER[1], 10)  # ~5.5 км
+    index.upsert(3, CENTER[0] + 0.5, CENTER[1], 10)  # ~55 км, заказ вне радиуса
+    executors = [_executor(3, radius_km=10), _executor(2, radius_km=10), _executor(1, radius_km=10), _executor(4)]
+
+    ranked = [executor.telegram_id for executor in index.rank(executors, *CENTER)]
+
+    # Исполнитель 4 без базы остается, но без бонуса за близость
+    assert ranked == [1, 2, 4]
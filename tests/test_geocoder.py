@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+
+from app.services.geocoder import CircuitBreaker, GeocoderGateway, GeocoderUnavailable
+
+
+def _expire(breaker: CircuitBreaker):
+    """Сдвигает момент размыкания так, будто reset_timeout уже прошел."""
+    breaker.opened_at -= breaker.reset_timeout
+
+
+class FakeBackend:
+    def __init__(self, result: str | None = "Тюмень", error: Exception | None = None, delay: float = 0.0):
+        self.result = result
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def geocode(self, query: str) -> str | None:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    async def close(self):
+        pass
+
+
+def test_breaker_opens_after_threshold_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_allows_single_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_failed_trial_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+
+def test_successful_trial_closes_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_released_trial_can_be_retried():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow_request()
+    breaker.release_trial()
+    assert breaker.allow_request()
+
+
+def test_gateway_rejects_without_calling_backend_when_open():
+    backend = FakeBackend(error=GeocoderUnavailable("нет сети"))
+    gateway = GeocoderGateway(backend, deadline=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30))
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(GeocoderUnavailable):
+                await gateway.lookup("адрес", "адрес")
+
+    asyncio.run(scenario())
+    assert backend.calls == 2
+    assert gateway.rejected == 1
+    assert gateway.stats()["breaker_state"] == "open"
+
+
+def test_gateway_counts_timeout_as_failure():
+    backend = FakeBackend(delay=1)
+    gateway = GeocoderGateway(backend, deadline=0.01, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=30))
+
+    async def scenario():
+        with pytest.raises(GeocoderUnavailable):
+            await gateway.lookup("адрес", "адрес")
+
+    asyncio.run(scenario())
+    assert gateway.failures == 1
+    assert gateway.breaker.state == "open"
+
+
+def test_gateway_coalesces_concurrent_lookups():
+    backend = FakeBackend(delay=0.01)
+    gateway = GeocoderGateway(backend, deadline=1)
+
+    async def scenario():
+        return await asyncio.gather(*(gateway.lookup("адрес", "адрес") for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["Тюмень"] * 5
+    assert backend.calls == 1
+    assert gateway.coalesced == 4
+
+
+def test_cancelled_lookup_releases_trial_and_fails_waiters():
+    backend = FakeBackend(delay=1)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    _expire(breaker)
+    gateway = GeocoderGateway(backend, deadline=5, breaker=breaker)
+
+    async def scenario():
+        leader = asyncio.create_task(gateway.lookup("адрес", "адрес"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(gateway.lookup("адрес", "адрес"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        with pytest.raises(GeocoderUnavailable):
+            await waiter
+
+    asyncio.run(scenario())
+    # Прерванный пробный запрос не считается ошибкой и не занимает пробное окно
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+
+
+def test_unexpected_backend_error_counts_as_failure_and_frees_trial():
+    backend = FakeBackend(error=KeyError("response"))
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    _expire(breaker)
+    gateway = GeocoderGateway(backend, deadline=1, breaker=breaker)
+
+    async def scenario():
+        with pytest.raises(KeyError):
+            await gateway.lookup("адрес", "адрес")
+
+    asyncio.run(scenario())
+    assert gateway.failures == 1
+    assert breaker.state == "open"
+    _expire(breaker)
+    assert breaker.allow_request()
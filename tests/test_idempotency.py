@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.services import idempotency
+from app.services.idempotency import IdempotencyCache
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(idempotency)
+
+
+def test_repeat_within_ttl_is_duplicate(clock):
+    cache = IdempotencyCache(ttl=10)
+    keys = [("callback", "42")]
+    assert cache.lookup(keys) is None
+    cache.remember(keys)
+    clock.now += 9.9
+    assert cache.lookup(keys) is not None
+    assert cache.stats()["duplicates"] == 1
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = IdempotencyCache(ttl=10)
+    keys = [("callback", "42")]
+    cache.remember(keys)
+    clock.now += 10
+    assert cache.lookup(keys) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_any_key_matches(clock):
+    cache = IdempotencyCache(ttl=10)
+    cache.remember([("callback", "1"), ("button", 7, 100, 55, "accept_1")])
+    # Повторное нажатие той же кнопки приходит с новым id колбэка
+    assert cache.lookup([("callback", "2"), ("button", 7, 100, 55, "accept_1")]) is not None
+
+
+def test_forget_allows_retry_after_error(clock):
+    cache = IdempotencyCache(ttl=10)
+    keys = [("callback", "42"), ("button", 7, 100, 55, "accept_1")]
+    cache.remember(keys)
+    cache.forget(keys)
+    assert cache.lookup(keys) is None
+
+
+def test_oldest_entries_are_evicted_over_limit(clock):
+    cache = IdempotencyCache(ttl=10, max_entries=3)
+    for i in range(5):
+        cache.remember([("callback", str(i))])
+    assert cache.stats()["entries"] == 3
+    assert cache.lookup([("callback", "0")]) is None
+    assert cache.lookup([("callback", "4")]) is not None
+
+
+def test_duplicate_gets_recorded_answer(clock):
+    cache = IdempotencyCache(ttl=10)
+    keys = [("callback", "42")]
+    cache.remember(keys, callback_id="42")
+    cache.record_answer("42", "Заказ принят", None)
+    cache.finish("42")
+    # Ответ, записанный после завершения обработки, уже не привязывается
+    cache.record_answer("42", "Другой ответ", True)
+    assert cache.lookup(keys).answer == ("Заказ принят", False)
+
+
+def test_middleware_forgets_update_when_handler_fails():
+    pytest.importorskip("aiogram")
+    from types import SimpleNamespace
+
+    from aiogram.types import CallbackQuery, User
+
+    from app.middlewares.idempotency_middleware import IdempotencyMiddleware
+
+    cache = IdempotencyCache(ttl=10)
+    middleware = IdempotencyMiddleware(cache)
+    user = User(id=100, is_bot=False, first_name="Анна")
+    calls = []
+
+    async def failing_handler(event, data):
+        calls.append(event.id)
+        raise RuntimeError("ошибка БД")
+
+    async def handler(event, data):
+        calls.append(event.id)
+        return "ok"
+
+    async def scenario():
+        data = {"bot": SimpleNamespace(id=7)}
+        event = CallbackQuery(id="42", from_user=user, chat_instance="1", data="accept_1")
+        with pytest.raises(RuntimeError):
+            await middleware(failing_handler, event, data)
+        return await middleware(handler, event, data)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert calls == ["42", "42"]
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from app.services.job_coordinator import JobCoordinator, job_lock_id
+
+
+async def sample_job(events: list, delay: float = 0.0):
+    events.append("start")
+    await asyncio.sleep(delay)
+    events.append("end")
+    return "done"
+
+
+def test_lock_id_is_stable_signed_bigint():
+    assert job_lock_id("app.scheduler.check_expired_offers") == job_lock_id("app.scheduler.check_expired_offers")
+    assert job_lock_id("a") != job_lock_id("b")
+    assert -2 ** 63 <= job_lock_id("a") < 2 ** 63
+
+
+def test_disabled_coordinator_runs_job_directly():
+    coordinator = JobCoordinator(engine=None, enabled=False)
+    job = coordinator.exclusive(sample_job)
+    events = []
+
+    assert asyncio.run(job(events)) == "done"
+    assert events == ["start", "end"]
+    assert job.__name__ == "sample_job"
+
+
+def test_drain_waits_for_running_jobs():
+    coordinator = JobCoordinator(engine=None, enabled=False)
+    job = coordinator.exclusive(sample_job)
+    events = []
+
+    async def scenario():
+        task = asyncio.create_task(job(events, 0.05))
+        await asyncio.sleep(0)
+        assert coordinator.stats()["running"] == 1
+        left = await coordinator.drain(timeout=1)
+        await task
+        return left
+
+    assert asyncio.run(scenario()) == 0
+    assert events == ["start", "end"]
+    assert coordinator.stats()["running"] == 0
+
+
+def test_drain_reports_jobs_that_did_not_finish():
+    coordinator = JobCoordinator(engine=None, enabled=False)
+    job = coordinator.exclusive(sample_job)
+
+    async def scenario():
+        task = asyncio.create_task(job([], 1))
+        await asyncio.sleep(0)
+        left = await coordinator.drain(timeout=0.01)
+        task.cancel()
+        return left
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_cancelled_caller_does_not_interrupt_job():
+    # Остановка планировщика отменяет ожидающего, но сама задача доходит до конца
+    coordinator = JobCoordinator(engine=None, enabled=False)
+    job = coordinator.exclusive(sample_job)
+    events = []
+
+    async def scenario():
+        caller = asyncio.create_task(job(events, 0.02))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await coordinator.drain(timeout=1)
+
+    asyncio.run(scenario())
+    assert events == ["start", "end"]
+
+
+def test_disabled_lock_is_always_acquired():
+    coordinator = JobCoordinator(engine=None, enabled=False)
+
+    async def scenario():
+        async with coordinator.lock("batch") as first, coordinator.lock("batch") as second:
+            return first, second
+
+    assert asyncio.run(scenario()) == (True, True)
+
+
+def test_named_lock_is_held_by_one_replica(run_db):
+    async def scenario(session_pool):
+        engine = session_pool.kw["bind"]
+        first, second = JobCoordinator(engine, enabled=True), JobCoordinator(engine, enabled=True)
+        async with first.lock("batch") as acquired:
+            async with second.lock("batch") as acquired_by_other:
+                held = (acquired, acquired_by_other)
+        # После выхода из блока блокировка снята
+        async with second.lock("batch") as acquired_after:
+            return held, acquired_after
+
+    assert run_db(scenario) == ((True, False), True)
+
+
+def test_only_one_replica_runs_job(run_db):
+    async def scenario(session_pool):
+        engine = session_pool.kw["bind"]
+        # Две копии бота с общей базой
+        replicas = [JobCoordinator(engine, enabled=True) for _ in range(2)]
+        events = []
+        results = await asyncio.gather(*(replica.exclusive(sample_job)(events, 0.2) for replica in replicas))
+        return results, events, [replica.stats() for replica in replicas]
+
+    results, events, stats = run_db(scenario)
+    assert sorted(results, key=str) == ["done", None]
+    assert events == ["start", "end"]
+    name = f"{__name__}.sample_job"
+    assert sum(replica["runs"].get(name, 0) for replica in stats) == 1
+    assert sum(replica["skipped"].get(name, 0) for replica in stats) == 1
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+from app.services.occupancy import OccupancyIndex
+
+
+def test_occupy_marks_only_that_slot_busy():
+    index = OccupancyIndex()
+    index.occupy(10, 1, "2025-06-02", "10:00-12:00")
+    assert index.is_busy(1, "2025-06-02", "10:00-12:00")
+    assert not index.is_busy(1, "2025-06-02", "12:00-14:00")
+    assert not index.is_busy(1, "2025-06-03", "10:00-12:00")
+    assert not index.is_busy(2, "2025-06-02", "10:00-12:00")
+    assert len(index) == 1
+
+
+def test_reschedule_frees_previous_slot():
+    index = OccupancyIndex()
+    index.occupy(10, 1, "2025-06-02", "10:00-12:00")
+    index.occupy(10, 1, "2025-06-03", "14:00-16:00")
+    assert not index.is_busy(1, "2025-06-02", "10:00-12:00")
+    assert index.is_busy(1, "2025-06-03", "14:00-16:00")
+    assert len(index) == 1
+
+
+def test_release_is_idempotent():
+    index = OccupancyIndex()
+    index.occupy(10, 1, "2025-06-02", "10:00-12:00")
+    index.release(10)
+    index.release(10)
+    index.release(99)
+    assert not index.is_busy(1, "2025-06-02", "10:00-12:00")
+    assert len(index) == 0
+
+
+def test_release_of_stale_order_keeps_new_owner():
+    # Слот перешел к другому заказу: освобождение старого заказа не должно освободить слот
+    index = OccupancyIndex()
+    index.occupy(10, 1, "2025-06-02", "10:00-12:00")
+    index.occupy(11, 1, "2025-06-02", "10:00-12:00")
+    index.release(10)
+    assert index.is_busy(1, "2025-06-02", "10:00-12:00")
+    index.release(11)
+    assert not index.is_busy(1, "2025-06-02", "10:00-12:00")
+
+
+def test_load_replaces_contents():
+    index = OccupancyIndex()
+    index.occupy(1, 1, "2025-06-01", "08:00-10:00")
+    index.load([
+        SimpleNamespace(order_id=10, executor_tg_id=1, scheduled_date="2025-06-02", slot="10:00-12:00"),
+        SimpleNamespace(order_id=11, executor_tg_id=2, scheduled_date="2025-06-02", slot="10:00-12:00"),
+    ])
+    assert len(index) == 2
+    assert not index.is_busy(1, "2025-06-01", "08:00-10:00")
+    assert index.is_busy(1, "2025-06-02", "10:00-12:00")
+    assert index.is_busy(2, "2025-06-02", "10:00-12:00")
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import price_calculator
+from app.services.price_calculator import TARIFFS, PricingEngine, calculate_executor_payment
+
+SERVICE_PRICES = {"win": 300, "sofa": 1500}
+
+
+@pytest.fixture
+def engine() -> PricingEngine:
+    return PricingEngine(TARIFFS, SERVICE_PRICES, "percent", 15.0)
+
+
+@pytest.mark.parametrize("cleaning_type, rooms, bathrooms, expected", [
+    ("🧽 Поддерживающая", "1", "1", 1000),
+    ("🧽 Поддерживающая", "3", "2", 1000 + 2 * 500 + 300),
+    ("🧼 Генеральная", "5+", "3+", 1500 + 4 * 700 + 2 * 500),
+    ("🛠 После ремонта", "2", "1", 2000 + 1000),
+])
+def test_quote_follows_tariff_formula(engine, cleaning_type, rooms, bathrooms, expected):
+    assert engine.quote(cleaning_type, rooms, bathrooms) == expected
+
+
+@pytest.mark.parametrize("cleaning_type, rooms, bathrooms", [
+    ("Неизвестная уборка", "1", "1"),
+    ("🧼 Генеральная", "много", "1"),
+    ("🧼 Генеральная", "1", ""),
+])
+def test_quote_unknown_options_cost_nothing(engine, cleaning_type, rooms, bathrooms):
+    assert engine.quote(cleaning_type, rooms, bathrooms) == 0
+
+
+def test_services_cost_multiplies_quantity_and_ignores_unknown(engine):
+    assert engine.services_cost(None) == 0
+    assert engine.services_cost({"win": 3, "sofa": 1, "removed": 2}) == 3 * 300 + 1500
+
+
+def test_quote_many_matches_single_quotes(engine):
+    orders = [
+        ("🧼 Генеральная", "2", "1", {"win": 2}),
+        ("🧽 Поддерживающая", "4", "2", None),
+        ("Неизвестная уборка", "1", "1", {"sofa": 1}),
+    ]
+    expected = [engine.quote(t, r, b) + engine.services_cost(s) for t, r, b, s in orders]
+    assert engine.quote_many(orders) == expected == [2800, 2800, 1500]
+
+
+def test_engine_is_immutable_snapshot_of_tariffs():
+    tariffs = {name: dict(tariff) for name, tariff in TARIFFS.items()}
+    engine = PricingEngine(tariffs, SERVICE_PRICES)
+    tariffs["🧼 Генеральная"]["base"] = 0
+    assert engine.quote("🧼 Генеральная", "1", "1") == 1500
+    with pytest.raises(TypeError):
+        engine.tariffs["🧼 Генеральная"]["base"] = 0
+
+
+@pytest.mark.parametrize("commission_type, commission_value, expected", [
+    ("percent", 15.0, 2550.0),
+    ("fixed", 500.0, 2500.0),
+    ("fixed", 5000.0, 0),
+    (None, 15.0, 3000.0),
+])
+def test_executor_payment(commission_type, commission_value, expected):
+    assert calculate_executor_payment(3000, commission_type, commission_value) == expected
+
+
+def test_rebuild_swaps_current_engine(monkeypatch):
+    monkeypatch.setattr(price_calculator, "_engine", price_calculator.get_pricing_engine())
+    tariffs = {"🧽 Поддерживающая": {"base": 1200, "per_room": 600, "per_bathroom": 400}}
+    system = SimpleNamespace(tariffs=tariffs, commission_type="fixed", commission_value=100.0)
+    previous = price_calculator.get_pricing_engine()
+
+    engine = price_calculator.rebuild_pricing_engine(system)
+
+    assert engine is price_calculator.get_pricing_engine() is not previous
+    assert price_calculator.calculate_preliminary_cost("🧽 Поддерживающая", "2", "1") == 1800
+    assert engine.executor_payment(1800) == 1700.0
+    # Ранее выданный расчетчик продолжает считать по старым тарифам
+    assert previous.quote("🧽 Поддерживающая", "2", "1") == 1500
@@ -0,0 +1,73 @@
+import pytest
+
+from app.services import throttling
+from app.services.throttling import CLEANUP_EVERY, ROUTE_DEFAULT, ROUTE_EXPENSIVE, RateLimiter
+
+BUDGETS = {ROUTE_DEFAULT: (5, 30), ROUTE_EXPENSIVE: (1, 10)}
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(throttling)
+
+
+def test_burst_is_allowed_then_throttled(clock):
+    limiter = RateLimiter(BUDGETS)
+    assert all(limiter.hit(1, ROUTE_DEFAULT) == (True, False) for _ in range(30))
+    assert limiter.hit(1, ROUTE_DEFAULT) == (False, True)
+    assert limiter.stats() == {ROUTE_DEFAULT: {"allowed": 30, "throttled": 1}}
+
+
+def test_warns_only_on_first_rejection_in_a_row(clock):
+    limiter = RateLimiter(BUDGETS)
+    for _ in range(10):
+        limiter.hit(1, ROUTE_EXPENSIVE)
+    assert limiter.hit(1, ROUTE_EXPENSIVE) == (False, True)
+    assert limiter.hit(1, ROUTE_EXPENSIVE) == (False, False)
+    clock.now += 1
+    assert limiter.hit(1, ROUTE_EXPENSIVE) == (True, False)
+    # После успешного запроса предупреждение снова показывается
+    assert limiter.hit(1, ROUTE_EXPENSIVE) == (False, True)
+
+
+def test_tokens_refill_at_rate_up_to_burst(clock):
+    limiter = RateLimiter(BUDGETS)
+    for _ in range(10):
+        limiter.hit(1, ROUTE_EXPENSIVE)
+    clock.now += 3.5
+    assert [limiter.hit(1, ROUTE_EXPENSIVE)[0] for _ in range(4)] == [True, True, True, False]
+
+    # Долгий простой не копит больше размера корзины
+    clock.now += 3600
+    assert sum(limiter.hit(1, ROUTE_EXPENSIVE)[0] for _ in range(20)) == 10
+
+
+def test_buckets_are_per_user_and_route(clock):
+    limiter = RateLimiter(BUDGETS)
+    for _ in range(10):
+        limiter.hit(1, ROUTE_EXPENSIVE)
+    assert not limiter.hit(1, ROUTE_EXPENSIVE)[0]
+    assert limiter.hit(1, ROUTE_DEFAULT)[0]
+    assert limiter.hit(2, ROUTE_EXPENSIVE)[0]
+
+
+def test_unknown_route_uses_default_budget(clock):
+    limiter = RateLimiter(BUDGETS)
+    assert sum(limiter.hit(1, "reports")[0] for _ in range(40)) == 30
+
+
+def test_cleanup_drops_only_full_buckets(clock):
+    limiter = RateLimiter(BUDGETS)
+    for _ in range(10):
+        limiter.hit(1, ROUTE_EXPENSIVE)
+    clock.now += 1
+    # Остальные пользователи сделали по одному запросу и к моменту очистки успели накопить полную корзину
+    for user_id in range(2, CLEANUP_EVERY - 9):
+        limiter.hit(user_id, ROUTE_DEFAULT)
+    clock.now += 1
+    # CLEANUP_EVERY-й вызов запускает очистку
+    limiter.hit(CLEANUP_EVERY, ROUTE_DEFAULT)
+
+    assert set(limiter._buckets) == {(1, ROUTE_EXPENSIVE), (CLEANUP_EVERY, ROUTE_DEFAULT)}
+    # Неполная корзина сохранила свое состояние
+    assert [limiter.hit(1, ROUTE_EXPENSIVE)[0] for _ in range(3)] == [True, True, False]